@@ -0,0 +1,303 @@
+import abc
+import os
+import select
+import stat
+import sys
+import threading
+import typing
+import wave
+
+import numpy
+
+import effects
+
+# files and directories the audio program may read from, - for stdin, set from the audio_sources of the config
+allowed_sources: list[str] = []
+
+# the reading thread checks this often whether its source was closed, it never blocks the closing event loop
+CLOSE_INTERVAL = 0.1
+
+
+class PcmSource(abc.ABC):
+    sample_rate: int = 44100
+
+    @abc.abstractmethod
+    def read(self, count: int) -> numpy.ndarray:
+        pass
+
+    def close(self):
+        pass
+
+
+class WaveSource(PcmSource):
+    # reads exactly the requested number of samples, so a file is played in real time if read once per frame
+    def __init__(self, path: str, loop: bool = True):
+        self._file = wave.open(path, 'rb')  # pylint: disable=consider-using-with
+        if self._file.getsampwidth() != 2:
+            self._file.close()
+            raise ValueError(f'{path} has to contain 16 bit PCM samples')
+
+        self.sample_rate = self._file.getframerate()
+        self.channels = self._file.getnchannels()
+        self.loop = loop
+        self._samples = numpy.zeros(0, dtype=numpy.float32)
+
+    def read(self, count: int) -> numpy.ndarray:
+        if len(self._samples) < count:
+            self._samples = numpy.zeros(count, dtype=numpy.float32)
+
+        data = self._file.readframes(count)
+        if len(data) < count * 2 * self.channels and self.loop:
+            self._file.rewind()
+            data += self._file.readframes(count - len(data) // (2 * self.channels))
+
+        frames = numpy.frombuffer(data, dtype='<i2').reshape(-1, self.channels)
+        samples = self._samples[:len(frames)]
+        if self.channels > 1:
+            numpy.mean(frames, axis=1, out=samples)
+        else:
+            numpy.copyto(samples, frames[:, 0])
+        samples *= 1 / 32768
+        return samples
+
+    def close(self):
+        self._file.close()
+
+
+class StreamSource(PcmSource):
+    # raw signed 16 bit little endian PCM from a pipe or stdin, read by a thread so rendering never blocks
+    def __init__(self, stream: typing.Union[typing.BinaryIO, str], sample_rate: int = 44100, channels: int = 1,
+                 chunk_size: int = 512, buffer_size: int = 16384):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.chunk_size = chunk_size
+
+        # a path is opened by the thread, opening a pipe waits until its writer is connected
+        self._path = stream if isinstance(stream, str) else None
+        self._stream = None if self._path else stream
+        self._chunk = bytearray(chunk_size * 2 * channels)
+        self._samples = numpy.zeros(chunk_size, dtype=numpy.float32)
+        self._buffer = numpy.zeros(buffer_size, dtype=numpy.float32)
+        self._output = numpy.zeros(buffer_size, dtype=numpy.float32)
+        self._written = 0
+        self._read = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.on_input: typing.Optional[typing.Callable[[], None]] = None
+        self._thread = threading.Thread(target=self._read_stream, name='audio input', daemon=True)
+        self._thread.start()
+
+    def _read_stream(self):
+        if self._path:
+            try:
+                self._stream = open(self._path, 'rb')  # pylint: disable=consider-using-with
+            except OSError as error:
+                print(f'Audio input {self._path}: {error}')
+                return
+
+        # the thread owns the stream and closes it, a read waits at most CLOSE_INTERVAL, so closing never waits
+        # for the writer
+        try:
+            while not self._closed and self._read_chunk():
+                if on_input := self.on_input:
+                    on_input()
+        except OSError as error:
+            print(f'Audio input {self._path or "stream"}: {error}')
+        finally:
+            if self._stream is not sys.stdin.buffer:
+                self._stream.close()
+
+    def _read_chunk(self) -> bool:
+        # fills the chunk from the file descriptor, False at the end of the stream or once closed
+        descriptor, chunk = self._stream.fileno(), memoryview(self._chunk)
+        filled = 0
+        while filled < len(chunk):
+            if not select.select([descriptor], [], [], CLOSE_INTERVAL)[0]:
+                if self._closed:
+                    return False
+                continue
+            received = os.readv(descriptor, [chunk[filled:]])
+            if not received:
+                break
+            filled += received
+
+        count = filled // (2 * self.channels)
+        if count:
+            frames = numpy.frombuffer(self._chunk, dtype='<i2', count=count * self.channels).reshape(-1, self.channels)
+            samples = self._samples[:count]
+            if self.channels > 1:
+                numpy.mean(frames, axis=1, out=samples)
+            else:
+                numpy.copyto(samples, frames[:, 0])
+            samples *= 1 / 32768
+            self._store(samples)
+        return filled == len(chunk)
+
+    def _store(self, samples: numpy.ndarray):
+        size = len(self._buffer)
+        samples = samples[-size:]
+        with self._lock:
+            start = self._written % size
+            first = min(len(samples), size - start)
+            self._buffer[start:start + first] = samples[:first]
+            self._buffer[:len(samples) - first] = samples[first:]
+            self._written += len(samples)
+
+    def read(self, count: int) -> numpy.ndarray:
+        # returns all samples received since the last read, at most the size of the buffer
+        with self._lock:
+            available = min(self._written - self._read, len(self._buffer))
+            start = (self._written - available) % len(self._buffer)
+            first = min(available, len(self._buffer) - start)
+            self._output[:first] = self._buffer[start:start + first]
+            self._output[first:available] = self._buffer[:available - first]
+            self._read = self._written
+
+        return self._output[:available]
+
+    def close(self):
+        self._closed = True
+
+
+def check_source(source: str):
+    if source == '-':
+        if '-' in allowed_sources:
+            return
+    else:
+        path = os.path.realpath(source)
+        for allowed in (os.path.realpath(allowed) for allowed in allowed_sources if allowed != '-'):
+            if os.path.commonpath([path, allowed]) == allowed:
+                return
+
+    raise ValueError(f'Audio source {source} is not in the audio_sources of the config')
+
+
+def open_source(source: str) -> PcmSource:
+    # nothing is opened on the event loop which could wait for a writer, pipes are opened by the reading thread
+    check_source(source)
+    if source == '-':
+        return StreamSource(sys.stdin.buffer)
+
+    is_file = stat.S_ISREG(os.stat(source).st_mode)
+    if source.endswith('.wav'):
+        if not is_file:
+            raise ValueError(f'Audio source {source} has to be a wav file')
+        return WaveSource(source)
+
+    return StreamSource(source)
+
+
+class SpectrumAnalyzer:
+    # streaming FFT over the last window_size samples with log spaced bands, all buffers are allocated once
+    def __init__(self, sample_rate: int, bands: int, window_size: int = 1024, min_frequency: float = 40.0,
+                 max_frequency: float = 16000.0, dynamic_range: float = 40.0):
+        self.window_size = window_size
+        self.dynamic_range = dynamic_range
+
+        self._ring = numpy.zeros(window_size, dtype=numpy.float32)
+        self._position = 0
+        self._hann = numpy.hanning(window_size).astype(numpy.float32)
+        self._windowed = numpy.zeros(window_size, dtype=numpy.float32)
+        self._power = numpy.zeros(window_size // 2 + 1, dtype=numpy.float64)
+        self._energies = numpy.zeros(bands, dtype=numpy.float64)
+        self._levels = numpy.zeros(bands, dtype=numpy.float32)
+        self._peak = -numpy.inf
+
+        frequencies = numpy.fft.rfftfreq(window_size, 1 / sample_rate)
+        max_frequency = min(max_frequency, sample_rate / 2)
+        edges = numpy.geomspace(min_frequency, max_frequency, bands + 1)
+        self._weights = numpy.zeros((bands, len(frequencies)), dtype=numpy.float64)
+        for band in range(bands):
+            selected = (frequencies >= edges[band]) & (frequencies < edges[band + 1])
+            if not selected.any():  # narrow low bands get at least their nearest bin
+                selected[numpy.argmin(numpy.abs(frequencies - (edges[band] + edges[band + 1]) / 2))] = True
+            self._weights[band, selected] = 1 / selected.sum()
+
+    def push(self, samples: numpy.ndarray):
+        samples = samples[-self.window_size:]
+        count = len(samples)
+        first = min(count, self.window_size - self._position)
+        self._ring[self._position:self._position + first] = samples[:first]
+        self._ring[:count - first] = samples[first:]
+        self._position = (self._position + count) % self.window_size
+
+    def analyze(self, peak_decay: float = 0.999) -> numpy.ndarray:
+        # returns band levels between 0 and 1 relative to the recent peak
+        tail = self.window_size - self._position
+        numpy.multiply(self._ring[self._position:], self._hann[:tail], out=self._windowed[:tail])
+        numpy.multiply(self._ring[:self._position], self._hann[tail:], out=self._windowed[tail:])
+
+        numpy.abs(numpy.fft.rfft(self._windowed), out=self._power)
+        numpy.square(self._power, out=self._power)
+        numpy.matmul(self._weights, self._power, out=self._energies)
+
+        energies = self._energies
+        numpy.maximum(energies, 1e-12, out=energies)
+        numpy.log10(energies, out=energies)
+        energies *= 10
+
+        self._peak = max(self._peak - 10 * (1 - peak_decay), float(energies.max()))
+        energies -= self._peak - self.dynamic_range
+        energies *= 1 / self.dynamic_range
+        numpy.clip(energies, 0, 1, out=energies)
+        self._levels[:] = energies
+        return self._levels
+
+
+class AudioSpectrum(effects.Effect):
+    # every column shows one frequency band as a bar growing from the last row, colored along the palette
+    options = ('source',)
+
+    def __init__(self, geometry: effects.Geometry, palette: numpy.ndarray, seed: int = None, fps: float = 20.0, *,
+                 source: typing.Union[str, PcmSource] = '-', attack: float = 0.02, decay: float = 0.3):
+        super().__init__(geometry, palette, seed, fps)
+
+        self.source = open_source(source) if isinstance(source, str) else source
+        self.analyzer = SpectrumAnalyzer(self.source.sample_rate, bands=max(geometry.cols, 1))
+        self.samples_per_frame = int(round(self.source.sample_rate / fps))
+
+        self._attack = numpy.float32(1 - numpy.exp(-1 / (max(attack, 1e-3) * fps)))
+        self._decay = numpy.float32(1 - numpy.exp(-1 / (max(decay, 1e-3) * fps)))
+        self._levels = numpy.zeros(max(geometry.cols, 1), dtype=numpy.float32)
+        self._delta = numpy.zeros_like(self._levels)
+        self._rates = numpy.zeros_like(self._levels)
+
+        # height of every block counted from the bottom row and its color interpolated along the palette
+        rows = max(geometry.rows, 1)
+        self._heights = ((rows - 1 - geometry.block_rows) / rows).astype(numpy.float32)
+        steps = numpy.linspace(0, len(self.palette) - 1, rows)[rows - 1 - geometry.block_rows]
+        lower = numpy.floor(steps).astype(numpy.intp)
+        upper = numpy.minimum(lower + 1, len(self.palette) - 1)
+        mix = (steps - lower)[:, None].astype(numpy.float32)
+        self._block_colors = self.palette[lower] * (1 - mix) + self.palette[upper] * mix
+        self._blocks = numpy.zeros_like(self._block_colors)
+
+    def advance(self, frames: int):
+        # the samples of skipped frames are consumed, so the bars stay in sync with the audio
+        self.analyzer.push(self.source.read(self.samples_per_frame * frames))
+        self.frame_number += frames
+
+    def listen(self, callback: typing.Callable[[], None]) -> bool:
+        if isinstance(self.source, StreamSource):
+            self.source.on_input = callback
+            return True
+        return False
+
+    def render(self, time: float) -> numpy.ndarray:  # pylint: disable=unused-argument
+        self.analyzer.push(self.source.read(self.samples_per_frame))
+        levels = self.analyzer.analyze()
+
+        # attack/decay smoothing: fast rise, slow fall
+        numpy.subtract(levels, self._levels, out=self._delta)
+        numpy.copyto(self._rates, self._decay)
+        self._rates[self._delta > 0] = self._attack
+        self._delta *= self._rates
+        self._levels += self._delta
+
+        # a block is lit completely if the bar covers it, the topmost one partially
+        fill = numpy.clip((self._levels[self.geometry.block_cols] - self._heights) * self.geometry.rows, 0, 1)
+        numpy.multiply(self._block_colors, fill[:, None], out=self._blocks)
+        return self.geometry.expand(self._blocks)
+
+    def close(self):
+        self.source.close()
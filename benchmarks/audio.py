@@ -0,0 +1,97 @@
+# Measures the latency from an audio chunk written to the input pipe until the render loop of a matrix shows its frame
+# on the (mocked) strip, with the render loop woken by new input and waiting for its next frame.
+#
+#   python -m benchmarks.audio --seconds 10 --cols 10 --rows 10 --fps 30
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+import numpy
+
+import audio
+import effects
+import led_block
+import strip
+
+
+def write_chunks(path: str, chunk_size: int, fps: float, seconds: float, written: list):
+    # a chunk per frame in real time, like a sound card, starting half way between two frames of the render loop
+    times = numpy.arange(chunk_size) / 44100
+    with open(path, 'wb') as pipe:
+        started = time.monotonic() + 0.5 / fps
+        for index in range(int(seconds * fps)):
+            time.sleep(max(started + index / fps - time.monotonic(), 0))
+            frequency = 100 * 2 ** (index % 70 / 10)
+            chunk = (numpy.sin(2 * numpy.pi * frequency * times) * 16000).astype('<i2').tobytes()
+            written.append(time.monotonic())
+            pipe.write(chunk)
+            pipe.flush()
+
+
+async def measure(path: str, matrix: led_block.LedMatrix, chunk_size: int, seconds: float) -> numpy.ndarray:
+    # the time a frame is shown with the number of samples it has read
+    shown = []
+    effect = audio.AudioSpectrum(matrix.geometry, numpy.array([[0, 255, 0], [255, 0, 0]]), fps=matrix.fps,
+                                 source=audio.StreamSource(path, chunk_size=chunk_size))
+    written = []
+    writer = threading.Thread(target=write_chunks, args=(path, chunk_size, matrix.fps, seconds, written))
+
+    def on_frame(_):
+        shown.append((time.monotonic(), effect.source._read))  # pylint: disable=protected-access
+
+    strip.frame_listeners.append(on_frame)
+    try:
+        matrix._is_running = True  # pylint: disable=protected-access
+        task = asyncio.create_task(matrix._run_effect(effect))  # pylint: disable=protected-access
+        writer.start()
+        while writer.is_alive():
+            await asyncio.sleep(0.1)
+        matrix._is_running = False  # pylint: disable=protected-access
+        await task
+    finally:
+        strip.frame_listeners.remove(on_frame)
+
+    # every chunk against the first frame which has read it
+    times, read = numpy.array(shown).T
+    first = numpy.searchsorted(read, (numpy.arange(len(written)) + 1) * chunk_size)
+    valid = first < len(times)
+    return (times[first[valid]] - numpy.array(written)[valid]) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency from audio chunk to strip output')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--cols', type=int, default=10)
+    parser.add_argument('--leds-per-block', type=int, default=6)
+    parser.add_argument('--fps', type=float, default=30.0)
+    arguments = parser.parse_args()
+
+    size = arguments.leds_per_block
+    blocks = [[led_block.LedBlock(start=(row * arguments.cols + col) * size,
+                                  end=(row * arguments.cols + col + 1) * size)
+               for col in range(arguments.cols)] for row in range(arguments.rows)]
+    chunk_size = int(44100 / arguments.fps)
+
+    print(f'{"render loop":22} {"median ms":>10} {"p99 ms":>10} {"max ms":>10}')
+    for name in ('woken by input', 'waiting for its frame'):
+        if name == 'waiting for its frame':
+            audio.AudioSpectrum.listen = effects.Effect.listen
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'input')
+            os.mkfifo(path)
+            matrix = led_block.LedMatrix(strip_obj=strip.Strip(count=arguments.rows * arguments.cols * size),
+                                         name='audio', fps=arguments.fps, rows=arguments.rows, cols=arguments.cols,
+                                         blocks=blocks)
+            latencies = asyncio.run(measure(path, matrix, chunk_size, arguments.seconds))
+
+        print(f'{name:22} {numpy.median(latencies):10.2f} {numpy.percentile(latencies, 99):10.2f} '
+              f'{latencies.max():10.2f}')
+
+
+if __name__ == '__main__':
+    main()
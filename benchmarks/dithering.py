@@ -0,0 +1,70 @@
+# Measures the cost of the output path per frame with 8 bit frames, rounded float frames and dithered float frames,
+# and how exact a low level fade is shown on average over a second.
+#
+#   python -m benchmarks.dithering --counts 571 5000 --frames 1000
+import argparse
+import time
+
+import numpy
+
+import strip
+
+
+def time_frames(output: strip.Strip, frames: list[numpy.ndarray], convert: bool) -> numpy.ndarray:
+    # like LedMatrix._show_frame, without showing the frame
+    indices = numpy.arange(output.count)
+    times = []
+    for frame in frames:
+        started = time.perf_counter()
+        if convert:
+            frame = numpy.clip(frame, 0, 255).astype(numpy.uint8)
+        output.set_pixels(indices, frame)
+        times.append(time.perf_counter() - started)
+    return numpy.array(times) * 1e6
+
+
+def level_error(output: strip.Strip, levels: numpy.ndarray, convert: bool, fps: int) -> float:
+    # mean difference between the exact output level of a color and the level shown on average over one second
+    indices = numpy.arange(output.count)
+    frame = numpy.repeat(levels[:, None], 3, axis=1).astype(numpy.float32)
+    exact = output.level_table[numpy.rint(levels * strip.LEVEL_STEPS).astype(numpy.intp)]
+
+    shown = numpy.zeros(output.count)
+    for _ in range(fps):
+        output.set_pixels(indices, numpy.clip(frame, 0, 255).astype(numpy.uint8) if convert else frame)
+        shown += output.pixels[:, 0]
+    return float(numpy.abs(shown / fps - exact).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Overhead of temporal dithering in the output path')
+    parser.add_argument('--counts', type=int, nargs='+', default=[571, 5000])
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--gamma', type=float, default=2.2)
+    parser.add_argument('--brightness', type=float, default=0.5)
+    parser.add_argument('--fps', type=int, default=30)
+    arguments = parser.parse_args()
+
+    print(f'{"LEDs":>6} {"output":10} {"median us":>10} {"p99 us":>10} {"overhead us":>12} {"level error":>12}')
+    for count in arguments.counts:
+        # a slow fade of the darkest levels, where the 8 bit steps are visible the most
+        ramp = numpy.linspace(0, 40, count, dtype=numpy.float32)
+        frames = [numpy.repeat((ramp + index / arguments.frames)[:, None], 3, axis=1)
+                  for index in range(arguments.frames)]
+
+        baseline = None
+        for name, dithering, convert in (('8 bit', False, True), ('float', False, False),
+                                         ('dithered', True, False)):
+            output = strip.Strip(count=count, gamma=arguments.gamma, brightness=arguments.brightness,
+                                 dithering=dithering)
+            times = time_frames(output, frames, convert)
+            baseline = numpy.median(times) if baseline is None else baseline
+            error = level_error(output, ramp, convert, arguments.fps)
+            output.release()
+
+            print(f'{count:6} {name:10} {numpy.median(times):10.1f} {numpy.percentile(times, 99):10.1f} '
+                  f'{numpy.median(times) - baseline:12.1f} {error:12.3f}')
+
+
+if __name__ == '__main__':
+    main()
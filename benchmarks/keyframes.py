@@ -0,0 +1,70 @@
+# Measures the time per frame of a program stepping every half second, shown smoothly by computing the colors of all
+# blocks in Python for every frame against blending the keyframes of its steps in the render loop.
+#
+#   python -m benchmarks.keyframes --blocks 50 1000 --fps 60 --seconds 5
+import argparse
+import random
+import time
+
+import numpy
+
+import effects
+import keyframes
+import led_block
+
+
+def get_blocks(count: int) -> tuple[effects.Geometry, list[led_block.LedBlock]]:
+    geometry = effects.Geometry([[(30 * index, 30 * (index + 1)) for index in range(count)]])
+    return geometry, [led_block.LedBlock(start=30 * index, end=30 * (index + 1),
+                                         color=led_block.ColorConverter.get_random()) for index in range(count)]
+
+
+def blend_in_python(geometry: effects.Geometry, blocks: list[led_block.LedBlock], frames: int, fps: float) -> list:
+    # like the fading program, every frame mixes the colors of all blocks
+    times, previous, targets = [], [block.color for block in blocks], [block.color for block in blocks]
+    for frame in range(frames):
+        started = time.perf_counter()
+        if frame % round(fps / 2) == 0:
+            previous, targets = targets, [led_block.ColorConverter.get_random() for _ in blocks]
+        share = frame % round(fps / 2) / round(fps / 2)
+        for block, first, second in zip(blocks, previous, targets):
+            block.color = first.get_mixed_color(second, share)
+        colors = numpy.array([block.color.as_tuple for block in blocks], dtype=numpy.float32)
+        geometry.expand(colors)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def blend_keyframes(geometry: effects.Geometry, blocks: list[led_block.LedBlock], frames: int, fps: float) -> list:
+    # the program sets its blocks once per step, the render loop samples the track every frame
+    times, track = [], keyframes.KeyframeTrack()
+    for frame in range(frames):
+        started = time.perf_counter()
+        if frame % round(fps / 2) == 0:
+            for block in blocks:
+                block.color = led_block.ColorConverter.get_random()
+            colors = numpy.array([block.color.as_tuple for block in blocks], dtype=numpy.float32)
+            track.add(colors, frame / fps + 0.5, keyframes.Easing.EASE_IN_OUT)
+        geometry.expand(track.sample(frame / fps))
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time per frame of smooth block programs')
+    parser.add_argument('--blocks', type=int, nargs='+', default=[50, 1000])
+    parser.add_argument('--fps', type=float, default=60)
+    parser.add_argument('--seconds', type=float, default=5)
+    arguments = parser.parse_args()
+
+    random.seed(1)
+    frames = round(arguments.seconds * arguments.fps)
+    print(f'{"blocks":>7} {"blended":10} {"mean ms":>9} {"p99 ms":>9}')
+    for count in arguments.blocks:
+        for name, blend in (('in python', blend_in_python), ('keyframes', blend_keyframes)):
+            times = numpy.array(blend(*get_blocks(count), frames, arguments.fps)) * 1e3
+            print(f'{count:7} {name:10} {numpy.mean(times):9.3f} {numpy.percentile(times, 99):9.3f}')
+
+
+if __name__ == '__main__':
+    main()
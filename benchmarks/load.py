@@ -0,0 +1,215 @@
+# Load test of the web interface while programs render on the timing accurate mock strip.
+# The server runs in a child process like in production, the clients are asyncio tasks of this process.
+#
+#   python -m benchmarks.load --dashboards 10 --controllers 2 --duration 20
+import argparse
+import asyncio
+import json
+import random
+import signal
+import subprocess
+import sys
+import time
+
+import numpy
+
+EFFECT_PROGRAMS = ('twinkle', 'sparkle', 'random_decay')
+COLORS = ('red', 'green', 'blue', 'yellow', 'white')
+
+
+def run_child(port: int, config_file: str):
+    # pylint: disable=import-outside-toplevel
+    import uvicorn
+
+    import controller
+    import led_block
+    import strip
+    from rpi_mock import neopixel
+
+    neopixel.NeoPixel.timing_accurate = True
+    frames: dict[str, list[float]] = {}
+    strip.frame_listeners.append(lambda shown: frames.setdefault(shown.identifier, []).append(time.time()))
+
+    controller.DataInitialize.config_file = config_file
+    uvicorn.Server(uvicorn.Config(controller.app, host='127.0.0.1', port=port, log_level='warning')).run()
+
+    # with several matrices on one strip the frames of all of them are counted, the fastest one is the nominal rate
+    fps = {}
+    for matrix in led_block.known_blocks.values():
+        if matrix.strip_name in frames:
+            fps[matrix.strip_name] = max(fps.get(matrix.strip_name, 0), matrix.fps)
+    print(json.dumps({'frames': frames, 'fps': fps}), flush=True)
+
+
+class Connection:
+    # minimal keep alive HTTP/1.1 client, responses are read completely but not parsed
+    def __init__(self, port: int):
+        self.port = port
+        self._reader: asyncio.StreamReader = None
+        self._writer: asyncio.StreamWriter = None
+
+    async def request(self, method: str, path: str) -> int:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection('127.0.0.1', self.port)
+
+        self._writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: 0\r\n\r\n'.encode())
+        await self._writer.drain()
+
+        head = await self._reader.readuntil(b'\r\n\r\n')
+        length = 0
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                length = int(value)
+        await self._reader.readexactly(length)
+        return int(head.split(b' ', 2)[1])
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class LoadTest:
+    def __init__(self, port: int, blocks: list[str], seed: int = 0):
+        self.port = port
+        self.blocks = blocks
+        self.random = random.Random(seed)
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    async def _timed(self, connection: Connection, kind: str, method: str, path: str):
+        started = time.perf_counter()
+        try:
+            status = await connection.request(method, path)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            status = 0
+            connection.close()
+            connection._writer = None  # pylint: disable=protected-access
+
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - started)
+        if status >= 400 or status == 0:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    async def dashboard(self, block: str, poll_interval: float, until: float):
+        # like an open matrix page: loaded once, afterwards the colors are polled
+        connection = Connection(self.port)
+        await self._timed(connection, 'page', 'GET', f'/block/{block}/')
+        while time.time() < until:
+            await self._timed(connection, 'colors', 'GET', f'/block/{block}/colors/')
+            await asyncio.sleep(poll_interval)
+        connection.close()
+
+    async def controller(self, switch_interval: float, until: float):
+        connection = Connection(self.port)
+        while time.time() < until:
+            block = self.random.choice(self.blocks)
+            program = self.random.choice(EFFECT_PROGRAMS)
+            color1, color2 = self.random.sample(COLORS, 2)
+            await self._timed(connection, 'program', 'POST',
+                              f'/block/{block}/?program={program}&color1={color1}&color2={color2}'
+                              f'&seed={self.random.randrange(2 ** 31)}')
+            await asyncio.sleep(switch_interval)
+        connection.close()
+
+    async def run(self, dashboards: int, controllers: int, duration: float, poll_interval: float,
+                  switch_interval: float):
+        until = time.time() + duration
+        await asyncio.gather(
+            *(self.dashboard(self.blocks[index % len(self.blocks)], poll_interval, until)
+              for index in range(dashboards)),
+            *(self.controller(switch_interval, until) for _ in range(controllers)),
+        )
+
+
+async def wait_for_server(port: int, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def print_latencies(load: LoadTest, duration: float):
+    print(f'{"requests":10} {"count":>7} {"errors":>7} {"req/s":>7} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} '
+          f'{"max ms":>8}')
+    for kind, latencies in sorted(load.latencies.items()):
+        values = numpy.array(latencies) * 1000
+        print(f'{kind:10} {len(values):7} {load.errors.get(kind, 0):7} {len(values) / duration:7.1f} '
+              f'{numpy.percentile(values, 50):8.2f} {numpy.percentile(values, 90):8.2f} '
+              f'{numpy.percentile(values, 99):8.2f} {values.max():8.2f}')
+
+
+def print_frames(result: dict, started: float, stopped: float):
+    for strip_name, times in sorted(result['frames'].items()):
+        times = numpy.array(times)
+        times = times[(times >= started) & (times <= stopped)]
+        if len(times) < 2:
+            print(f'strip {strip_name}: {len(times)} frames during the load test')
+            continue
+
+        nominal = 1000 / result['fps'].get(strip_name, 30)
+        intervals = numpy.diff(times) * 1000
+        jitter = numpy.abs(intervals - nominal)
+        print(f'strip {strip_name}: {len(times)} frames, {len(times) / (stopped - started):.1f} fps '
+              f'(nominal {1000 / nominal:.1f}), interval p50 {numpy.percentile(intervals, 50):.2f} ms '
+              f'p99 {numpy.percentile(intervals, 99):.2f} ms max {intervals.max():.2f} ms, '
+              f'jitter p50 {numpy.percentile(jitter, 50):.2f} ms p99 {numpy.percentile(jitter, 99):.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Request latencies and frame jitter under web load')
+    parser.add_argument('--config', default='default.config.json')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--blocks', nargs='+', default=['default'])
+    parser.add_argument('--program', default='twinkle', help='program started on all blocks before the load test')
+    parser.add_argument('--dashboards', type=int, default=5, help='open matrix pages polling the colors')
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--controllers', type=int, default=1, help='clients switching programs')
+    parser.add_argument('--switch-interval', type=float, default=1.0, help='pause between program switches')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0, help='time for switching the strips on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--child', nargs=2, default=None, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        run_child(int(arguments.child[0]), arguments.child[1])
+        return
+
+    # pylint: disable=consider-using-with
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.load', '--child', str(arguments.port),
+                               arguments.config], stdout=subprocess.PIPE, text=True)
+
+    async def run() -> tuple[LoadTest, float, float]:
+        await wait_for_server(arguments.port)
+        connection = Connection(arguments.port)
+        for block in arguments.blocks:
+            await connection.request('POST', f'/block/{block}/?program={arguments.program}')
+        connection.close()
+        await asyncio.sleep(arguments.warmup)
+
+        load = LoadTest(arguments.port, arguments.blocks, arguments.seed)
+        started = time.time()
+        await load.run(arguments.dashboards, arguments.controllers, arguments.duration, arguments.poll_interval,
+                       arguments.switch_interval)
+        return load, started, time.time()
+
+    try:
+        load, started, stopped = asyncio.run(run())
+    finally:
+        server.send_signal(signal.SIGINT)
+        output, _ = server.communicate(timeout=30)
+
+    print(f'{arguments.dashboards} dashboards polling every {arguments.poll_interval} s, {arguments.controllers} '
+          f'controllers switching every {arguments.switch_interval} s, {stopped - started:.1f} s')
+    print_latencies(load, stopped - started)
+    print_frames(json.loads(output.strip().splitlines()[-1]), started, stopped)
+
+
+if __name__ == '__main__':
+    main()
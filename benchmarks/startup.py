@@ -0,0 +1,78 @@
+# Measures the time from process start to the first lit frame on the (mocked) strip.
+#
+#   python -m benchmarks.startup --runs 5 --power-settle 0.2
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_child(config_file: str):
+    import controller  # pylint: disable=import-outside-toplevel
+    import led_block  # pylint: disable=import-outside-toplevel
+    import strip  # pylint: disable=import-outside-toplevel
+
+    show = strip.Strip.update_strip
+
+    def update_strip(self):
+        show(self)
+        if self.pixels.any():
+            print(time.time(), flush=True)
+            os._exit(0)  # pylint: disable=protected-access
+
+    strip.Strip.update_strip = update_strip
+    controller.DataInitialize.config_file = config_file
+
+    async def start():
+        await controller.DataInitialize.initialize()
+        matrix = next(iter(led_block.known_blocks.values()))
+        await matrix.run_program(led_block.BlockProgram.FIXED, colors=[led_block.Color(red=255)])
+        await asyncio.sleep(30)
+
+    asyncio.run(start())
+
+
+def measure(config_file: str) -> float:
+    started = time.time()
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child', config_file],
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1]) - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time from process start to the first lit frame')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--config', default='default.config.json')
+    parser.add_argument('--power-settle', type=float, default=None, help='override power_settle of all strips')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        run_child(arguments.child)
+        return
+
+    with open(os.path.join('config', arguments.config), 'r', encoding='utf-8') as data:
+        config = json.load(data)
+    if arguments.power_settle is not None:
+        for strip_data in config['strips']:
+            strip_data['power_settle'] = arguments.power_settle
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, arguments.config)
+        with open(config_file, 'w', encoding='utf-8') as data:
+            json.dump(config, data)
+
+        results = [measure(config_file) for _ in range(arguments.runs)]
+
+    print(f'first run (compiling the layout): {results[0] * 1000:8.1f} ms')
+    if len(results) > 1:
+        cached = sorted(results[1:])
+        print(f'cached layout, best / median:   {cached[0] * 1000:8.1f} ms / {cached[len(cached) // 2] * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Runs a leader and followers with skewed wall clocks as separate servers on loopback and measures how far the
+# frames shown by each node are from the phase of the shared timeline.
+#
+#   python -m benchmarks.sync --followers 2 --skew 3.5 --duration 10
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+
+def run_child(config_file: str, skew: float, duration: float):
+    import clock  # pylint: disable=import-outside-toplevel
+    import controller  # pylint: disable=import-outside-toplevel
+    import led_block  # pylint: disable=import-outside-toplevel
+
+    class SkewedClock(clock.Clock):
+        def wall_time(self) -> float:
+            return time.time() + skew
+
+    clock.current = SkewedClock()
+    controller.DataInitialize.config_file = config_file
+    controller.DataInitialize.state_file = f'{config_file}.state.json'
+
+    # the time shown by a frame against the real time since the start on the timeline of the leader, whose
+    # wall clock is not skewed
+    errors = []
+    render_frame = led_block.LedMatrix._render_frame
+
+    def record_frame(self, steps: int = 1):
+        render_frame(self, steps)
+        if self.name == 'default' and self._effect is not None:
+            errors.append((self._effect.frame_number - 1) / self._effect.fps - (time.time() - self._started))
+
+    led_block.LedMatrix._render_frame = record_frame
+
+    async def start():
+        await controller.DataInitialize.initialize()
+        if controller.DataInitialize.sync_settings.role.value == 'leader':
+            await led_block.known_blocks['default'].run_program(led_block.BlockProgram.TWINKLE, seed=1)
+        await asyncio.sleep(duration)
+        await controller.DataInitialize.shutdown()
+
+    asyncio.run(start())
+    print(json.dumps(errors[len(errors) // 2:]), flush=True)  # the first half is for starting and settling
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Phase error of synchronized servers on loopback')
+    parser.add_argument('--followers', type=int, default=2)
+    parser.add_argument('--skew', type=float, default=3.5, help='seconds the wall clock of the n-th follower is off '
+                                                                 'multiplied by n')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=5810)
+    parser.add_argument('--config', default='default.config.json')
+    parser.add_argument('--child', nargs=3, default=None, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        run_child(arguments.child[0], float(arguments.child[1]), float(arguments.child[2]))
+        return
+
+    with open(os.path.join('config', arguments.config), 'r', encoding='utf-8') as data:
+        config = json.load(data)
+    for strip_data in config['strips']:
+        strip_data['power_settle'] = 0.1
+    fps = config['blocks'][0].get('fps', 20)
+
+    with tempfile.TemporaryDirectory() as directory:
+        children = []
+        for index in range(arguments.followers + 1):
+            role = 'leader' if index == 0 else 'follower'
+            config_file = os.path.join(directory, f'{role}{index}.config.json')
+            with open(config_file, 'w', encoding='utf-8') as data:
+                json.dump({**config, 'sync': {'role': role, 'port': arguments.port, 'interval': 0.5}}, data)
+
+            children.append((role, subprocess.Popen(  # pylint: disable=consider-using-with
+                [sys.executable, '-m', 'benchmarks.sync', '--child', config_file, str(index * arguments.skew),
+                 str(arguments.duration)], stdout=subprocess.PIPE, text=True)))
+            time.sleep(0.5)  # the leader listens before the followers start
+
+        print(f'{"node":10} {"frames":>7} {"median frames":>14} {"p99 frames":>11}')
+        medians = []
+        for index, (role, child) in enumerate(children):
+            output, _ = child.communicate()
+            errors = numpy.array(json.loads(output.strip().splitlines()[-1])) * fps
+            medians.append(numpy.median(errors))
+            print(f'{role + str(index):10} {len(errors):7} {medians[-1]:14.3f} '
+                  f'{numpy.percentile(numpy.abs(errors), 99):11.3f}')
+
+    print(f'largest phase difference between nodes: {max(medians) - min(medians):.3f} frames')
+
+
+if __name__ == '__main__':
+    main()
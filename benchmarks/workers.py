@@ -0,0 +1,73 @@
+# Measures the time the main loop spends per frame on an expensive expression effect, rendered in the main process
+# and by render workers, while the loop does the rest of its work between the frames.
+#
+#   python -m benchmarks.workers --effects 1 3 --leds 30000 --fps 30 --frames 200
+import argparse
+import time
+
+import numpy
+
+import effects
+import expressions
+import workers
+
+SOURCE = ('a = dist(cx, cy) / 3 - t * 2; hue = fract(sin(a) + cos(x * 0.3 + t) + u / 30); '
+          'value = smoothstep(0, 1, wave(a))')
+
+
+def get_geometry(leds: int) -> effects.Geometry:
+    # square matrix of blocks with 30 LEDs each
+    cols = max(int((leds / 30) ** 0.5), 1)
+    return effects.Geometry([[(30 * (row * cols + col), 30 * (row * cols + col + 1)) for col in range(cols)]
+                             for row in range(cols)])
+
+
+def time_frames(rendered: list[effects.Effect], frames: int, fps: float) -> numpy.ndarray:
+    # like the render loop, the rest of the frame interval is used by compositing, output and the server
+    times = []
+    for _ in range(frames):
+        started = time.perf_counter()
+        for effect in rendered:
+            effect.next_frame()
+        spent = time.perf_counter() - started
+        times.append(spent)
+        time.sleep(max(1 / fps - spent, 0))
+    return numpy.array(times) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Main loop time of effects rendered by render workers')
+    parser.add_argument('--effects', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--leds', type=int, default=30000)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=None, help='render workers, one per core besides one')
+    arguments = parser.parse_args()
+
+    geometry = get_geometry(arguments.leds)
+    palette = numpy.array([[255, 0, 0], [0, 0, 255]], dtype=numpy.float32)
+    pool = workers.RenderPool(arguments.processes)
+
+    print(f'{geometry.led_count} LEDs, {pool.processes} render workers')
+    print(f'{"effects":>8} {"rendered in":12} {"median ms":>10} {"p99 ms":>10}')
+    try:
+        for count in arguments.effects:
+            for name in ('main process', 'workers'):
+                rendered = [expressions.ExpressionEffect(geometry, palette, seed=seed, expression=SOURCE)
+                            for seed in range(count)]
+                if name == 'workers':
+                    rendered = [pool.wrap(effect) for effect in rendered]
+                    for effect in rendered:
+                        effect.wait(10)  # the worker processes start first
+
+                times = time_frames(rendered, arguments.frames, arguments.fps)
+                for effect in rendered:
+                    effect.close()
+
+                print(f'{count:8} {name:12} {numpy.median(times):10.2f} {numpy.percentile(times, 99):10.2f}')
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
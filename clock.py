@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import selectors
+import time
+import typing
+
+
+class Clock:
+    # time source of the programs, the render loop and the strips
+    def time(self) -> float:
+        return time.monotonic()
+
+    def wall_time(self) -> float:
+        # unlike time() comparable across restarts
+        return time.time()
+
+    async def sleep(self, delay: float):
+        await asyncio.sleep(delay)
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        # whether the event was set within the timeout
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.new_event_loop()
+
+
+class VirtualClock(Clock):
+    # time only passes while every task of a VirtualEventLoop waits, it jumps straight to the next timer
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def wall_time(self) -> float:
+        return self.now
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        return VirtualEventLoop(self)
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    # polls the real selector and advances the clock instead of blocking until the next timer
+    def __init__(self, virtual_clock: VirtualClock):
+        self._clock = virtual_clock
+        self._selector = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None):
+        return self._selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self._selector.modify(fileobj, events, data)
+
+    def select(self, timeout=None):
+        events = self._selector.select(0)
+        if events or timeout == 0:
+            return events
+
+        if timeout is None:  # no timer is due, only threads or real I/O can continue
+            return self._selector.select(None)
+
+        self._clock.now += timeout
+        return []
+
+    def close(self):
+        self._selector.close()
+
+    def get_map(self):
+        return self._selector.get_map()
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, virtual_clock: VirtualClock):
+        super().__init__(_VirtualSelector(virtual_clock))
+        self.clock = virtual_clock
+
+    def time(self) -> float:
+        return self.clock.now
+
+
+class VirtualEventLoopPolicy(asyncio.DefaultEventLoopPolicy):
+    def __init__(self, virtual_clock: VirtualClock):
+        super().__init__()
+        self.clock = virtual_clock
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        return self.clock.new_event_loop()
+
+
+current: Clock = Clock()
+
+
+@contextlib.contextmanager
+def use(new_clock: Clock) -> typing.Iterator[Clock]:
+    global current  # pylint: disable=global-statement,invalid-name
+    previous, current = current, new_clock
+    try:
+        yield new_clock
+    finally:
+        current = previous
@@ -0,0 +1,101 @@
+import enum
+
+import numpy
+
+import effects
+
+
+class BlendMode(enum.Enum):
+    ADD = 'add'
+    MULTIPLY = 'multiply'
+    MAX = 'max'
+    ALPHA = 'alpha'
+
+
+class Layer:
+    def __init__(self, effect: effects.Effect, blend_mode: BlendMode = BlendMode.ALPHA, opacity: float = 1.0,
+                 mask: numpy.ndarray = None, settings: dict = None, started: float = None):
+        self.effect = effect
+        self.settings = settings or {}  # how the layer was created, so it can be created again
+        self.started = started  # time of the first frame of the effect on the shared timeline
+        self.blend_mode = blend_mode
+        self.opacity = max(0.0, min(opacity, 1.0))
+        self.mask = mask
+
+        # opacity and mask are folded into one weight per LED, so blending is a single multiply per layer
+        weight = numpy.full(effect.geometry.led_count, self.opacity, dtype=numpy.float32)
+        if mask is not None:
+            weight *= numpy.asarray(mask, dtype=numpy.float32)
+        self._weight = weight[:, None]
+
+    @property
+    def description(self) -> dict:
+        return {
+            'effect': type(self.effect).__name__,
+            'blend_mode': self.blend_mode.value,
+            'opacity': self.opacity,
+            'masked': self.mask is not None,
+            'seed': self.effect.seed,
+        }
+
+    def blend(self, frame: numpy.ndarray, scratch: numpy.ndarray, steps: int = 1):
+        source = self.effect.next_frame(steps)
+        weight = self._weight
+
+        match self.blend_mode:
+            case BlendMode.ADD:
+                numpy.multiply(source, weight, out=scratch)
+            case BlendMode.MULTIPLY:
+                # frame * (1 - w) + w * frame * source / 255 == frame * (1 + w * (source / 255 - 1))
+                numpy.multiply(source, 1 / 255, out=scratch)
+                scratch -= 1
+                scratch *= weight
+                scratch *= frame
+            case BlendMode.MAX:
+                numpy.maximum(frame, source, out=scratch)
+                scratch -= frame
+                scratch *= weight
+            case BlendMode.ALPHA:
+                numpy.subtract(source, frame, out=scratch)
+                scratch *= weight
+
+        frame += scratch
+
+
+class LayerStack:
+    def __init__(self):
+        self.layers: list[Layer] = []
+        self._frame: numpy.ndarray = numpy.zeros((0, 3), dtype=numpy.float32)
+        self._scratch: numpy.ndarray = numpy.zeros((0, 3), dtype=numpy.float32)
+
+    def __bool__(self) -> bool:
+        return bool(self.layers)
+
+    def __len__(self) -> int:
+        return len(self.layers)
+
+    def add(self, layer: Layer) -> int:
+        self.layers.append(layer)
+        return len(self.layers) - 1
+
+    def remove(self, index: int) -> Layer:
+        layer = self.layers.pop(index)
+        layer.effect.close()
+        return layer
+
+    def clear(self):
+        for layer in self.layers:
+            layer.effect.close()
+        self.layers.clear()
+
+    def composite(self, base: numpy.ndarray, steps: int = 1) -> numpy.ndarray:
+        if self._frame.shape != base.shape:
+            self._frame = numpy.zeros(base.shape, dtype=numpy.float32)
+            self._scratch = numpy.zeros(base.shape, dtype=numpy.float32)
+
+        frame = self._frame
+        frame[:] = base
+        for layer in self.layers:
+            layer.blend(frame, self._scratch, steps)
+
+        return numpy.clip(frame, 0, 255, out=frame)
@@ -1,79 +1,348 @@
 import asyncio
+import enum
 import json
 import os
 import typing
 
 import fastapi
+import fastapi.routing
 import fastapi.staticfiles
-import fastapi.templating
+import pydantic
 
+import audio
+import clock
+import expressions
+import layout
 import led_block
+import pages
+import profiler
+import quality
+import state
 import strip
+import sync
+import workers
 
 app = fastapi.FastAPI()
 app.include_router(led_block.router, tags=['blocks'])
 app.mount("/static", fastapi.staticfiles.StaticFiles(directory="static"), name="static")
 
-templates = fastapi.templating.Jinja2Templates(directory="templates")
-
 
 class DataInitialize:
     strips_data: list[dict]
     blocks_data: list[dict]
+    power_supplies_data: list[dict] = []
+    config_file: str = 'default.config.json'
+    state_file: str = '.state.json'
+    expressions_file: str = 'expressions.json'
+    expressions_data: dict[str, str] = {}
+    watch_interval: float = 0
+    sync_settings: typing.Optional[sync.SyncSettings] = None
 
     _is_initialized = False
+    _initialized: asyncio.Event = None
     _available_strips: dict[str, strip.Strip] = {}
+    _power_supplies: dict[str, strip.PowerSupply] = {}
     _blocks: list[led_block.LedMatrix] = []
+    _geometries: dict = {}
+    _aliases: dict[str, list[list[str]]] = {}
+    _reload_lock: asyncio.Lock = None
+    _expressions_lock: asyncio.Lock = None
+    _stored_expressions: dict[str, str] = {}
+    _watch_task: asyncio.Task = None
+    _quality_task: asyncio.Task = None
 
     @classmethod
     async def initialize(cls):
-        cls._initialize_config()
-        cls._init_strips()
+        cls._initialized = cls._initialized or asyncio.Event()
+
+        cls._initialize_config(cls.config_file)
+        await cls._init_strips()
+        cls._init_power_supplies()
         cls._init_blocks()
+        await cls._restore_state()
+        await cls._start_sync()
+
         cls._is_initialized = True
+        cls._initialized.set()
+
+        if cls.watch_interval and (not cls._watch_task or cls._watch_task.done()):
+            cls._watch_task = asyncio.create_task(cls._watch_config(), name='watch config')
+
+        if not cls._quality_task or cls._quality_task.done():
+            cls._quality_task = asyncio.create_task(quality.monitor.run(), name='quality monitor')
 
     @classmethod
     def _initialize_config(cls, config_file: str = 'default.config.json'):
+        compiled = cls._read_config(config_file)
+        cls.strips_data, cls.blocks_data, cls.watch_interval = compiled.strips, compiled.blocks, compiled.watch_interval
+        cls.power_supplies_data = compiled.power_supplies
+        cls._geometries = compiled.geometries
+        cls._aliases = compiled.aliases
+        cls.config_file = config_file
+        cls.sync_settings = compiled.sync
+        cls.expressions_data = compiled.expressions
+        cls._stored_expressions = expressions.load_library(cls._get_config_path(cls.expressions_file))
+        cls._publish_expressions()
+        audio.allowed_sources = compiled.audio_sources
+        profiler.enabled = compiled.profiling
+        workers.pool.configure(compiled.render_workers)
 
-        full_config_path: str = os.path.join('config', config_file)
-        with open(full_config_path, 'r', encoding='utf-8') as data:
-            json_data = json.load(data)
+    @classmethod
+    def _publish_expressions(cls):
+        # expressions stored through the API take precedence over those of the config file
+        expressions.library = {**cls.expressions_data, **cls._stored_expressions}
 
-            if 'strips' in json_data:
-                cls.strips_data = json_data['strips']
-            else:
-                raise ValueError(f'missing entry strips in {config_file}')
+    @staticmethod
+    def _get_config_path(config_file: str) -> str:
+        return os.path.join('config', config_file)
 
-            if 'blocks' in json_data:
-                cls.blocks_data = json_data['blocks']
-            else:
-                raise ValueError(f'missing entry areas in {config_file}')
+    @classmethod
+    def _read_config(cls, config_file: str) -> layout.Layout:
+        return layout.load(cls._get_config_path(config_file))
 
     @classmethod
-    def _init_strips(cls):
-        for strip_data in cls.strips_data:
-            if (identifier := strip_data['identifier']) not in cls._available_strips:
-                cls._available_strips[identifier] = strip.Strip(**strip_data)
+    async def _init_strips(cls):
+        # the drivers are set up in parallel and the power is switched on right away,
+        # the settle time passes while the blocks are initialized
+        new_strips = [strip_data for strip_data in cls.strips_data
+                      if strip_data['identifier'] not in cls._available_strips]
+
+        for new_strip in await asyncio.gather(*(asyncio.to_thread(strip.Strip, **data) for data in new_strips)):
+            cls._available_strips[new_strip.identifier] = new_strip
+
+        for available_strip in cls._available_strips.values():
+            available_strip.power_on()
+
+    @classmethod
+    def _init_power_supplies(cls):
+        cls._power_supplies = {data['name']: strip.PowerSupply(**data) for data in cls.power_supplies_data}
+        for available_strip in cls._available_strips.values():
+            available_strip.set_power_supply(cls._power_supplies.get(available_strip.power_supply))
 
     @classmethod
     def _init_blocks(cls):
         for bdata in cls.blocks_data:
             strip_name = bdata.get('strip_name', 'default')
             if strip_name in cls._available_strips:
-                _blocks = led_block.LedMatrix(cls._available_strips[strip_name], **bdata)
+                _blocks = led_block.LedMatrix(cls._available_strips[strip_name],
+                                              geometry=cls._geometries.get(bdata['name']), **bdata)
+
+    @classmethod
+    async def _restore_state(cls):
+        # the programs of the last run are started again before the first frame, effects at their phase by now
+        state.store.open(cls._get_config_path(cls.state_file), cls._collect_state)
+        saved_matrices = [(matrix, saved) for name, saved in state.store.load().items()
+                          if (matrix := led_block.known_blocks.get(name))]
+        await asyncio.gather(*(cls._restore_matrix(matrix, saved) for matrix, saved in saved_matrices))
+
+    @staticmethod
+    async def _restore_matrix(matrix: led_block.LedMatrix, saved: dict):
+        try:
+            await matrix.restore(saved)
+        except (KeyError, TypeError, ValueError, OSError) as error:
+            print(f'Could not restore {matrix.name}: {error}')
+
+    @staticmethod
+    def _collect_state() -> dict[str, dict]:
+        return {name: saved for name, matrix in led_block.known_blocks.items() if (saved := matrix.state)}
+
+    @classmethod
+    async def _start_sync(cls):
+        # a leader sends its programs to the followers, the followers show them at the same phase
+        if cls.sync_settings is None:
+            await sync.node.stop()
+            return
+
+        if cls.sync_settings != sync.node.settings:
+            try:
+                await sync.node.start(cls.sync_settings, cls._collect_state, cls._apply_leader_state)
+            except OSError as error:
+                print(f'Could not start sync as {cls.sync_settings.role.value}: {error}')
+                await sync.node.stop()
+
+    @classmethod
+    async def _apply_leader_state(cls, states: dict[str, dict]):
+        # only blocks showing something else than on the leader are changed, with the start times of the leader
+        for name, matrix in list(led_block.known_blocks.items()):
+            saved = states.get(name)
+            if saved == json.loads(json.dumps(matrix.state)):
+                continue
+
+            if matrix.program_settings and not (saved or {}).get('program'):
+                await matrix.run_program(led_block.BlockProgram.STOP)
+            matrix.clear_layers()
+            if saved:
+                await cls._restore_matrix(matrix, saved)
+
+    @classmethod
+    async def reload(cls, config_file: str = None) -> dict[str, dict[str, list[str]]]:
+        cls._reload_lock = lock = cls._reload_lock or asyncio.Lock()
+        async with lock:
+            # the compiled layout is validated, so nothing is touched on errors
+            config_file = config_file or cls.config_file
+            compiled = cls._read_config(config_file)
+            new_strips = {data['identifier']: data for data in compiled.strips}
+            new_blocks = {data['name']: data for data in compiled.blocks if data['strip_name'] in new_strips}
+
+            # the swap runs without awaiting, so render loops only ever see either the old or the new layout
+            summary = {'strips': {'added': [], 'changed': [], 'removed': []},
+                       'blocks': {'added': [], 'rebuilt': [], 'updated': [], 'removed': []}}
+            removed_strips = cls._swap_strips(new_strips, summary['strips'])
+            restarts = cls._swap_blocks(new_blocks, compiled.geometries, summary['blocks'])
+
+            cls.strips_data, cls.blocks_data = compiled.strips, compiled.blocks
+            cls.power_supplies_data = compiled.power_supplies
+            cls.watch_interval = compiled.watch_interval
+            cls._init_power_supplies()
+            cls._geometries = compiled.geometries
+            cls._aliases = compiled.aliases
+            cls.config_file = config_file
+            cls.sync_settings = compiled.sync
+            cls.expressions_data = compiled.expressions
+            cls._publish_expressions()
+            audio.allowed_sources = compiled.audio_sources
+            profiler.enabled = compiled.profiling
+            if not profiler.enabled and profiler.session:
+                profiler.session.stop()
+            workers.pool.configure(compiled.render_workers)
+            pages.cache.clear()
+
+            for matrix, program in restarts:
+                await matrix.run_program(**program)
+
+            for name in summary['blocks']['updated']:
+                await led_block.known_blocks[name].redraw()
+
+            for removed in removed_strips:
+                await removed.switch_off()
+                removed.release()
+
+            await cls._start_sync()
+            return summary
+
+    @classmethod
+    async def store_expression(cls, name: str, source: str = None):
+        # stored expressions have a file of their own, the hand written config file is never rewritten;
+        # the lock keeps a second change from being lost while the file is written
+        cls._expressions_lock = lock = cls._expressions_lock or asyncio.Lock()
+        async with lock:
+            stored = dict(cls._stored_expressions)
+            if source is not None:
+                stored[name] = source
+            elif stored.pop(name, None) is None:
+                raise ValueError(f'Expression {name} is part of {cls.config_file} and can only be removed there')
+
+            await asyncio.to_thread(state.write_file, cls._get_config_path(cls.expressions_file),
+                                    json.dumps(stored, indent=4))
+            cls._stored_expressions = stored
+            cls._publish_expressions()
+            pages.cache.clear()
+
+    @classmethod
+    def _swap_strips(cls, new_strips: dict[str, dict], summary: dict[str, list[str]]) -> list[strip.Strip]:
+        removed_strips = [cls._available_strips.pop(identifier) for identifier in list(cls._available_strips)
+                          if identifier not in new_strips]
+        summary['removed'] = [removed.identifier for removed in removed_strips]
+
+        for identifier, data in new_strips.items():
+            if not (old_strip := cls._available_strips.get(identifier)):
+                cls._available_strips[identifier] = strip.Strip(**data)
+                summary['added'].append(identifier)
+
+            elif not old_strip.has_settings(data):
+                was_on = old_strip.is_on
+                old_strip.release()
+                cls._available_strips[identifier] = new_strip = strip.Strip(**data)
+                new_strip.set_power(was_on)
+                summary['changed'].append(identifier)
+
+        return removed_strips
+
+    @classmethod
+    def _swap_blocks(cls, new_blocks: dict[str, dict], geometries: dict,
+                     summary: dict[str, list[str]]) -> list[tuple[led_block.LedMatrix, dict]]:
+        for name in [name for name, matrix in led_block.known_blocks.items()
+                     if not matrix.is_region and name not in new_blocks]:
+            led_block.known_blocks[name].detach()
+            summary['removed'].append(name)
+
+        restarts = []
+        for name, data in new_blocks.items():
+            strip_obj = cls._available_strips[data.get('strip_name', 'default')]
+            matrix = led_block.known_blocks.get(name)
+
+            if matrix and not matrix.is_region and matrix.has_geometry(data['blocks']):
+                matrix.apply_settings(strip_obj, **data)
+                summary['updated'].append(name)
+                continue
+
+            # programs of a changed geometry are restarted with the same settings on the new matrix
+            programs = {}
+            if matrix:
+                programs = {old.name: old.program_settings for old in matrix.with_regions if old.program_settings}
+                matrix.detach()
+                summary['rebuilt'].append(name)
+            else:
+                summary['added'].append(name)
+
+            new_matrix = led_block.LedMatrix(strip_obj, geometry=geometries.get(name), **data)
+            restarts += [(restarted, programs[restarted.name]) for restarted in new_matrix.with_regions
+                         if restarted.name in programs]
+
+        return restarts
+
+    @classmethod
+    async def _watch_config(cls):
+        last_modified = os.path.getmtime(cls._get_config_path(cls.config_file))
+        while cls.watch_interval:
+            await clock.current.sleep(cls.watch_interval)
+
+            try:
+                modified = os.path.getmtime(cls._get_config_path(cls.config_file))
+                if modified != last_modified:
+                    last_modified = modified
+                    print(f'Reloading {cls.config_file}: {await cls.reload()}')
+            except (OSError, ValueError) as error:
+                print(f'Reloading {cls.config_file} failed: {error}')
 
     @classmethod
     async def shutdown(cls):
+        if cls._watch_task:
+            cls._watch_task.cancel()
+
+        if cls._quality_task:
+            cls._quality_task.cancel()
+
+        if profiler.session:
+            profiler.session.stop()
+
+        await sync.node.stop()
+        await state.store.flush()
+        state.store.close()
+        workers.pool.close()
+
+        cls._is_initialized = False
+        cls._initialized = None
+
         for available_strip in cls._available_strips.values():
             await available_strip.switch_off()
 
     @classmethod
     async def wait_for_initialize(cls):
-        while not cls._is_initialized:
+        if not cls._is_initialized:
             print('Initialising strips')
-            await asyncio.sleep(0.1)
+            cls._initialized = cls._initialized or asyncio.Event()
+            await cls._initialized.wait()
         return True
 
+    @classmethod
+    def aliases(cls) -> dict[str, list[list[str]]]:
+        return cls._aliases
+
+    @classmethod
+    def power_supplies(cls) -> dict[str, strip.PowerSupply]:
+        return cls._power_supplies
+
     @classmethod
     def strips(cls) -> typing.Generator[strip.Strip, None, None]:
         for available_strip in cls._available_strips.values():
@@ -92,21 +361,189 @@ async def _stop_server():
 
 @app.get("/")
 def show_main_page(request: fastapi.Request):
-    return templates.TemplateResponse("index.html", {
-        'request': request,
+    return pages.cache.render(request, 'index', "index.html", lambda: {
         'blocks': led_block.known_blocks.values()
     })
 
 
 @app.get("/status/")
 def show_status_page(request: fastapi.Request):
-    return templates.TemplateResponse("status.html", {
-        'request': request,
-    })
+    return pages.cache.render(request, 'status', "status.html", dict)
+
+
+@app.post("/config/reload/")
+async def reload_config():
+    try:
+        return await DataInitialize.reload()
+    except (OSError, ValueError, pydantic.ValidationError) as error:
+        raise fastapi.HTTPException(status_code=400, detail=f'Reloading the configuration failed: {error}') from error
+
+
+@app.post("/brightness/")
+async def set_brightness(
+        value: float = fastapi.Query(ge=0, le=1, title='Brightness of all strips on top of their own brightness'),
+):
+    strip.set_global_brightness(value)
+    for matrix in led_block.known_blocks.values():
+        if not matrix.is_region:
+            await matrix.redraw()
+
+    return {'brightness': strip.global_brightness}
+
+
+@app.get("/layout/aliases/")
+def get_layout_aliases():
+    # blocks sharing the same LEDs per strip, of the ones in one matrix only the last block is written
+    return DataInitialize.aliases()
+
+
+@app.get("/metrics/power/")
+def get_power_metrics():
+    return {
+        'strips': {available_strip.identifier: available_strip.power_metrics
+                   for available_strip in DataInitialize.strips()},
+        'power_supplies': {name: supply.metrics for name, supply in DataInitialize.power_supplies().items()},
+    }
+
+
+@app.get("/metrics/quality/")
+def get_quality_metrics():
+    return quality.monitor.metrics
+
+
+@app.get("/metrics/sync/")
+def get_sync_metrics():
+    return sync.node.metrics
+
+
+@app.get("/expressions/")
+def get_expressions():
+    return expressions.library
+
+
+@app.put("/expressions/{name}/")
+async def store_expression(
+        name: str = fastapi.Path(max_length=50, regex=r'^[\w-]+$', title='Name of the expression', example='rainbow'),
+        expression: str = fastapi.Query(max_length=expressions.MAX_LENGTH, example='hue = (x + y) / 10 + t * 0.2'),
+):
+    try:
+        expressions.compile_expression(expression)
+        await DataInitialize.store_expression(name, expression)
+    except (OSError, ValueError) as error:
+        raise fastapi.HTTPException(status_code=400, detail=str(error)) from error
+
+    return expressions.library
+
+
+@app.delete("/expressions/{name}/")
+async def remove_expression(
+        name: str = fastapi.Path(title='Name of the expression', example='rainbow'),
+):
+    if name not in expressions.library:
+        raise fastapi.HTTPException(status_code=404, detail=f'Expression {name} is unknown')
+
+    try:
+        await DataInitialize.store_expression(name)
+    except (OSError, ValueError) as error:
+        raise fastapi.HTTPException(status_code=400, detail=str(error)) from error
+
+    return expressions.library
+
+
+class ProfilingTarget(enum.Enum):
+    MATRIX = 'matrix'
+    OUTPUT = 'output'
+    HTTP = 'http'
+
+
+def _get_profiling_target(target: ProfilingTarget, block_id: str = None) -> profiler.Target:
+    match target:
+        case ProfilingTarget.MATRIX:
+            matrix = led_block.known_blocks.get(block_id)
+            if not matrix:
+                raise fastapi.HTTPException(status_code=404, detail=f'Unknown block {block_id}')
+
+            # running programs are only covered by the sampling profiler, cProfile sees the frames and strip updates
+            matrices = matrix.with_regions
+            return profiler.Target(
+                f'matrix-{matrix.name}', tasks=lambda: matrix.tasks,
+                patches=[(led_block.LedMatrix, '_render_frame'), (led_block.LedMatrix, '_update_strip')],
+                condition=lambda rendered, *_, **__: any(rendered is member for member in matrices))
+        case ProfilingTarget.OUTPUT:
+            return profiler.Target('output', codes=[strip.Strip.update_strip.__code__],
+                                    patches=[(strip.Strip, 'update_strip')])
+        case _:
+            routes = [route for route in app.routes if isinstance(route, fastapi.routing.APIRoute)
+                      and not route.path.startswith('/profiling/')]
+            return profiler.Target('http', codes=[route.endpoint.__code__ for route in routes],
+                                    patches=[(route.dependant, 'call') for route in routes])
+
+
+def _check_profiling_enabled():
+    # profiling slows every frame and request down, so it has to be enabled in the config first
+    if not profiler.enabled:
+        raise fastapi.HTTPException(status_code=403, detail='Profiling is disabled in the config')
+
+
+def _get_profiling_session() -> profiler.Session:
+    _check_profiling_enabled()
+    if not profiler.session:
+        raise fastapi.HTTPException(status_code=404, detail='Nothing was profiled yet')
+    return profiler.session
+
+
+@app.post("/profiling/")
+async def start_profiling(
+        target: ProfilingTarget = fastapi.Query(title='Matrix programs, strip output or HTTP request handlers'),
+        block_id: str = fastapi.Query(default=None, title='Identifier of the profiled matrix', example='default'),
+        mode: profiler.ProfilerMode = fastapi.Query(default=profiler.ProfilerMode.SAMPLING),
+        duration: float = fastapi.Query(default=10, gt=0, le=600, title='Seconds until profiling stops by itself'),
+        interval: float = fastapi.Query(default=0.01, ge=0.001, le=1, title='Seconds between two stack samples'),
+):
+    _check_profiling_enabled()
+    try:
+        session = profiler.start(_get_profiling_target(target, block_id), mode, duration, interval)
+    except RuntimeError as error:
+        raise fastapi.HTTPException(status_code=409, detail=str(error)) from error
+
+    return session.status
+
+
+@app.get("/profiling/")
+def get_profiling_status():
+    return _get_profiling_session().status
+
+
+@app.delete("/profiling/")
+async def stop_profiling():
+    session = _get_profiling_session()
+    session.stop()
+    return session.status
+
+
+@app.get("/profiling/result/")
+def get_profiling_result():
+    session = _get_profiling_session()
+    if session.is_running:
+        raise fastapi.HTTPException(status_code=409, detail='Profiling is still running')
+
+    media_type = 'text/plain' if session.mode is profiler.ProfilerMode.SAMPLING else 'application/octet-stream'
+    return fastapi.Response(content=session.result, media_type=media_type,
+                            headers={'Content-Disposition': f'attachment; filename="{session.file_name}"'})
 
 
 @app.get("/test/")
 async def start_tests():
-    for strip in DataInitialize.strips():
-        asyncio.create_task(strip.run_tests())
+    for available_strip in DataInitialize.strips():
+        asyncio.create_task(available_strip.run_tests())
     return {'started': 'successful'}
+
+
+@app.get("/calibrate/")
+async def calibrate_strips(
+        samples: int = fastapi.Query(default=20, ge=1, le=1000, title='Timed frames per test color'),
+        hold: float = fastapi.Query(default=0.5, ge=0, le=10, title='Seconds every test color is shown'),
+):
+    available_strips = list(DataInitialize.strips())
+    reports = await asyncio.gather(*(available_strip.calibrate(samples, hold) for available_strip in available_strips))
+    return {available_strip.identifier: report for available_strip, report in zip(available_strips, reports)}
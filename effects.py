@@ -0,0 +1,183 @@
+import abc
+import typing
+
+import numpy
+
+
+class Geometry:
+    # Flat index arrays describing how the blocks of a matrix map onto the LEDs of the strip
+    def __init__(self, ranges: list[list[tuple[int, int]]], shadowed_blocks: typing.Sequence[int] = ()):
+        self.rows = len(ranges)
+        self.cols = max((len(row) for row in ranges), default=0)
+
+        block_rows, block_cols, led_index, led_block, led_offset = [], [], [], [], []
+        for row_index, row in enumerate(ranges):
+            for col_index, (start, end) in enumerate(row):
+                block_id = len(block_rows)
+                block_rows.append(row_index)
+                block_cols.append(col_index)
+
+                length = abs(end - start)
+                first = min(start, end)
+                indices = numpy.arange(first, first + length)
+                led_index.append(indices[::-1] if start > end else indices)
+                led_block.append(numpy.full(length, block_id))
+                led_offset.append(numpy.arange(length) / max(length - 1, 1))
+
+        self.block_rows = numpy.array(block_rows, dtype=numpy.intp)
+        self.block_cols = numpy.array(block_cols, dtype=numpy.intp)
+        self.block_count = len(block_rows)
+
+        self.led_index = numpy.concatenate(led_index).astype(numpy.intp) if led_index else numpy.zeros(0, numpy.intp)
+        self.led_block = numpy.concatenate(led_block).astype(numpy.intp) if led_block else numpy.zeros(0, numpy.intp)
+        self.led_offset = numpy.concatenate(led_offset) if led_offset else numpy.zeros(0)
+        self.led_count = len(self.led_index)
+
+        self._leds_per_block = numpy.maximum(numpy.bincount(self.led_block, minlength=self.block_count), 1)
+
+        # blocks with the same LEDs as a later block are rendered but not written, every LED is written once
+        written = ~numpy.isin(self.led_block, numpy.asarray(shadowed_blocks, dtype=numpy.intp))
+        self.write_positions = None if written.all() else numpy.flatnonzero(written)
+        self.write_index = self.led_index if self.write_positions is None else self.led_index[self.write_positions]
+
+    def block_id(self, row: int, col: int) -> int:
+        return int(numpy.flatnonzero((self.block_rows == row) & (self.block_cols == col))[0])
+
+    def expand(self, block_colors: numpy.ndarray) -> numpy.ndarray:
+        return block_colors[self.led_block]
+
+    def mask(self, rows: tuple[int, int] = None, cols: tuple[int, int] = None) -> numpy.ndarray:
+        # rows and cols are inclusive (first, last) ranges, a missing range selects everything
+        selected = numpy.ones(self.block_count, dtype=bool)
+        if rows:
+            selected &= (self.block_rows >= rows[0]) & (self.block_rows <= rows[1])
+        if cols:
+            selected &= (self.block_cols >= cols[0]) & (self.block_cols <= cols[1])
+
+        return self.expand(selected.astype(numpy.float32))
+
+    def block_means(self, frame: numpy.ndarray) -> numpy.ndarray:
+        sums = numpy.stack([
+            numpy.bincount(self.led_block, weights=frame[:, channel], minlength=self.block_count)
+            for channel in range(3)
+        ], axis=1)
+        return sums / self._leds_per_block[:, None]
+
+
+class Effect(abc.ABC):
+    # Frames are rendered as float RGB values (0-255) for every LED of the geometry on a fixed time step,
+    # so a run is fully determined by its seed.
+    in_worker = False  # expensive effects are rendered by a worker process if render workers are configured
+    options: tuple[str, ...] = ()  # settings of the program besides colors and seed
+
+    def __init__(self, geometry: Geometry, palette: numpy.ndarray, seed: int = None, fps: float = 20.0):
+        if seed is None:
+            seed = int(numpy.random.SeedSequence().entropy % 2 ** 32)
+
+        self.geometry = geometry
+        self.palette = numpy.asarray(palette, dtype=numpy.float32).reshape(-1, 3)
+        self.seed = seed
+        self.fps = fps
+        self.frame_number = 0
+        self.rng = numpy.random.default_rng(seed)
+
+    @property
+    def frame_interval(self) -> float:
+        return 1 / self.fps
+
+    @property
+    def time(self) -> float:
+        return self.frame_number / self.fps
+
+    def next_frame(self, steps: int = 1) -> numpy.ndarray:
+        # a frame standing for several time steps skips the ones before, so the animation keeps its speed
+        if steps > 1:
+            self.advance(steps - 1)
+
+        frame = self.render(self.time)
+        self.frame_number += 1
+        return frame
+
+    def advance(self, frames: int):
+        self.frame_number += frames
+
+    def listen(self, callback: typing.Callable[[], None]) -> bool:  # pylint: disable=unused-argument
+        # effects driven by an input call back from their input thread whenever new input arrived
+        return False
+
+    @abc.abstractmethod
+    def render(self, time: float) -> numpy.ndarray:
+        pass
+
+    def close(self):
+        pass
+
+
+class Twinkle(Effect):
+    def __init__(self, geometry: Geometry, palette: numpy.ndarray, seed: int = None, fps: float = 20.0, *,
+                 min_period: float = 1.0, max_period: float = 4.0):
+        super().__init__(geometry, palette, seed, fps)
+        count = geometry.block_count
+
+        self._colors = self.palette[self.rng.integers(0, len(self.palette), count)]
+        self._phases = self.rng.uniform(0, 2 * numpy.pi, count).astype(numpy.float32)
+        self._speeds = (2 * numpy.pi / self.rng.uniform(min_period, max_period, count)).astype(numpy.float32)
+
+    def render(self, time: float) -> numpy.ndarray:
+        brightness = 0.5 + 0.5 * numpy.sin(self._phases + self._speeds * time)
+
+        # blocks picking up a new color are the ones passing through their darkest point
+        recolor = brightness < 0.02
+        if recolor.any():
+            self._colors[recolor] = self.palette[self.rng.integers(0, len(self.palette), int(recolor.sum()))]
+
+        return self.geometry.expand(self._colors * brightness[:, None])
+
+
+class Sparkle(Effect):
+    def __init__(self, geometry: Geometry, palette: numpy.ndarray, seed: int = None, fps: float = 20.0, *,
+                 density: float = 0.05, half_life: float = 0.15, background: typing.Sequence[int] = (0, 0, 0)):
+        super().__init__(geometry, palette, seed, fps)
+
+        self.density = density
+        self._decay = numpy.float32(0.5 ** (1 / (half_life * fps)))
+        self._background = numpy.asarray(background, dtype=numpy.float32)
+        self._frame = numpy.zeros((geometry.led_count, 3), dtype=numpy.float32)
+
+    def advance(self, frames: int):
+        self._frame *= self._decay ** frames
+        self.frame_number += frames
+
+    def render(self, time: float) -> numpy.ndarray:
+        self._frame *= self._decay
+
+        count = self.rng.binomial(self.geometry.led_count, self.density) if self.geometry.led_count else 0
+        if count:
+            leds = self.rng.choice(self.geometry.led_count, size=count, replace=False)
+            self._frame[leds] = self.palette[self.rng.integers(0, len(self.palette), count)]
+
+        return numpy.maximum(self._frame, self._background)
+
+
+class RandomDecay(Effect):
+    def __init__(self, geometry: Geometry, palette: numpy.ndarray, seed: int = None, fps: float = 20.0, *,
+                 rate: float = 5.0, half_life: float = 1.0):
+        super().__init__(geometry, palette, seed, fps)
+
+        self._hits_per_frame = rate / fps
+        self._decay = numpy.float32(0.5 ** (1 / (half_life * fps)))
+        self._colors = numpy.zeros((geometry.block_count, 3), dtype=numpy.float32)
+
+    def advance(self, frames: int):
+        self._colors *= self._decay ** frames
+        self.frame_number += frames
+
+    def render(self, time: float) -> numpy.ndarray:
+        self._colors *= self._decay
+
+        count = min(int(self.rng.poisson(self._hits_per_frame)), self.geometry.block_count)
+        if count:
+            blocks = self.rng.choice(self.geometry.block_count, size=count, replace=False)
+            self._colors[blocks] = self.palette[self.rng.integers(0, len(self.palette), count)]
+
+        return self.geometry.expand(self._colors)
@@ -0,0 +1,248 @@
+import ast
+import functools
+import json
+
+import numpy
+
+import effects
+
+MAX_LENGTH = 2000
+
+# variables of every element, x and y are the column and row of the block, u is the position of an LED in its block
+VARIABLES = ('x', 'y', 'u', 'i', 'n', 't', 'r', 'rows', 'cols', 'cx', 'cy', 'pi')
+
+# an expression sets a color by red/green/blue, by a palette position or by hue/saturation, value scales all of them
+OUTPUTS = ('red', 'green', 'blue', 'palette', 'hue', 'saturation', 'value')
+
+
+def _fract(value):
+    return value - numpy.floor(value)
+
+
+def _smoothstep(low, high, value):
+    value = numpy.clip((value - low) / (high - low), 0.0, 1.0)
+    return value * value * (3 - 2 * value)
+
+
+FUNCTIONS = {
+    'sin': numpy.sin,
+    'cos': numpy.cos,
+    'tan': numpy.tan,
+    'abs': numpy.abs,
+    'sqrt': lambda value: numpy.sqrt(numpy.maximum(value, 0.0)),
+    'exp': numpy.exp,
+    'log': lambda value: numpy.log(numpy.maximum(value, 1e-9)),
+    'floor': numpy.floor,
+    'fract': _fract,
+    'min': numpy.minimum,
+    'max': numpy.maximum,
+    'clamp': lambda value, low=0.0, high=1.0: numpy.clip(value, low, high),
+    'mix': lambda first, second, factor: first + (second - first) * factor,
+    'step': lambda edge, value: numpy.where(value >= edge, 1.0, 0.0),
+    'smoothstep': _smoothstep,
+    'wave': lambda value: 0.5 + 0.5 * numpy.sin(2 * numpy.pi * value),
+    'where': numpy.where,
+}
+
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+              ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+class _NumpyNumbers(ast.NodeTransformer):
+    # python floats raise on overflow and division by zero, numpy numbers give inf and nan like the arrays
+    def __init__(self):
+        self.numbers: dict[str, numpy.float64] = {}
+
+    def visit_Constant(self, node: ast.Constant) -> ast.Name:  # pylint: disable=invalid-name
+        name = f'_{len(self.numbers)}'
+        self.numbers[name] = numpy.float64(node.value)
+        return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+
+class Expression:
+    # parsed and checked once, afterwards every frame is a single evaluation of numpy operations on whole arrays
+    def __init__(self, source: str):
+        if len(source) > MAX_LENGTH:
+            raise ValueError(f'Expression is longer than {MAX_LENGTH} characters')
+
+        try:
+            tree = ast.parse('\n'.join(line.strip() for line in source.replace(';', '\n').splitlines()), mode='exec')
+        except SyntaxError as error:
+            raise ValueError(f'Invalid expression: {error.msg} at {error.lineno}:{error.offset}') from error
+
+        self.source = source
+        self.names: set[str] = set()
+        self.outputs: list[str] = []
+        numbers = _NumpyNumbers()
+        try:
+            for statement in tree.body:
+                self._check_statement(statement)
+            self.code = compile(numbers.visit(tree), '<expression>', 'exec')
+        except RecursionError as error:
+            raise ValueError('Expression is nested too deeply') from error
+
+        if not {'red', 'green', 'blue', 'palette', 'hue'} & set(self.outputs):
+            raise ValueError('Expression sets no color, assign red/green/blue, palette or hue')
+
+        self.uses_leds = 'u' in self.names
+        self._numbers = numbers.numbers
+        self._try()
+
+    def _check_statement(self, statement: ast.stmt):
+        if not isinstance(statement, ast.Assign) or len(statement.targets) != 1 \
+                or not isinstance(statement.targets[0], ast.Name):
+            raise ValueError(f'Line {statement.lineno}: only assignments like "hue = x / 10" are allowed')
+
+        self._check_value(statement.value)
+
+        name = statement.targets[0].id
+        if name.startswith('_') or name in VARIABLES or name in FUNCTIONS or name == 'dist':
+            raise ValueError(f'Line {statement.lineno}: {name} cannot be assigned')
+        self.outputs.append(name)
+
+    def _check_value(self, node: ast.AST):
+        # numbers, known names, arithmetic, single comparisons and calls of the functions, nothing else
+        match node:
+            case ast.Constant(value=bool()) | ast.Constant(value=str()):
+                raise ValueError(f'Column {node.col_offset}: only numbers are allowed')
+            case ast.Constant(value=int() | float()):
+                pass
+            case ast.Name(id=name):
+                if name not in VARIABLES and name not in self.outputs:
+                    raise ValueError(f'Column {node.col_offset}: unknown name {name}')
+                self.names.add(name)
+            case ast.BinOp(op=operator) | ast.UnaryOp(op=operator) if isinstance(operator, _OPERATORS):
+                for child in ast.iter_child_nodes(node):
+                    if not isinstance(child, ast.operator | ast.unaryop):
+                        self._check_value(child)
+            case ast.Compare(ops=[operator], left=left, comparators=[right]) if isinstance(operator, _OPERATORS):
+                self._check_value(left)
+                self._check_value(right)
+            case ast.Call(func=ast.Name(id=name), args=args, keywords=[]) if name in FUNCTIONS or name == 'dist':
+                # a further argument of a numpy function is its output array, which would overwrite a variable
+                if isinstance(FUNCTIONS.get(name), numpy.ufunc) and len(args) != FUNCTIONS[name].nin:
+                    raise ValueError(f'Column {node.col_offset}: {name} takes {FUNCTIONS[name].nin} arguments')
+                for argument in args:
+                    self._check_value(argument)
+            case _:
+                raise ValueError(f'Column {getattr(node, "col_offset", 0)}: {type(node).__name__} is not allowed')
+
+    def _try(self):
+        # calls with wrong arguments and results without a value per element only show up on evaluation, a trial on
+        # a 2x2 matrix finds them before a render loop runs the expression
+        x, y = numpy.array([0, 1, 0, 1], dtype=numpy.float32), numpy.array([0, 0, 1, 1], dtype=numpy.float32)
+        variables = {
+            'x': x, 'y': y, 'u': numpy.array([0, 1, 0, 1], dtype=numpy.float32),
+            'i': numpy.arange(4, dtype=numpy.float32), 'n': numpy.float64(4),
+            'r': numpy.array([0.1, 0.9, 0.4, 0.6], dtype=numpy.float32),
+            'rows': numpy.float64(2), 'cols': numpy.float64(2), 'cx': numpy.float64(0.5), 'cy': numpy.float64(0.5),
+            'pi': numpy.float64(numpy.pi), 't': numpy.float64(0), 'dist': functools.partial(_distance, x, y),
+        }
+        try:
+            for name, value in self.evaluate(variables).items():
+                if numpy.shape(value) not in ((), (4,)):
+                    raise ValueError(f'{name} is not a number')
+        except (ArithmeticError, TypeError, ValueError) as error:
+            raise ValueError(f'Invalid expression: {error}') from error
+
+    def __reduce__(self):
+        # the compiled code cannot be pickled, an effect sent to a render worker compiles its expression there
+        return compile_expression, (self.source,)
+
+    def evaluate(self, variables: dict) -> dict:
+        namespace = {'__builtins__': {}, **FUNCTIONS, **self._numbers, **variables}
+        with numpy.errstate(all='ignore'):
+            exec(self.code, namespace)  # pylint: disable=exec-used
+        return {name: namespace[name] for name in OUTPUTS if name in namespace}
+
+
+@functools.lru_cache(maxsize=64)
+def compile_expression(source: str) -> Expression:
+    return Expression(source)
+
+
+# named expressions of the configuration, a program can use the name instead of the expression itself
+library: dict[str, str] = {}
+
+
+def load_library(path: str) -> dict[str, str]:
+    # expressions stored through the API, an invalid one is left out instead of failing the startup
+    try:
+        with open(path, 'r', encoding='utf-8') as data:
+            stored = json.load(data)
+    except (OSError, ValueError) as error:
+        if not isinstance(error, FileNotFoundError):
+            print(f'Could not load expressions {path}: {error}')
+        return {}
+
+    valid = {}
+    for name, source in (stored.items() if isinstance(stored, dict) else ()):
+        try:
+            compile_expression(source)
+            valid[name] = source
+        except (TypeError, ValueError) as error:
+            print(f'Expression {name} in {path}: {error}')
+    return valid
+
+
+def _distance(x: numpy.ndarray, y: numpy.ndarray, px: float, py: float) -> numpy.ndarray:
+    return numpy.hypot(x - px, y - py)
+
+
+def hsv_to_rgb(hue: numpy.ndarray, saturation: numpy.ndarray, value: numpy.ndarray) -> numpy.ndarray:
+    hue = _fract(hue) * 6
+    channels = [value - value * saturation * numpy.clip(numpy.minimum(sector, 4 - sector), 0, 1)
+                for sector in ((offset + hue) % 6 for offset in (5, 3, 1))]
+    return numpy.stack(channels, axis=-1)
+
+
+class ExpressionEffect(effects.Effect):
+    in_worker = True
+    options = ('expression',)
+
+    def __init__(self, geometry: effects.Geometry, palette: numpy.ndarray, seed: int = None, fps: float = 20.0, *,
+                 expression: str = None):
+        if not expression:
+            raise ValueError('The expression program needs an expression or the name of a configured expression')
+
+        super().__init__(geometry, palette, seed, fps)
+        self.expression = compile_expression(library.get(expression, expression))
+
+        # expressions not depending on the position inside a block are evaluated once per block
+        if self.expression.uses_leds:
+            blocks, offset = geometry.led_block, geometry.led_offset
+        else:
+            blocks, offset = numpy.arange(geometry.block_count), numpy.zeros(geometry.block_count)
+        self._count = len(blocks)
+
+        x = geometry.block_cols[blocks].astype(numpy.float32)
+        y = geometry.block_rows[blocks].astype(numpy.float32)
+        self._variables = {
+            'x': x, 'y': y, 'u': offset.astype(numpy.float32),
+            'i': numpy.arange(self._count, dtype=numpy.float32), 'n': numpy.float64(self._count),
+            'r': self.rng.random(geometry.block_count, dtype=numpy.float32)[blocks],
+            'rows': numpy.float64(geometry.rows), 'cols': numpy.float64(geometry.cols),
+            'cx': numpy.float64((geometry.cols - 1) / 2), 'cy': numpy.float64((geometry.rows - 1) / 2),
+            'pi': numpy.float64(numpy.pi),
+            'dist': functools.partial(_distance, x, y),
+        }
+
+    def render(self, time: float) -> numpy.ndarray:
+        outputs = {name: numpy.broadcast_to(numpy.nan_to_num(numpy.asarray(value, dtype=numpy.float32)), self._count)
+                   for name, value in self.expression.evaluate({**self._variables, 't': numpy.float64(time)}).items()}
+        value = outputs.get('value', numpy.ones(self._count, dtype=numpy.float32))
+
+        if 'red' in outputs or 'green' in outputs or 'blue' in outputs:
+            zero = numpy.zeros(self._count, dtype=numpy.float32)
+            colors = numpy.stack([numpy.clip(outputs.get(name, zero), 0, 1) for name in ('red', 'green', 'blue')],
+                                 axis=-1) * 255
+        elif 'palette' in outputs:
+            position = _fract(outputs['palette']) * len(self.palette)
+            first = numpy.floor(position).astype(numpy.intp) % len(self.palette)
+            mix = (position - numpy.floor(position))[:, None]
+            colors = self.palette[first] * (1 - mix) + self.palette[(first + 1) % len(self.palette)] * mix
+        else:
+            colors = hsv_to_rgb(outputs['hue'], numpy.clip(outputs.get('saturation', 1.0), 0, 1), 1.0) * 255
+
+        colors = numpy.clip(colors * numpy.clip(value, 0, 1)[..., None], 0, 255).astype(numpy.float32)
+        return colors if self.expression.uses_leds else self.geometry.expand(colors)
@@ -0,0 +1,80 @@
+import bisect
+import enum
+
+import numpy
+
+
+class Easing(enum.Enum):
+    STEP = 'step'
+    LINEAR = 'linear'
+    EASE_IN = 'ease_in'
+    EASE_OUT = 'ease_out'
+    EASE_IN_OUT = 'ease_in_out'
+
+    def apply(self, progress: float) -> float:
+        # progress from one keyframe to the next between 0 and 1, mapped to the share of the next one
+        match self:
+            case Easing.STEP:
+                return float(progress >= 1)
+            case Easing.EASE_IN:
+                return progress * progress
+            case Easing.EASE_OUT:
+                return progress * (2 - progress)
+            case Easing.EASE_IN_OUT:
+                return progress * progress * (3 - 2 * progress)
+        return progress
+
+
+class KeyframeTrack:
+    # block colors a program reaches at given times, the render loop blends between them at its frame rate, so
+    # programs changing their blocks in steps of seconds move smoothly without rendering every frame themselves
+    def __init__(self):
+        self._times: list[float] = []
+        self._colors: list[numpy.ndarray] = []
+        self._easings: list[Easing] = []
+        self._blended: numpy.ndarray = None
+
+    def __bool__(self) -> bool:
+        return bool(self._times)
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    def add(self, colors: numpy.ndarray, time: float, easing: Easing = Easing.LINEAR):
+        # the easing is used on the way from the previous keyframe to this one, a keyframe replaces later ones
+        while self._times and self._times[-1] >= time:
+            self._times.pop()
+            self._colors.pop()
+            self._easings.pop()
+
+        self._times.append(time)
+        self._colors.append(numpy.array(colors, dtype=numpy.float32))
+        self._easings.append(easing)
+
+    def clear(self):
+        self._times.clear()
+        self._colors.clear()
+        self._easings.clear()
+
+    def sample(self, time: float) -> numpy.ndarray:
+        # keyframes before the one reached last are not needed any more
+        reached = bisect.bisect_right(self._times, time)
+        if reached > 1:
+            del self._times[:reached - 1], self._colors[:reached - 1], self._easings[:reached - 1]
+            reached = 1
+
+        if reached == 0:
+            return self._colors[0]
+        if reached == len(self._times):
+            return self._colors[-1]
+
+        (start, end), (first, second) = self._times[:2], self._colors[:2]
+        share = self._easings[1].apply((time - start) / (end - start))
+        if self._blended is None or self._blended.shape != first.shape:
+            self._blended = numpy.empty_like(first)
+
+        # one blend for all blocks, the blocks which do not change blend into themselves
+        numpy.subtract(second, first, out=self._blended)
+        self._blended *= share
+        self._blended += first
+        return self._blended
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import pickle
+
+import numpy
+import pydantic
+
+import effects
+import expressions
+import led_block
+import strip
+import sync
+
+# bump if the compiled layout changes, so old snapshots are not used anymore
+LAYOUT_VERSION = 10
+
+
+class Layout:
+    # validated configuration with precomputed geometries of all matrices
+    def __init__(self, strips: list[dict], blocks: list[dict], watch_interval: float,
+                 geometries: dict[str, effects.Geometry], power_supplies: list[dict] = None,
+                 named_expressions: dict[str, str] = None, aliases: dict[str, list[list[str]]] = None,
+                 render_workers: int = None, sync_settings: sync.SyncSettings = None, audio_sources: list[str] = None,
+                 profiling: bool = False):
+        self.strips = strips
+        self.blocks = blocks
+        self.watch_interval = watch_interval
+        self.geometries = geometries
+        self.power_supplies = power_supplies or []
+        self.expressions = named_expressions or {}
+        self.aliases = aliases or {}
+        self.render_workers = render_workers  # None uses one worker per core besides the one of the server
+        self.sync = sync_settings  # None runs on its own
+        self.audio_sources = audio_sources or []  # files and directories the audio program may read, - for stdin
+        self.profiling = profiling  # the profiling endpoints are only served if enabled
+
+
+class IntervalIndex:
+    # the LED ranges of all blocks on one strip sorted by their first LED, so out of range blocks, partial overlaps
+    # and exact aliases are found with one sort instead of comparing every pair of blocks
+    def __init__(self, count: int, matrices: dict[str, list[list[list[int]]]]):
+        self.count = count
+        self._names = list(matrices)
+
+        # one line per block with its matrix, row, column, start and end
+        lengths = [[len(row) for row in ranges] for ranges in matrices.values()]
+        row_lengths = numpy.array([length for matrix_lengths in lengths for length in matrix_lengths],
+                                  dtype=numpy.int64)
+        row_starts = numpy.cumsum(row_lengths) - row_lengths
+        table = numpy.zeros((int(row_lengths.sum()), 5), dtype=numpy.int64)
+        table[:, 0] = numpy.repeat(numpy.arange(len(lengths)), [sum(matrix_lengths) for matrix_lengths in lengths])
+        table[:, 1] = numpy.concatenate([numpy.repeat(numpy.arange(len(matrix_lengths)), matrix_lengths)
+                                         for matrix_lengths in lengths] or [numpy.zeros(0, numpy.int64)])
+        table[:, 2] = numpy.arange(len(table)) - numpy.repeat(row_starts, row_lengths)
+        table[:, 3:] = numpy.array([block for ranges in matrices.values() for row in ranges for block in row],
+                                   dtype=numpy.int64).reshape(-1, 2)
+        self._table = table
+        matrix = table[:, 0]
+        low, high = numpy.minimum(table[:, 3], table[:, 4]), numpy.maximum(table[:, 3], table[:, 4])
+        block_ids = numpy.arange(len(table)) - numpy.searchsorted(matrix, matrix)
+
+        # blocks without LEDs cannot collide, equal ranges keep the order of the configuration
+        used = numpy.flatnonzero(high > low)
+        order = used[numpy.lexsort((used, high[used], low[used]))]
+        sorted_low, sorted_high, sorted_matrix = low[order], high[order], matrix[order]
+
+        # a block with the same range as the one before is an alias of it
+        same = (sorted_low[1:] == sorted_low[:-1]) & (sorted_high[1:] == sorted_high[:-1])
+        first = numpy.concatenate(([True], ~same))[:len(order)]
+        representatives = order[first]
+
+        # a distinct range starting before the end of any range before it overlaps that one partially
+        reach = numpy.maximum.accumulate(high[representatives])
+        holders = numpy.maximum.accumulate(
+            numpy.where(high[representatives] == reach, numpy.arange(len(representatives)), 0))
+        overlapping = numpy.flatnonzero(low[representatives][1:] < reach[:-1]) + 1
+
+        self.out_of_range = [self._describe(block) for block in numpy.flatnonzero(high > count)]
+        self.overlaps = [(self._describe(representatives[holders[position - 1]]),
+                          self._describe(representatives[position])) for position in overlapping]
+        groups = numpy.cumsum(first) - 1
+        aliased = numpy.bincount(groups)[groups] > 1 if len(order) else numpy.zeros(0, dtype=bool)
+        self.aliases = [[self._describe(block) for block in group] for group in
+                        numpy.split(order[aliased], numpy.flatnonzero(first[aliased])[1:]) if len(group)]
+
+        # of aliases in the same matrix only the last block is written, like before the last one was shown
+        shadowing = same & (sorted_matrix[1:] == sorted_matrix[:-1])
+        shadowed = order[:-1][shadowing]
+        self.shadowed = {self._names[matrix_id]: block_ids[shadowed[matrix[shadowed] == matrix_id]].tolist()
+                         for matrix_id in numpy.unique(matrix[shadowed]).tolist()}
+
+    def _describe(self, block: int) -> str:
+        matrix_id, row_index, col_index, start, end = self._table[block].tolist()
+        return f'{self._names[matrix_id]}[{row_index}][{col_index}] ({start}, {end})'
+
+
+def compile_layout(json_data: dict, config_file: str = 'config') -> Layout:
+    if 'strips' not in json_data:
+        raise ValueError(f'missing entry strips in {config_file}')
+
+    if 'blocks' not in json_data:
+        raise ValueError(f'missing entry areas in {config_file}')
+
+    power_supplies = []
+    for data in json_data.get('power_supplies', []):
+        values, _, error = pydantic.validate_model(strip.PowerSupply, data)
+        if error:
+            raise error
+        power_supplies.append(values)
+
+    strips, counts = [], {}
+    for data in json_data['strips']:
+        values, _, error = pydantic.validate_model(strip.Strip, data)
+        if error:
+            raise error
+        if values['power_supply'] and values['power_supply'] not in {supply['name'] for supply in power_supplies}:
+            raise ValueError(f'Power supply {values["power_supply"]} of strip {values["identifier"]} is unknown '
+                             f'in {config_file}')
+        strips.append(values)
+        counts[values['identifier']] = values['count']
+
+    blocks = []
+    for data in json_data['blocks']:
+        values = led_block.LedMatrix.validate_config(data)
+        ranges = [[[block.start, block.end] for block in row] for row in values['blocks']]
+        blocks.append({**values, 'blocks': ranges, 'regions': [region.dict() for region in values['regions']]})
+
+    aliases, shadowed = {}, {}
+    for identifier, count in counts.items():
+        index = IntervalIndex(count, {block['name']: block['blocks'] for block in blocks
+                                      if block['strip_name'] == identifier})
+        if index.out_of_range:
+            raise ValueError(f'Blocks beyond the {count} LEDs of strip {identifier} in {config_file}: '
+                             f'{", ".join(index.out_of_range[:5])}')
+        if index.overlaps:
+            raise ValueError(f'Partially overlapping blocks on strip {identifier} in {config_file}: '
+                             f'{", ".join(f"{first} and {second}" for first, second in index.overlaps[:5])}')
+        if index.aliases:
+            aliases[identifier] = index.aliases
+        shadowed.update(index.shadowed)
+
+    geometries = {block['name']: effects.Geometry(block['blocks'], shadowed.get(block['name'], ()))
+                  for block in blocks}
+
+    named_expressions = json_data.get('expressions', {})
+    for name, source in named_expressions.items():
+        try:
+            expressions.compile_expression(source)
+        except ValueError as error:
+            raise ValueError(f'Expression {name} in {config_file}: {error}') from error
+
+    render_workers = json_data.get('render_workers')
+    if render_workers is not None and (not isinstance(render_workers, int) or render_workers < 0):
+        raise ValueError(f'render_workers in {config_file} must be a number of processes, 0 renders everything '
+                         f'in the server process')
+
+    sync_settings = sync.SyncSettings(**json_data['sync']) if json_data.get('sync') else None
+
+    audio_sources = json_data.get('audio_sources', [])
+    if not isinstance(audio_sources, list) or not all(isinstance(source, str) for source in audio_sources):
+        raise ValueError(f'audio_sources in {config_file} must be a list of files and directories, - for stdin')
+
+    profiling = json_data.get('profiling', False)
+    if not isinstance(profiling, bool):
+        raise ValueError(f'profiling in {config_file} must be true or false')
+
+    return Layout(strips, blocks, json_data.get('watch_interval', 0), geometries, power_supplies, named_expressions,
+                  aliases, render_workers, sync_settings, audio_sources, profiling)
+
+
+def get_snapshot_path(config_path: str, content: bytes) -> str:
+    digest = hashlib.sha256(content + str(LAYOUT_VERSION).encode()).hexdigest()[:16]
+    directory, file_name = os.path.split(config_path)
+    return os.path.join(directory, '.cache', f'{file_name}.{digest}.pickle')
+
+
+def load(config_path: str) -> Layout:
+    with open(config_path, 'rb') as data:
+        content = data.read()
+
+    snapshot_path = get_snapshot_path(config_path, content)
+    try:
+        with open(snapshot_path, 'rb') as snapshot:
+            return pickle.load(snapshot)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+
+    compiled = compile_layout(json.loads(content), os.path.basename(config_path))
+
+    # the snapshot is only a cache, a read only config directory must not break the startup
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        temporary_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as snapshot:
+            pickle.dump(compiled, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, snapshot_path)
+
+        directory, snapshot_name = os.path.split(snapshot_path)
+        prefix = f'{os.path.basename(config_path)}.'
+        for outdated in os.listdir(directory):
+            if outdated.startswith(prefix) and outdated.endswith('.pickle') and outdated != snapshot_name:
+                os.remove(os.path.join(directory, outdated))
+    except OSError as error:
+        print(f'Could not store layout snapshot {snapshot_path}: {error}')
+
+    return compiled
@@ -1,14 +1,27 @@
+# pylint: disable=too-many-lines
 import asyncio
 import enum
+import functools
 import math
 import random
 import typing
 
 import fastapi
-import fastapi.templating
+import numpy
 import pydantic
 
+import audio
+import clock
+import compositing
+import effects
+import expressions
+import keyframes
+import pages
+import quality
+import state
 import strip
+import sync
+import workers
 
 RED = 'red'
 GREEN = 'green'
@@ -120,6 +133,14 @@ class ColorConverter:
     def get_color(color_name: ColorName) -> Color:
         return ColorConverter._color_codes.get(color_name, None)
 
+    @classmethod
+    def get_palette(cls, colors: list[Color] = None) -> numpy.ndarray:
+        palette = [color.as_tuple for color in colors or [] if color and not color.is_black]
+        if not palette:
+            palette = [color.as_tuple for color in cls._available_colors if not color.is_black]
+
+        return numpy.array(palette, dtype=numpy.float32)
+
     @classmethod
     def get_random(cls, exclude_color: Color = None) -> Color:
         color = random.choice(cls._available_colors)
@@ -135,6 +156,11 @@ class BlockProgram(enum.Enum):
     COLOR_RUN = 'color_run'
     FADING = 'fading'
     RANDOM = 'random'
+    TWINKLE = 'twinkle'
+    SPARKLE = 'sparkle'
+    RANDOM_DECAY = 'random_decay'
+    AUDIO = 'audio'
+    EXPRESSION = 'expression'
 
 
 class LedBlock(pydantic.BaseModel):  # pylint: disable=no-member
@@ -155,8 +181,40 @@ class LedBlock(pydantic.BaseModel):  # pylint: disable=no-member
         return abs(self.end - self.start)
 
 
+class Region(pydantic.BaseModel):  # pylint: disable=no-member
+    name: str
+    rows: tuple[int, int] = None
+    cols: tuple[int, int] = None
+    blocks: list[tuple[int, int]] = None
+
+    def contains(self, row: int, col: int) -> bool:
+        if self.blocks is not None:
+            return (row, col) in self.blocks
+
+        first_row, last_row = self.rows or (row, row)
+        first_col, last_col = self.cols or (col, col)
+        return first_row <= row <= last_row and first_col <= col <= last_col
+
+
 known_blocks: dict[str, 'LedMatrix'] = {}
 
+# last color preview of every matrix with its creation time
+previews: dict[str, tuple[float, list]] = {}
+
+effect_programs: dict[BlockProgram, type[effects.Effect]] = {
+    BlockProgram.TWINKLE: effects.Twinkle,
+    BlockProgram.SPARKLE: effects.Sparkle,
+    BlockProgram.RANDOM_DECAY: effects.RandomDecay,
+    BlockProgram.AUDIO: audio.AudioSpectrum,
+    BlockProgram.EXPRESSION: expressions.ExpressionEffect,
+}
+
+# programs changing their blocks in steps, blended from one step to the next with their default easing
+keyframe_programs: dict[BlockProgram, keyframes.Easing] = {
+    BlockProgram.RANDOM: keyframes.Easing.LINEAR,
+    BlockProgram.COLOR_RUN: keyframes.Easing.EASE_IN_OUT,
+}
+
 
 class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
     name: str = 'default'
@@ -164,22 +222,89 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
     cols: int = 5
     blocks: list[list[LedBlock]] = []
     strip_name: str = 'default'
+    fps: float = pydantic.Field(default=30.0, gt=0)
+    priority: int = pydantic.Field(default=0, title='Matrices with a lower priority are throttled first under load')
+    regions: list[Region] = []
 
     _strip: strip.Strip = None
     _act_task: asyncio.Task = None
     _is_running: bool = False
+    _geometry: effects.Geometry = None
+    _effect: effects.Effect = None
+    _layers: compositing.LayerStack = None
+    _keyframes: keyframes.KeyframeTrack = None
+    _render_task: asyncio.Task = None
+    _input: asyncio.Event = None
+    _inputs: int = 0
+    _shown_colors: numpy.ndarray = None
+    _frame: numpy.ndarray = None
+    _block_levels: numpy.ndarray = None
+    _parent: 'LedMatrix' = None
+    _parent_leds: numpy.ndarray = None
+    _regions: dict[str, 'LedMatrix'] = None
+    _is_active: bool = False
+    _program_settings: dict = None
+    _started: float = None
+
+    def __init__(self, strip_obj: strip.Strip = None, geometry: effects.Geometry = None, **data):
+        super().__init__(**self._convert_blocks(data))
+        self._geometry = geometry
+
+        self._strip = strip_obj
+        self._layers = compositing.LayerStack()
+        self._keyframes = keyframes.KeyframeTrack()
+        known_blocks[self.name] = self
+        pages.cache.clear()
+
+        self._regions = {}
+        for region in self.regions:
+            self._regions[region.name] = self._create_region(region)
 
-    def __init__(self, strip_obj: strip.Strip = None, **data):
+    @staticmethod
+    def _convert_blocks(data: dict) -> dict:
         if 'blocks' in data \
                 and isinstance(data['blocks'], list) \
                 and all(isinstance(content, list) for content in data['blocks']) \
                 and all(isinstance(content, list) for rows in data['blocks'] for content in rows):
-            data['blocks'] = [[{'start': col[0], 'end': col[1]} for col in row] for row in data['blocks']]
+            data = {**data, 'blocks': [[{'start': col[0], 'end': col[1]} for col in row] for row in data['blocks']]}
+        return data
 
-        super().__init__(**data)
+    @classmethod
+    def validate_config(cls, data: dict) -> dict:
+        values, _, error = pydantic.validate_model(cls, cls._convert_blocks(data))
+        if error:
+            raise error
 
-        self._strip = strip_obj
-        known_blocks[self.name] = self
+        for region in values['regions']:
+            cls._select_region_blocks(values['name'], values['blocks'], region)
+
+        return values
+
+    @staticmethod
+    def _select_region_blocks(name: str, blocks: list[list[LedBlock]], region: Region) -> list[list[tuple[int, int]]]:
+        selected = [[(row_index, col_index) for col_index, _ in enumerate(row) if region.contains(row_index, col_index)]
+                    for row_index, row in enumerate(blocks)]
+        selected = [row for row in selected if row]
+        if not selected:
+            raise ValueError(f'Region {region.name} of {name} does not contain any block')
+        return selected
+
+    def _create_region(self, region: Region) -> 'LedMatrix':
+        selected = self._select_region_blocks(self.name, self.blocks, region)
+
+        region_matrix = LedMatrix(
+            name=f'{self.name}.{region.name}',
+            rows=len(selected),
+            cols=max(len(row) for row in selected),
+            blocks=[[[self.blocks[i][j].start, self.blocks[i][j].end] for (i, j) in row] for row in selected],
+            strip_name=self.strip_name,
+            fps=self.fps,
+        )
+
+        block_ids = [self.geometry.block_id(i, j) for row in selected for (i, j) in row]
+        region_matrix._parent = self
+        region_matrix._parent_leds = numpy.flatnonzero(numpy.isin(self.geometry.led_block, block_ids))
+        return region_matrix
 
     @property
     def running_task(self) -> str:
@@ -187,13 +312,251 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
             return 'No running task'
         return f'Running task: {self._act_task.get_name()}'
 
+    @property
+    def effect_seed(self) -> typing.Optional[int]:
+        if not self._effect or not self._act_task or self._act_task.done():
+            return None
+        return self._effect.seed
+
     @property
     def all_blocks(self) -> typing.Generator[LedBlock, None, None]:
         for row in self.blocks:
             for block in row:
                 yield block
 
-    async def run_program(self, program: BlockProgram, colors: list[Color] = None):
+    @property
+    def geometry(self) -> effects.Geometry:
+        if not self._geometry:
+            self._geometry = effects.Geometry([[(block.start, block.end) for block in row] for row in self.blocks])
+        return self._geometry
+
+    @property
+    def layers(self) -> list[dict]:
+        return [layer.description for layer in self._layers.layers]
+
+    @property
+    def region_names(self) -> list[str]:
+        return [region.name for region in self._regions.values()]
+
+    @property
+    def shown_colors(self) -> list[list[Color]]:
+        if not self._is_composited or self._shown_colors is None:
+            return [[block.color for block in row] for row in self.blocks]
+
+        colors = iter(self._shown_colors.tolist())
+        return [[Color.construct(red=red, green=green, blue=blue) for red, green, blue in
+                 (next(colors) for _ in row)] for row in self.blocks]
+
+    @property
+    def is_region(self) -> bool:
+        return self._parent is not None
+
+    @property
+    def with_regions(self) -> list['LedMatrix']:
+        return [self, *self._regions.values()]
+
+    @property
+    def tasks(self) -> list[asyncio.Task]:
+        return [task for matrix in self.with_regions for task in (matrix._act_task, matrix._render_task)
+                if task and not task.done()]
+
+    @property
+    def program_settings(self) -> typing.Optional[dict]:
+        return self._program_settings
+
+    @property
+    def state(self) -> typing.Optional[dict]:
+        # program and layers with the time their effects started, restarts and followers resume at the same phase
+        if not self._program_settings and not self._layers:
+            return None
+
+        program = None
+        if settings := self._program_settings:
+            program = {**settings, 'program': settings['program'].value,
+                       'colors': [color.as_tuple for color in settings['colors'] or []]}
+            if settings.get('easing'):
+                program['easing'] = settings['easing'].value
+            if self._effect is not None:
+                program['started'] = self._started
+
+        return {'program': program,
+                'layers': [{**layer.settings, 'started': layer.started} for layer in self._layers.layers]}
+
+    async def restore(self, saved: dict):
+        if program := saved.get('program'):
+            await self.run_program(**self._parse_settings(program))
+
+        for layer in saved.get('layers', []):
+            await self.add_layer(**self._parse_settings(layer))
+
+    @staticmethod
+    def _parse_settings(settings: dict) -> dict:
+        colors = [Color(red=red, green=green, blue=blue) for red, green, blue in settings.get('colors') or []]
+        parsed = {**settings, 'program': BlockProgram(settings['program']), 'colors': colors}
+        if 'blend_mode' in settings:
+            parsed['blend_mode'] = compositing.BlendMode(settings['blend_mode'])
+        if settings.get('easing'):
+            parsed['easing'] = keyframes.Easing(settings['easing'])
+        for key in ('rows', 'cols'):
+            if parsed.get(key):
+                parsed[key] = tuple(parsed[key])
+        return parsed
+
+    def has_geometry(self, ranges: list[list[list[int]]]) -> bool:
+        return [[(block.start, block.end) for block in row] for row in self.blocks] \
+            == [[tuple(block_range) for block_range in row] for row in ranges]
+
+    def apply_settings(self, strip_obj: strip.Strip, **data):
+        # used by a configuration reload if the geometry is unchanged, running programs keep running
+        values = self.validate_config(data)
+
+        self._strip = strip_obj
+        self.rows, self.cols, self.strip_name, self.fps, self.priority = \
+            values['rows'], values['cols'], values['strip_name'], values['fps'], values['priority']
+
+        regions = {region.name: region for region in values['regions']}
+        for old_region in self.regions:
+            if regions.get(old_region.name) != old_region:
+                self._regions.pop(old_region.name).detach()
+
+        for region in regions.values():
+            if region.name in self._regions:
+                self._regions[region.name].fps = self.fps
+            else:
+                self._regions[region.name] = self._create_region(region)
+
+        self.regions = list(regions.values())
+
+    def detach(self):
+        # used if the matrix is replaced, afterwards nothing is written to the strip anymore
+        for region in self._regions.values():
+            region.detach()
+
+        self._deactivate()
+        self._effect = None
+        self._strip = None
+        if self._render_task:
+            self._render_task.cancel()
+
+        if known_blocks.get(self.name) is self:
+            del known_blocks[self.name]
+            previews.pop(self.name, None)
+            quality.monitor.forget(self.name)
+            pages.cache.clear()
+
+    async def redraw(self):
+        await self._update_strip()
+
+    @property
+    def is_rendering(self) -> bool:
+        if self._parent:
+            return self._parent.is_rendering
+        return self._render_task is not None and not self._render_task.done()
+
+    @property
+    def frame_rate(self) -> float:
+        # the configured fps, limited to what the strip can show according to its calibration
+        power_strip = self._power_strip
+        max_fps = power_strip.max_fps if power_strip else None
+        return min(self.fps, max_fps) if max_fps else self.fps
+
+    @property
+    def render_rate(self) -> float:
+        return self.frame_rate / self._frame_divider
+
+    @property
+    def _frame_divider(self) -> int:
+        top_priority = max((matrix.priority for matrix in known_blocks.values() if not matrix.is_region), default=0)
+        return quality.monitor.frame_divider(self.priority, top_priority)
+
+    @property
+    def is_dithered(self) -> bool:
+        power_strip = self._power_strip
+        return bool(power_strip and power_strip.dithering)
+
+    @property
+    def _power_strip(self) -> typing.Optional[strip.Strip]:
+        return self._parent._power_strip if self._parent else self._strip
+
+    @property
+    def _active_regions(self) -> list['LedMatrix']:
+        return [region for region in self._regions.values() if region._is_active or region._layers]
+
+    @property
+    def _is_composited(self) -> bool:
+        return bool(self._layers) or bool(self._active_regions)
+
+    def create_effect(self, program: BlockProgram, colors: list[Color] = None, seed: int = None,
+                      **options) -> effects.Effect:
+        if program not in effect_programs:
+            raise ValueError(f'Program {program.value} is not a frame based effect. '
+                             f'Valid programs are: {", ".join(effect.value for effect in effect_programs)}')
+
+        options = {key: value for key, value in options.items() if value is not None}
+        if unknown := sorted(set(options) - set(effect_programs[program].options)):
+            raise ValueError(f'Program {program.value} does not take {", ".join(unknown)}')
+
+        effect = effect_programs[program](self.geometry, ColorConverter.get_palette(colors), seed=seed,
+                                          fps=self.frame_rate,
+                                          **options)
+        return workers.pool.wrap(effect) if effect.in_worker else effect
+
+    @staticmethod
+    async def _start_workers(program: BlockProgram):
+        # the worker processes are started in a thread before the first effect needs one
+        if program in effect_programs and effect_programs[program].in_worker:
+            await workers.pool.start()
+
+    async def add_layer(self, program: BlockProgram, colors: list[Color] = None, seed: int = None,
+                        blend_mode: compositing.BlendMode = compositing.BlendMode.ALPHA, opacity: float = 1.0,
+                        rows: tuple[int, int] = None, cols: tuple[int, int] = None, source: str = None,
+                        expression: str = None, started: float = None) -> int:
+        await self._start_workers(program)
+        effect = self.create_effect(program, colors, seed, source=source, expression=expression)
+        mask = self.geometry.mask(rows, cols) if rows or cols else None
+        settings = {'program': program.value, 'colors': [color.as_tuple for color in colors or []],
+                    'seed': effect.seed, 'blend_mode': blend_mode.value, 'opacity': opacity, 'rows': rows, 'cols': cols,
+                    'source': source, 'expression': expression}
+
+        if power_strip := self._power_strip:
+            await power_strip.switch_on()
+
+        self._resume(effect, started)
+        self._listen(effect)
+        index = self._layers.add(compositing.Layer(effect, blend_mode=blend_mode, opacity=opacity, mask=mask,
+                                                   settings=settings,
+                                                   started=sync.node.time() if started is None else started))
+        self._start_renderer()
+        state.store.mark_changed()
+        return index
+
+    def remove_layer(self, index: int):
+        self._layers.remove(index)
+        state.store.mark_changed()
+
+    def clear_layers(self):
+        self._layers.clear()
+        state.store.mark_changed()
+
+    async def run_program(self, program: BlockProgram, colors: list[Color] = None, seed: int = None,
+                          source: str = None, expression: str = None, started: float = None,
+                          easing: keyframes.Easing = None):
+        # the effect is created first, so a program with invalid settings does not change the running one
+        await self._start_workers(program)
+        effect = self.create_effect(program, colors, seed, source=source, expression=expression) \
+            if program in effect_programs else None
+
+        # a region owns its part of the parent matrix as long as it is not stopped
+        self._is_active = program != BlockProgram.STOP
+        self._program_settings = {'program': program, 'colors': colors, 'seed': seed,
+                                  'source': source, 'expression': expression} if self._is_active else None
+        easing = easing or keyframe_programs.get(program)
+        if self._is_active and program in keyframe_programs:
+            self._program_settings['easing'] = easing
+        if self._parent and self._is_active:
+            self._start_renderer()
+        state.store.mark_changed()
+
         match program:
             case BlockProgram.STOP:
                 asyncio.create_task(self._run_new_task(self._run_stop()))
@@ -204,11 +567,13 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
                 else:
                     color = ColorConverter.get_random(exclude_color=ColorConverter.get_color(ColorName.BLACK))
 
+                self._program_settings['colors'] = [color]
                 asyncio.create_task(self._run_new_task(self._run_fixed(color)))
 
             case BlockProgram.RANDOM:
                 if colors and len(colors) > 1 and not colors[0].is_black and not colors[1].is_black:
-                    asyncio.create_task(self._run_new_task(self._run_random_with_color(colors[0], colors[1])))
+                    asyncio.create_task(self._run_new_task(self._run_random_with_color(colors[0], colors[1],
+                                                                                          easing)))
 
                 else:
                     asyncio.create_task(self._run_new_task(self._run_random()))
@@ -224,7 +589,8 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
                 else:
                     color2 = ColorConverter.get_random(exclude_color=ColorConverter.get_color(ColorName.BLACK))
 
-                asyncio.create_task(self._run_new_task(self._run_color_run(color, color2)))
+                self._program_settings['colors'] = [color, color2]
+                asyncio.create_task(self._run_new_task(self._run_color_run(color, color2, easing)))
 
             case BlockProgram.FADING:
                 if colors and not colors[0].is_black:
@@ -237,16 +603,24 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
                 else:
                     color2 = ColorConverter.get_random(exclude_color=ColorConverter.get_color(ColorName.BLACK))
 
+                self._program_settings['colors'] = [color, color2]
                 asyncio.create_task(self._run_new_task(self._run_fading(color, color2)))
 
+            case BlockProgram.TWINKLE | BlockProgram.SPARKLE | BlockProgram.RANDOM_DECAY | BlockProgram.AUDIO \
+                    | BlockProgram.EXPRESSION:
+                self._program_settings['seed'] = effect.seed
+                asyncio.create_task(self._run_new_task(self._run_effect(effect, started)))
+
     async def _run_new_task(self, task: typing.Coroutine):
-        if not self._is_running:
-            if self._strip:
-                await self._strip.switch_on()
+        if power_strip := self._power_strip:
+            await power_strip.switch_on()
 
         if self._act_task:
             await self._stop_act_task()
 
+        self._effect = None
+        self._block_levels = None
+        self._keyframes.clear()
         self._is_running = True
         self._act_task = asyncio.create_task(task)
 
@@ -254,12 +628,16 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
         counter = 10  # Wait maximum 1 seconds and cancel afterwards
         while self._act_task and not self._act_task.done() and counter > 0:
             self._is_running = False
-            await asyncio.sleep(0.1)
+            await clock.current.sleep(0.1)
             counter -= 1
 
         self._act_task.cancel()
 
     async def _run_stop(self):
+        self._layers.clear()
+        for region in self._regions.values():
+            region._deactivate()
+
         for block in self.all_blocks:
             block.color = ColorConverter.get_color(ColorName.BLACK)
 
@@ -273,8 +651,7 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
         for block in self.all_blocks:
             block.color = color
 
-        if self._strip:
-            self._strip.update_strip()
+        await self._update_strip()
 
         self._is_running = False
 
@@ -285,52 +662,38 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
                 row = random.choice(self.blocks)
                 cell = random.choice(row)  # type: LedBlock
                 cell.color = ColorConverter.get_random(exclude_color=cell.color)
+                self._update_block(cell)
 
-                if self._strip:
-                    self._strip.set_colors(
-                        color=cell.color.as_tuple,
-                        start_index=cell.abs_start,
-                        length=cell.number_of_leds
-                    )
-                    self._strip.update_strip()
-
-            await asyncio.sleep(0.05)
+            await clock.current.sleep(0.05)
             count = (count + 1) % 20
 
         self._is_running = False
 
-    async def _run_random_with_color(self, color, color2):
+    async def _run_random_with_color(self, color, color2, easing: keyframes.Easing = keyframes.Easing.LINEAR):
+        # the first frame is shown once complete
         for block in self.all_blocks:
             random_bool = random.random() < 0.5
             block.color = color if random_bool else color2
 
-            await self._update_strip()
+        await self._show_keyframe(0.5, easing)
 
         while self._is_running:
             row = random.choice(self.blocks)
             cell = random.choice(row)  # type: LedBlock
             cell.color = color2 if cell.color == color else color
+            await self._show_keyframe(0.5, easing)
 
-            if self._strip:
-                self._strip.set_colors(
-                    color=cell.color.as_tuple,
-                    start_index=cell.abs_start,
-                    length=cell.number_of_leds
-                )
-                self._strip.update_strip()
-
-            await asyncio.sleep(0.5)
-
+        self._keyframes.clear()
         self._is_running = False
 
-    async def _run_color_run(self, color: Color, color2: Color):
+    async def _run_color_run(self, color: Color, color2: Color,
+                             easing: keyframes.Easing = keyframes.Easing.EASE_IN_OUT):
         max_index = self.rows + self.cols - 1
 
         for index in range(max_index // 2):
             for (i, j) in self._get_indices_by_sum_value(index):
                 self.blocks[i][j].color = color
-            await self._update_strip()
-            await asyncio.sleep(0.5)
+            await self._show_keyframe(0.5, easing)
 
         while self._is_running:
             for index in range(max_index):
@@ -338,11 +701,20 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
                     self.blocks[i][j].color = color
                 for (i, j) in self._get_indices_by_sum_value(index):
                     self.blocks[i][j].color = color2
-                await self._update_strip()
-                await asyncio.sleep(0.5)
+                await self._show_keyframe(0.5, easing)
 
+        self._keyframes.clear()
         self._is_running = False
 
+    async def _show_keyframe(self, duration: float, easing: keyframes.Easing):
+        # the colors of the blocks are reached after the duration, the render loop blends towards them meanwhile;
+        # the first keyframe of a program is shown right away
+        now = clock.current.time()
+        colors = numpy.array([block.color.as_tuple for block in self.all_blocks], dtype=numpy.float32)
+        self._keyframes.add(colors, now + duration if self._keyframes else now, easing)
+        self._start_renderer()
+        await clock.current.sleep(duration)
+
     def _get_indices_by_sum_value(self, sum_value) -> typing.Generator[tuple[int, int], None, None]:
         return ((i, j) for i in range(self.rows) for j in range(self.cols) if i + j == sum_value)
 
@@ -350,35 +722,217 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
         while self._is_running:
             for start_position in range(10):
                 row_targets = [self.get_distance(start_position, i, self.rows) * 2 for i in range(self.rows)]
-                for time in range(10):  # for a smoother fading effect
-                    for row_index, row in enumerate(self.blocks):
-                        mixed_factor = \
-                            (row_targets[row_index]
-                             - time / 10 * (row_targets[(row_index + 1) % self.rows] - row_targets[row_index])) \
-                            / self.rows
-                        new_color = color.get_mixed_color(color2=color2, mixed_factor=mixed_factor)
+                # sub-steps for a smoother fading effect, under load fewer of them are shown for longer
+                stride = 10 // quality.monitor.interpolation_steps(10)
+                for time in range(0, 10, stride):
+                    # a dithered strip shows the fading at the frame rate, in between the sub-steps as well
+                    frames = max(round(0.2 * stride * self.frame_rate), 1) if self.is_dithered else 1
+                    for frame in range(frames):
+                        self._set_fading_colors(color, color2, row_targets, time + stride * frame / frames)
+                        await self._update_strip()
+                        await clock.current.sleep(0.2 * stride / frames)
+
+        self._is_running = False
 
-                        for block in row:
-                            block.color = new_color
+    def _set_fading_colors(self, color: Color, color2: Color, row_targets: list[int], time: float):
+        # on a dithered strip the blocks keep their exact float colors next to the 8 bit ones
+        first, second = numpy.array(color.as_tuple), numpy.array(color2.as_tuple)
+        row_levels = []
+        for row_index, row in enumerate(self.blocks):
+            mixed_factor = \
+                (row_targets[row_index]
+                 - time / 10 * (row_targets[(row_index + 1) % self.rows] - row_targets[row_index])) \
+                / self.rows
+            new_color = color.get_mixed_color(color2=color2, mixed_factor=mixed_factor)
+            row_levels.extend([first + (second - first) * max(0.0, min(mixed_factor, 1.0))] * len(row))
 
-                    await self._update_strip()
-                    await asyncio.sleep(0.2)
+            for block in row:
+                block.color = new_color
+
+        self._block_levels = numpy.array(row_levels, dtype=numpy.float32) if self.is_dithered else None
+
+    async def _run_effect(self, effect: effects.Effect, started: float = None):
+        # the effect itself is rendered by the render loop, this task only represents the running program
+        self._resume(effect, started)
+        self._listen(effect)
+        self._effect = effect
+        self._started = sync.node.time() if started is None else started
+        self._start_renderer()
+        state.store.mark_changed()
+
+        try:
+            while self._is_running:
+                await clock.current.sleep(effect.frame_interval)
+        finally:
+            if self._effect is effect:
+                self._effect = None
+            effect.close()
 
         self._is_running = False
 
-    async def _update_strip(self):
-        if not self._strip:
+    @staticmethod
+    def _resume(effect: effects.Effect, started: float = None):
+        # a resumed effect continues at the phase it would have reached if it had never stopped
+        if started is not None and not sync.node.is_synchronized:
+            effect.advance(max(round((sync.node.time() - started) * effect.fps), 0))
+
+    def _listen(self, effect: effects.Effect):
+        # new input of an effect wakes the render loop, which is the one of the parent for a region
+        if self._parent:
+            self._parent._listen(effect)
             return
 
-        for block in self.all_blocks:
-            self._strip.set_colors(
-                color=block.color.as_tuple,
-                start_index=block.abs_start,
-                length=block.number_of_leds
-            )
+        if effect.listen(functools.partial(asyncio.get_running_loop().call_soon_threadsafe, self._on_input)):
+            self._input = self._input or asyncio.Event()
+
+    def _on_input(self):
+        self._inputs += 1
+        if self._input is not None:
+            self._input.set()
 
+    def _deactivate(self):
+        self._is_active = False
+        self._is_running = False
+        self._layers.clear()
+        if self._act_task:
+            self._act_task.cancel()
+
+    def _start_renderer(self):
+        if self._parent:
+            self._parent._start_renderer()
+        elif not self.is_rendering:
+            self._render_task = asyncio.create_task(self._render_loop(), name=f'render {self.name}')
+
+    async def _render_loop(self):
+        deadline = clock.current.time()
+        shown = None  # frame of the shared timeline shown last
+
+        while self._effect is not None or self._keyframes or self._is_composited:
+            # a throttled matrix shows fewer frames, each one standing for several time steps of its effects
+            steps = self._frame_divider
+            interval = steps / self.frame_rate
+            if sync.node.is_synchronized:
+                shown, delay = self._render_synchronized(shown, steps)
+            else:
+                self._render_frame(steps)
+                deadline += interval
+                delay = deadline - clock.current.time()
+
+            quality.monitor.report_frame(self.name, max(-delay, 0.0), interval)
+            if delay < 0:  # do not try to catch up with a burst of frames after falling behind
+                deadline = clock.current.time()
+                delay = 0
+            if self._input is None or sync.node.is_synchronized:
+                await clock.current.sleep(delay)
+            elif await self._wait_for_input(deadline, interval):
+                deadline = clock.current.time()
+
+        self._render_task = None
+        self._input = None
+        await self._update_strip()
+
+    async def _wait_for_input(self, deadline: float, interval: float) -> bool:
+        # frames of an input driven effect follow its input: new input is shown right away, at most a tenth of an
+        # interval before the frame time, input faster than the frame rate and no input keep the frame rate
+        await clock.current.sleep(max(deadline - interval / 10 - clock.current.time(), 0))
+        if self._inputs > 1:
+            await clock.current.sleep(max(deadline - clock.current.time(), 0))
+            follows = False
+        else:
+            follows = self._inputs == 1 or await clock.current.wait(self._input, interval)
+
+        self._inputs = 0
+        self._input.clear()
+        return follows
+
+    def _render_synchronized(self, shown: typing.Optional[int], steps: int) -> tuple[int, float]:
+        # every node shows the frames of the shared timeline at the same time, frames a node is late for are skipped
+        frame = round(sync.node.time() * self.frame_rate)
+        if shown is None or frame > shown:
+            steps = steps if shown is None else frame - shown
+            for matrix in self.with_regions:
+                anchored = [(layer.effect, layer.started) for layer in matrix._layers.layers]
+                if matrix._effect is not None and matrix._started is not None:
+                    anchored.append((matrix._effect, matrix._started))
+                for effect, started in anchored:
+                    sync.align(effect, started, frame / self.frame_rate, steps)
+            self._render_frame(steps)
+            shown = frame
+
+        return shown, (shown + self._frame_divider) / self.frame_rate - sync.node.time()
+
+    def _render_frame(self, steps: int = 1):
+        # regions render into their part of the frame, layers of the matrix are put on top of everything
+        if self._frame is None or len(self._frame) != self.geometry.led_count:
+            self._frame = numpy.zeros((self.geometry.led_count, 3), dtype=numpy.float32)
+
+        frame = self._frame
+        frame[:] = self._render_base(steps)
+        for region in self._active_regions:
+            frame[region._parent_leds] = region._render_composited(steps)
+
+        self._show_frame(self._composite(frame, steps))
+
+    def _render_composited(self, steps: int = 1) -> numpy.ndarray:
+        return self._composite(self._render_base(steps), steps)
+
+    def _render_base(self, steps: int = 1) -> numpy.ndarray:
+        if self._effect is not None:
+            frame = self._effect.next_frame(steps)
+            self._set_block_colors(self.geometry.block_means(frame))
+            return frame
+
+        if self._keyframes:
+            return self.geometry.expand(self._keyframes.sample(clock.current.time()))
+        return self._get_block_frame()
+
+    def _composite(self, frame: numpy.ndarray, steps: int = 1) -> numpy.ndarray:
+        if self._layers:
+            frame = self._layers.composite(frame, steps)
+
+        if self._is_composited:
+            self._shown_colors = self.geometry.block_means(frame).astype(numpy.uint8)
+
+        return frame
+
+    def _get_block_frame(self) -> numpy.ndarray:
+        if self._block_levels is not None and len(self._block_levels) == self.geometry.block_count:
+            return self.geometry.expand(self._block_levels)
+
+        colors = numpy.array([block.color.as_tuple for block in self.all_blocks], dtype=numpy.float32)
+        return self.geometry.expand(colors.reshape(-1, 3))
+
+    def _set_block_colors(self, colors: numpy.ndarray):
+        for block, (red, green, blue) in zip(self.all_blocks, colors.astype(numpy.uint8).tolist()):
+            block.color = Color.construct(red=red, green=green, blue=blue)
+
+    def _show_frame(self, frame: numpy.ndarray):
+        geometry = self.geometry
+        if self._strip:
+            if geometry.write_positions is not None:
+                frame = frame[geometry.write_positions]
+            if not self._strip.dithering:
+                frame = numpy.clip(frame, 0, 255).astype(numpy.uint8)
+            self._strip.set_pixels(geometry.write_index, frame)
+            self._strip.update_strip()
+
+    def _update_block(self, block: LedBlock):
+        if not self._strip or self.is_rendering:
+            return
+
+        self._strip.set_colors(
+            color=block.color.as_tuple,
+            start_index=block.abs_start,
+            length=block.number_of_leds
+        )
         self._strip.update_strip()
 
+    async def _update_strip(self):
+        if not self._strip or self.is_rendering:
+            return
+
+        self._show_frame(self._get_block_frame())
+
     @staticmethod
     def get_distance(start: int, end: int, size: int):
         if start < end:
@@ -391,13 +945,18 @@ class LedMatrix(pydantic.BaseModel):  # pylint: disable=no-member
 
 
 router = fastapi.APIRouter(prefix="/block")
-templates = fastapi.templating.Jinja2Templates(directory="templates")
+
+
+def _get_matrix(block_id: str) -> LedMatrix:
+    if not (matrix := known_blocks.get(block_id, None)):
+        raise fastapi.HTTPException(status_code=404, detail=f'Block {block_id} is unknown. '
+                                                            f'Valid block names are: {", ".join(known_blocks.keys())}')
+    return matrix
 
 
 @router.get('/', tags=['UI'])
 def show_blocks(request: fastapi.Request):
-    return templates.TemplateResponse("blocks.html", {
-        "request": request,
+    return pages.cache.render(request, 'blocks', "blocks.html", lambda: {
         "blocks": known_blocks.values()
     })
 
@@ -407,13 +966,12 @@ def show_block(
         request: fastapi.Request,
         block_id: str = fastapi.Path(default='default')
 ):
-    if not (matrix := known_blocks.get(block_id, None)):
-        raise fastapi.HTTPException(status_code=404, detail=f'Block {block_id} is unknown. '
-                                                            f'Valid block names are: {", ".join(known_blocks.keys())}')
+    matrix = _get_matrix(block_id)
 
-    return templates.TemplateResponse("matrix.html", {
-        'request': request,
+    return pages.cache.render(request, f'block/{block_id}', "matrix.html", lambda: {
         'matrix': matrix,
+        'expressions': list(expressions.library),
+        'stdin_audio': '-' in audio.allowed_sources,
         'do_reload': True,
     })
 
@@ -424,22 +982,108 @@ async def set_program(
         program: BlockProgram = fastapi.Query(default=BlockProgram.RANDOM),
         color1: ColorName = fastapi.Query(default=ColorName.BLACK),
         color2: ColorName = fastapi.Query(default=ColorName.BLACK),
+        seed: int = fastapi.Query(default=None, ge=0, title='Seed to reproduce a random program'),
+        source: str = fastapi.Query(default=None, title='Audio input of the audio program, a wav file, a pipe or - '
+                                                        'for stdin'),
+        expression: str = fastapi.Query(default=None, max_length=expressions.MAX_LENGTH,
+                                        title='Expression or name of a configured expression of the expression '
+                                              'program'),
+        easing: keyframes.Easing = fastapi.Query(default=None, title='Blending from one step to the next of the '
+                                                                     'random and color run programs'),
 ):
-    if not (matrix := known_blocks.get(block_id, None)):
-        raise fastapi.HTTPException(status_code=404, detail=f'Block {block_id} is unknown. '
-                                                            f'Valid block names are: {", ".join(known_blocks.keys())}')
+    matrix = _get_matrix(block_id)
 
-    await matrix.run_program(program, colors=[ColorConverter.get_color(color1), ColorConverter.get_color(color2)])
+    try:
+        await matrix.run_program(program, colors=[ColorConverter.get_color(color1), ColorConverter.get_color(color2)],
+                                 seed=seed, source=source, expression=expression, easing=easing)
+    except (ValueError, OSError) as error:
+        raise fastapi.HTTPException(status_code=400, detail=str(error)) from error
 
     return router.url_path_for('show_block', **{'block_id': block_id})
 
 
 @router.get('/{block_id}/colors/')
 def get_act_colors(
+        response: fastapi.Response,
         block_id: str = fastapi.Path(title='Identifier of block', example='default'),
 ):
-    if not (matrix := known_blocks.get(block_id, None)):
-        raise fastapi.HTTPException(status_code=404, detail=f'Block {block_id} is unknown. '
-                                                            f'Valid block names are: {", ".join(known_blocks.keys())}')
+    matrix = _get_matrix(block_id)
+    interval = quality.monitor.preview_interval
+    response.headers['X-Preview-Interval'] = str(round(interval * 1000))
+    if matrix.effect_seed is not None:
+        response.headers['X-Effect-Seed'] = str(matrix.effect_seed)
+
+    # under load all dashboards of a matrix share one preview per interval
+    now = clock.current.time()
+    created, colors = previews.get(block_id, (None, None))
+    if colors is None or quality.monitor.level < quality.QualityLevel.PREVIEW or now - created >= interval:
+        colors = [[(color.as_html, color.text_as_html) for color in row] for row in matrix.shown_colors]
+        previews[block_id] = (now, colors)
+
+    return colors
+
+
+@router.get('/{block_id}/layers/')
+def get_layers(
+        block_id: str = fastapi.Path(title='Identifier of block', example='default'),
+):
+    return _get_matrix(block_id).layers
+
+
+@router.post('/{block_id}/layers/')
+async def add_layer(
+        block_id: str = fastapi.Path(title='Identifier of block', example='default'),
+        program: BlockProgram = fastapi.Query(default=BlockProgram.SPARKLE),
+        blend_mode: compositing.BlendMode = fastapi.Query(default=compositing.BlendMode.ADD),
+        opacity: float = fastapi.Query(default=1.0, ge=0, le=1),
+        color1: ColorName = fastapi.Query(default=ColorName.BLACK),
+        color2: ColorName = fastapi.Query(default=ColorName.BLACK),
+        seed: int = fastapi.Query(default=None, ge=0, title='Seed to reproduce a random program'),
+        first_row: int = fastapi.Query(default=None, ge=0, title='First row of the layer mask'),
+        last_row: int = fastapi.Query(default=None, ge=0, title='Last row of the layer mask'),
+        first_col: int = fastapi.Query(default=None, ge=0, title='First column of the layer mask'),
+        last_col: int = fastapi.Query(default=None, ge=0, title='Last column of the layer mask'),
+        source: str = fastapi.Query(default=None, title='Audio input of the audio program, a wav file, a pipe or - '
+                                                        'for stdin'),
+        expression: str = fastapi.Query(default=None, max_length=expressions.MAX_LENGTH,
+                                        title='Expression or name of a configured expression of the expression '
+                                              'program'),
+):
+    matrix = _get_matrix(block_id)
+
+    rows = (first_row or 0, matrix.geometry.rows if last_row is None else last_row) \
+        if first_row is not None or last_row is not None else None
+    cols = (first_col or 0, matrix.geometry.cols if last_col is None else last_col) \
+        if first_col is not None or last_col is not None else None
+
+    try:
+        await matrix.add_layer(program, colors=[ColorConverter.get_color(color1), ColorConverter.get_color(color2)],
+                               seed=seed, blend_mode=blend_mode, opacity=opacity, rows=rows, cols=cols,
+                               source=source, expression=expression)
+    except (ValueError, OSError) as error:
+        raise fastapi.HTTPException(status_code=400, detail=str(error)) from error
+
+    return matrix.layers
+
+
+@router.delete('/{block_id}/layers/')
+async def clear_layers(
+        block_id: str = fastapi.Path(title='Identifier of block', example='default'),
+):
+    matrix = _get_matrix(block_id)
+    matrix.clear_layers()
+    return matrix.layers
+
+
+@router.delete('/{block_id}/layers/{index}/')
+async def remove_layer(
+        block_id: str = fastapi.Path(title='Identifier of block', example='default'),
+        index: int = fastapi.Path(title='Position of the layer in the stack', ge=0),
+):
+    matrix = _get_matrix(block_id)
+    if index >= len(matrix.layers):
+        raise fastapi.HTTPException(status_code=404, detail=f'Layer {index} is unknown. '
+                                                            f'Block {block_id} has {len(matrix.layers)} layers.')
 
-    return [[(block.color.as_html, block.color.text_as_html) for block in row] for row in matrix.blocks]
+    matrix.remove_layer(index)
+    return matrix.layers
@@ -0,0 +1,238 @@
+# Renders a program of a configured matrix on a virtual clock, without a server and without a strip attached,
+# into a NumPy file, an animated GIF or a PNG sequence of the block grid or of the strip.
+#
+#   python -m offline --block default --program twinkle --seed 3 --duration 10 --fps 30 --output show.gif
+import argparse
+import asyncio
+import os
+import struct
+import typing
+import zlib
+
+import numpy
+
+import audio
+import clock
+import expressions
+import layout
+import led_block
+import simulation
+import strip
+
+
+class Recording(typing.NamedTuple):
+    times: numpy.ndarray  # virtual time of every frame
+    blocks: numpy.ndarray  # frames, rows, cols and RGB of the block grid, missing blocks are black
+    strip: numpy.ndarray  # frames, LEDs and RGB levels as shown by the strip
+    wall_time: float
+
+
+def render(config_path: str, block: str, program: led_block.BlockProgram, duration: float, fps: float = 30.0,
+           colors: list[led_block.Color] = None, seed: int = None, **options) -> Recording:
+    # the matrix is built from the compiled layout like by the server, only its strip is never switched on
+    compiled = layout.load(config_path)
+    data = next((data for data in compiled.blocks if block == data['name'] or block.startswith(f'{data["name"]}.')),
+                None)
+    if data is None:
+        raise ValueError(f'Block {block} is unknown. Valid blocks are: '
+                         f'{", ".join(data["name"] for data in compiled.blocks)}')
+
+    strip_data = next(values for values in compiled.strips if values['identifier'] == data['strip_name'])
+    output = strip.Strip(**{**strip_data, 'power_settle': 0})
+    matrix = led_block.LedMatrix(output, geometry=compiled.geometries[data['name']], **{**data, 'fps': fps})
+    try:
+        target = led_block.known_blocks.get(block)
+        if target is None:
+            raise ValueError(f'Region {block} is unknown. Valid regions are: {", ".join(matrix.region_names)}')
+
+        count = int(round(duration * fps))
+        times = numpy.zeros(count)
+        blocks = numpy.zeros((count, target.rows, target.cols, 3), dtype=numpy.uint8)
+        pixels = numpy.zeros((count, output.count, 3), dtype=numpy.uint8)
+
+        async def sample():
+            # in the middle between two frames, so every sample shows exactly one rendered frame
+            started = clock.current.time()
+            for index in range(count):
+                await clock.current.sleep(started + (index + 0.5) / fps - clock.current.time())
+                times[index] = clock.current.time() - started
+                for row_index, row in enumerate(target.shown_colors):
+                    blocks[index, row_index, :len(row)] = [color.as_tuple for color in row]
+                pixels[index] = output.rgb_pixels
+
+        async def start():
+            await target.run_program(program, colors=colors, seed=seed, **options)
+            asyncio.create_task(sample())
+
+        run = simulation.Simulation(record=False)
+        run.run(start, duration)
+        return Recording(times, blocks, pixels, run.wall_time)
+    finally:
+        matrix.detach()
+        output.release()
+
+
+def block_images(recording: Recording, scale: int = 8) -> numpy.ndarray:
+    return recording.blocks.repeat(scale, axis=1).repeat(scale, axis=2)
+
+
+def strip_images(recording: Recording, scale: int = 8) -> numpy.ndarray:
+    # one pixel per LED in the order of the strip
+    return numpy.repeat(recording.strip[:, None], scale, axis=1)
+
+
+def encode_png(image: numpy.ndarray) -> bytes:
+    height, width, _ = image.shape
+    rows = numpy.zeros((height, width * 3 + 1), dtype=numpy.uint8)  # every row starts with filter type 0
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(kind: bytes, content: bytes) -> bytes:
+        return struct.pack('>I', len(content)) + kind + content + struct.pack('>I', zlib.crc32(kind + content))
+
+    return b'\x89PNG\r\n\x1a\n' \
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) \
+        + chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) \
+        + chunk(b'IEND', b'')
+
+
+def _lzw_compress(indices: bytes, code_size: int) -> bytes:
+    clear_code, end_code = 1 << code_size, (1 << code_size) + 1
+    output = bytearray()
+
+    table: dict[int, int] = {}
+    next_code, bits = end_code + 1, code_size + 1
+    buffer, buffered = clear_code, bits
+
+    prefix = indices[0]
+    for index in indices[1:]:
+        key = prefix << 8 | index
+        if key in table:
+            prefix = table[key]
+            continue
+
+        buffer |= prefix << buffered
+        buffered += bits
+        if next_code < 4095:
+            table[key] = next_code
+            next_code += 1
+            if next_code > 1 << bits:
+                bits += 1
+        else:
+            # a full table starts over
+            buffer |= clear_code << buffered
+            buffered += bits
+            table.clear()
+            next_code, bits = end_code + 1, code_size + 1
+        prefix = index
+
+        while buffered >= 8:
+            output.append(buffer & 0xff)
+            buffer >>= 8
+            buffered -= 8
+
+    for code in (prefix, end_code):
+        buffer |= code << buffered
+        buffered += bits
+    while buffered > 0:
+        output.append(buffer & 0xff)
+        buffer >>= 8
+        buffered -= 8
+
+    return bytes(output)
+
+
+def encode_gif(images: numpy.ndarray, fps: float) -> bytes:
+    _, height, width, _ = images.shape
+    content = bytearray(b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0))
+    content += b'!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00'  # endless loop
+
+    for index, image in enumerate(images):
+        # every frame has its own palette, frames with more than 256 colors are reduced to 6 levels per color
+        palette, indices = numpy.unique(image.reshape(-1, 3), axis=0, return_inverse=True)
+        if len(palette) > 256:
+            palette, indices = numpy.unique(image.reshape(-1, 3) // 51 * 51, axis=0, return_inverse=True)
+        code_size = max(int(len(palette) - 1).bit_length(), 2)
+        table = numpy.zeros((1 << code_size, 3), dtype=numpy.uint8)
+        table[:len(palette)] = palette
+
+        # delays are whole centiseconds, the rounding errors do not add up
+        delay = round((index + 1) * 100 / fps) - round(index * 100 / fps)
+        content += b'!\xf9\x04' + struct.pack('<BHBB', 0x04, delay, 0, 0)
+        content += b',' + struct.pack('<HHHHB', 0, 0, width, height, 0x80 | (code_size - 1)) + table.tobytes()
+
+        data = _lzw_compress(indices.astype(numpy.uint8).tobytes(), code_size)
+        content.append(code_size)
+        for start in range(0, len(data), 255):
+            block = data[start:start + 255]
+            content += bytes([len(block)]) + block
+        content.append(0)
+
+    content += b';'
+    return bytes(content)
+
+
+def save(recording: Recording, path: str, view: str = 'blocks', scale: int = 8, fps: float = 30.0) -> list[str]:
+    base, extension = os.path.splitext(path)
+    match extension.lower():
+        case '.npz':
+            numpy.savez_compressed(path, times=recording.times, blocks=recording.blocks, strip=recording.strip)
+            return [path]
+        case '.npy':
+            numpy.save(path, recording.blocks if view == 'blocks' else recording.strip)
+            return [path]
+
+    images = block_images(recording, scale) if view == 'blocks' else strip_images(recording, scale)
+    match extension.lower():
+        case '.gif':
+            with open(path, 'wb') as output:
+                output.write(encode_gif(images, fps))
+            return [path]
+        case '.png':
+            paths = [f'{base}-{index:05d}.png' for index in range(len(images))]
+            for image_path, image in zip(paths, images):
+                with open(image_path, 'wb') as output:
+                    output.write(encode_png(image))
+            return paths
+        case _:
+            raise ValueError(f'Unknown output format {extension}, use .npz, .npy, .gif or .png')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a program offline into arrays or images')
+    parser.add_argument('--config', default='default.config.json')
+    parser.add_argument('--block', default='default')
+    parser.add_argument('--program', default=led_block.BlockProgram.TWINKLE.value,
+                        choices=[program.value for program in led_block.BlockProgram])
+    parser.add_argument('--color1', default=led_block.ColorName.BLACK.value)
+    parser.add_argument('--color2', default=led_block.ColorName.BLACK.value)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--expression', default=None, help='expression or name of a configured expression')
+    parser.add_argument('--source', default=None, help='audio input of the audio program')
+    parser.add_argument('--duration', type=float, default=10.0, help='rendered seconds')
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--output', default='render.npz', help='.npz, .npy, .gif or .png (one file per frame)')
+    parser.add_argument('--view', default='blocks', choices=['blocks', 'strip'])
+    parser.add_argument('--scale', type=int, default=8, help='pixels per block, height of the strip images')
+    arguments = parser.parse_args()
+
+    # configured expressions can be used by their name, the source given on the command line can be read
+    config_path = os.path.join('config', arguments.config)
+    compiled = layout.load(config_path)
+    expressions.library = {**compiled.expressions,
+                           **expressions.load_library(os.path.join('config', 'expressions.json'))}
+    audio.allowed_sources = compiled.audio_sources + ([arguments.source] if arguments.source else [])
+
+    colors = [led_block.ColorConverter.get_color(led_block.ColorName(arguments.color1)),
+              led_block.ColorConverter.get_color(led_block.ColorName(arguments.color2))]
+    recording = render(config_path, arguments.block, led_block.BlockProgram(arguments.program),
+                       arguments.duration, arguments.fps, colors=colors, seed=arguments.seed,
+                       expression=arguments.expression, source=arguments.source)
+    paths = save(recording, arguments.output, arguments.view, arguments.scale, arguments.fps)
+
+    print(f'{arguments.duration:.0f} s of {arguments.program} on {arguments.block}: {len(recording.times)} frames '
+          f'in {recording.wall_time:.2f} s, {arguments.duration / max(recording.wall_time, 1e-9):.0f}x real time, '
+          f'written to {paths[0]}' + (f' and {len(paths) - 1} more files' if len(paths) > 1 else ''))
+
+
+if __name__ == '__main__':
+    main()
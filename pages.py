@@ -0,0 +1,36 @@
+import hashlib
+import typing
+
+import fastapi
+import fastapi.responses
+import fastapi.templating
+
+templates = fastapi.templating.Jinja2Templates(directory="templates")
+
+
+class PageCache:
+    # the static structure of the pages is rendered once per configuration, the live state like the block colors
+    # is loaded by the pages themselves
+    def __init__(self):
+        self.renders = 0
+        self._pages: dict[str, tuple[bytes, str]] = {}
+
+    def clear(self):
+        self._pages.clear()
+
+    def render(self, request: fastapi.Request, key: str, template: str,
+               get_context: typing.Callable[[], dict]) -> fastapi.Response:
+        if (page := self._pages.get(key)) is None:
+            content = templates.get_template(template).render(get_context()).encode()
+            page = self._pages[key] = (content, f'"{hashlib.sha256(content).hexdigest()[:16]}"')
+            self.renders += 1
+
+        # browsers revalidate the page on every load, an unchanged page is answered without a body
+        content, etag = page
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if request.headers.get('if-none-match') == etag:
+            return fastapi.Response(status_code=304, headers=headers)
+        return fastapi.responses.HTMLResponse(content, headers=headers)
+
+
+cache = PageCache()
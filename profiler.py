@@ -0,0 +1,258 @@
+import asyncio
+import cProfile
+import enum
+import functools
+import marshal
+import os
+import pstats
+import sys
+import threading
+import types
+import typing
+
+import clock
+
+
+class ProfilerMode(enum.Enum):
+    SAMPLING = 'sampling'
+    CPROFILE = 'cprofile'
+
+
+class Target:
+    # a stack sample belongs to the target if one of the codes is on it or the event loop runs one of the tasks,
+    # in cProfile mode the patched functions are profiled for every call accepted by the condition
+    def __init__(self, name: str, codes: typing.Iterable[types.CodeType] = (),
+                 tasks: typing.Callable[[], typing.Iterable[asyncio.Task]] = None,
+                 patches: typing.Iterable[tuple[object, str]] = (), condition: typing.Callable[..., bool] = None):
+        self.name = name
+        self.codes = frozenset(codes)
+        self.tasks = tasks
+        self.patches = list(patches)
+        self.condition = condition
+
+
+def _describe(code: types.CodeType) -> str:
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Sampler:
+    # samples the stacks of all threads from a thread of its own and counts them in the collapsed stack format
+    switch_interval: float = 0.0002
+
+    def __init__(self, target: Target, interval: float, loop: asyncio.AbstractEventLoop):
+        self.target = target
+        self.interval = interval
+        self.ticks = 0
+        self.samples = 0
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._stacks: dict[str, int] = {}
+        self._switch_interval: float = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling sampler', daemon=True)
+
+    def start(self):
+        # the sampler waits for the GIL, with the default switch interval of 5 ms short frames are never sampled
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.switch_interval))
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            self.ticks += 1
+            tasks = set(self.target.tasks()) if self.target.tasks else set()
+            for thread, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if thread != own_thread:
+                    self.sample(thread, frame, tasks)
+
+    def sample(self, thread: int, frame: types.FrameType, tasks: set[asyncio.Task]):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+
+        if not self.target.codes.intersection(codes) \
+                and not (tasks and thread == self._loop_thread and asyncio.current_task(self._loop) in tasks):
+            return
+
+        stack = ';'.join(_describe(code) for code in reversed(codes))
+        self._stacks[stack] = self._stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    @property
+    def result(self) -> bytes:
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self._stacks.items())).encode()
+
+
+class CallProfiler:
+    # every thread gets a profile of its own, it only runs during the profiled calls
+    def __init__(self):
+        self.calls = 0
+        self.skipped = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles: list[cProfile.Profile] = []
+
+    def call(self, function: typing.Callable, *args, **kwargs):
+        if getattr(self._local, 'active', False):  # nested in a profiled call
+            return function(*args, **kwargs)
+
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            profile = self._local.profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(profile)
+
+        try:
+            profile.enable()
+        except ValueError:  # since python 3.12 only one thread at a time can be profiled
+            self.skipped += 1
+            return function(*args, **kwargs)
+
+        self._local.active = True
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._local.active = False
+            self.calls += 1
+
+    def wrap(self, function: typing.Callable, condition: typing.Callable[..., bool] = None) -> typing.Callable:
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def profiled_coroutine(*args, **kwargs):
+                if condition and not condition(*args, **kwargs):
+                    return await function(*args, **kwargs)
+                return await self._steps(function(*args, **kwargs))
+
+            return profiled_coroutine
+
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            if condition and not condition(*args, **kwargs):
+                return function(*args, **kwargs)
+            return self.call(function, *args, **kwargs)
+
+        return profiled
+
+    @types.coroutine
+    def _steps(self, coroutine: typing.Coroutine):
+        # only the steps of the coroutine are profiled, not the time it is waiting
+        send, value = coroutine.send, None
+        while True:
+            try:
+                yielded = self.call(send, value)
+            except StopIteration as stop:
+                return stop.value
+
+            try:
+                send, value = coroutine.send, (yield yielded)
+            except BaseException as error:  # pylint: disable=broad-except
+                send, value = coroutine.throw, error
+
+    @property
+    def result(self) -> bytes:
+        # same format as pstats.Stats.dump_stats(), readable by pstats and snakeviz
+        stats = pstats.Stats()
+        with self._lock:
+            for profile in self._profiles:
+                stats.add(profile)
+        return marshal.dumps(stats.stats)
+
+
+class Session:
+    # profiles the target for a bounded time, instrumentation is only installed while the session runs
+    def __init__(self, target: Target, mode: ProfilerMode, duration: float, interval: float = 0.01):
+        self.target = target
+        self.mode = mode
+        self.duration = duration
+        self.interval = interval
+        self.started: float = None
+        self.stopped: float = None
+
+        self._sampler: Sampler = None
+        self._call_profiler: CallProfiler = None
+        self._originals: list[tuple[object, str, typing.Callable]] = []
+        self._timeout: asyncio.Task = None
+
+    def start(self):
+        self.started = clock.current.time()
+        if self.mode is ProfilerMode.SAMPLING:
+            self._sampler = Sampler(self.target, self.interval, asyncio.get_running_loop())
+            self._sampler.start()
+        else:
+            self._call_profiler = CallProfiler()
+            for owner, attribute in self.target.patches:
+                original = getattr(owner, attribute)
+                self._originals.append((owner, attribute, original))
+                setattr(owner, attribute, self._call_profiler.wrap(original, self.target.condition))
+
+        self._timeout = asyncio.create_task(self._stop_after_duration(), name='profiling timeout')
+
+    async def _stop_after_duration(self):
+        await clock.current.sleep(self.duration)
+        self.stop()
+
+    def stop(self):
+        if not self.is_running:
+            return
+
+        self.stopped = clock.current.time()
+        if self._timeout is not asyncio.current_task():
+            self._timeout.cancel()
+
+        if self._sampler:
+            self._sampler.stop()
+        for owner, attribute, original in reversed(self._originals):
+            setattr(owner, attribute, original)
+        self._originals.clear()
+
+    @property
+    def is_running(self) -> bool:
+        return self.started is not None and self.stopped is None
+
+    @property
+    def result(self) -> bytes:
+        profiler = self._sampler or self._call_profiler
+        return profiler.result
+
+    @property
+    def file_name(self) -> str:
+        extension = 'folded' if self.mode is ProfilerMode.SAMPLING else 'pstats'
+        return f'profile-{self.target.name}.{extension}'
+
+    @property
+    def status(self) -> dict:
+        status = {
+            'target': self.target.name,
+            'mode': self.mode.value,
+            'duration': self.duration,
+            'running': self.is_running,
+            'elapsed': ((self.stopped if self.stopped is not None else clock.current.time()) - self.started
+                        if self.started is not None else 0.0),
+        }
+        if self._sampler:
+            status.update(interval=self.interval, ticks=self._sampler.ticks, samples=self._sampler.samples)
+        if self._call_profiler:
+            status.update(calls=self._call_profiler.calls, skipped_calls=self._call_profiler.skipped)
+        return status
+
+
+session: typing.Optional[Session] = None  # pylint: disable=invalid-name
+enabled: bool = False  # pylint: disable=invalid-name
+
+
+def start(target: Target, mode: ProfilerMode, duration: float, interval: float = 0.01) -> Session:
+    global session  # pylint: disable=global-statement,invalid-name
+    if session and session.is_running:
+        raise RuntimeError(f'Profiling of {session.target.name} is still running')
+
+    session = Session(target, mode, duration, interval)
+    session.start()
+    return session
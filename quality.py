@@ -0,0 +1,125 @@
+import enum
+import time
+
+import clock
+
+
+class QualityLevel(enum.IntEnum):
+    # every level includes the degradations of the levels before
+    FULL = 0
+    BACKGROUND_FPS = 1
+    INTERPOLATION = 2
+    PREVIEW = 3
+
+
+class FrameStats:
+    def __init__(self):
+        self.frames = 0
+        self.misses = 0
+        self.total_frames = 0
+        self.total_misses = 0
+        self.max_lateness = 0.0
+        self.rate = 0.0
+
+    def reset_window(self):
+        self.frames = 0
+        self.misses = 0
+        self.max_lateness = 0.0
+
+
+class QualityMonitor:
+    # watches frame deadlines, event loop lag and CPU time and degrades one level per window under pressure
+    def __init__(self, window: float = 1.0, degrade_misses: float = 0.1, restore_misses: float = 0.01,
+                 degrade_cpu: float = 0.9, restore_cpu: float = 0.6, max_lag: float = 0.05,
+                 restore_windows: int = 3):
+        self.window = window
+        self.degrade_misses = degrade_misses
+        self.restore_misses = restore_misses
+        self.degrade_cpu = degrade_cpu
+        self.restore_cpu = restore_cpu
+        self.max_lag = max_lag
+        self.restore_windows = restore_windows
+
+        self.level = QualityLevel.FULL
+        self.cpu = 0.0
+        self.lag = 0.0
+        self.background_divider = 2
+        self.interpolation_divider = 5
+        self.preview_intervals = (0.2, 1.0)
+
+        self._stats: dict[str, FrameStats] = {}
+        self._calm_windows = 0
+
+    def report_frame(self, name: str, lateness: float, interval: float):
+        # a frame counts as missed if it is shown more than half a frame late
+        stats = self._stats.setdefault(name, FrameStats())
+        stats.frames += 1
+        stats.total_frames += 1
+        stats.rate = 1 / interval
+        stats.max_lateness = max(stats.max_lateness, lateness)
+        if lateness > interval / 2:
+            stats.misses += 1
+            stats.total_misses += 1
+
+    def forget(self, name: str):
+        self._stats.pop(name, None)
+
+    def evaluate(self, cpu: float = 0.0, lag: float = 0.0) -> QualityLevel:
+        frames = sum(stats.frames for stats in self._stats.values())
+        misses = sum(stats.misses for stats in self._stats.values()) / frames if frames else 0.0
+        self.cpu, self.lag = cpu, lag
+
+        if misses > self.degrade_misses or cpu > self.degrade_cpu or lag > self.max_lag:
+            self._calm_windows = 0
+            self.level = QualityLevel(min(self.level + 1, QualityLevel.PREVIEW))
+        elif misses <= self.restore_misses and cpu < self.restore_cpu and lag <= self.max_lag / 2:
+            # quality comes back slower than it goes, so the levels do not flap
+            self._calm_windows += 1
+            if self._calm_windows >= self.restore_windows and self.level > QualityLevel.FULL:
+                self._calm_windows = 0
+                self.level = QualityLevel(self.level - 1)
+        else:
+            self._calm_windows = 0
+
+        for stats in self._stats.values():
+            stats.reset_window()
+        return self.level
+
+    async def run(self):
+        cpu_started = time.process_time()
+        while True:
+            started = clock.current.time()
+            await clock.current.sleep(self.window)
+            elapsed = clock.current.time() - started
+
+            cpu_now = time.process_time()
+            cpu, cpu_started = (cpu_now - cpu_started) / max(elapsed, 1e-9), cpu_now
+            self.evaluate(cpu, max(elapsed - self.window, 0.0))
+
+    def frame_divider(self, priority: int, top_priority: int) -> int:
+        if self.level >= QualityLevel.BACKGROUND_FPS and priority < top_priority:
+            return self.background_divider
+        return 1
+
+    def interpolation_steps(self, steps: int) -> int:
+        if self.level >= QualityLevel.INTERPOLATION:
+            return max(steps // self.interpolation_divider, 1)
+        return steps
+
+    @property
+    def preview_interval(self) -> float:
+        return self.preview_intervals[self.level >= QualityLevel.PREVIEW]
+
+    @property
+    def metrics(self) -> dict:
+        return {
+            'level': self.level.name.lower(),
+            'cpu': self.cpu,
+            'lag': self.lag,
+            'preview_interval': self.preview_interval,
+            'matrices': {name: {'frames': stats.total_frames, 'missed_frames': stats.total_misses,
+                                'rate': stats.rate} for name, stats in self._stats.items()},
+        }
+
+
+monitor = QualityMonitor()
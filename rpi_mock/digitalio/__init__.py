@@ -22,4 +22,7 @@ class DigitalInOut:
         self._direction = Direction.OUTPUT
 
     def switch_to_input(self):
-        self._direction = Direction.INPUT
\ No newline at end of file
+        self._direction = Direction.INPUT
+
+    def deinit(self):
+        pass
@@ -1,9 +1,31 @@
 # pylint disable=invalid-name,unused-argument,two-few-public-methods
+import time
+
+RGB: str = 'RGB'
+GRB: str = 'GRB'
+RGBW: str = 'RGBW'
+GRBW: str = 'GRBW'
+
 
 class NeoPixel:
-    def __init__(self, *args, **kwargs):
-        self._leds = [(0,0,0)] * 1000
-        pass
+    # like adafruit_pixelbuf the pixels are kept as bytes in wire order in _post_brightness_buffer
+    # if set, show() blocks as long as the real driver: 8 bits per byte at 800 kHz plus the reset time
+    timing_accurate: bool = False
+
+    def __init__(self, pin=None, n: int = 1000, *, bpp: int = 3, brightness: float = 1.0, auto_write: bool = True,
+                 pixel_order: str = None):
+        pixel_order = pixel_order or (GRBW if bpp == 4 else GRB)
+        self.pin = pin
+        self.n = n
+        self.bpp = len(pixel_order)
+        self.brightness = brightness
+        self.auto_write = auto_write
+        self._positions = ['RGBW'.index(channel) for channel in pixel_order]
+        self._post_brightness_buffer = bytearray(n * self.bpp)
+        self._show_time = n * self.bpp * 8 / 800000 + 0.00008
+
+    def __len__(self) -> int:
+        return self.n
 
     def begin(self):
         pass
@@ -12,13 +34,36 @@ class NeoPixel:
         pass
 
     def show(self):
+        if self.timing_accurate:
+            time.sleep(self._show_time)
+
+    def fill(self, color):
+        self[0:self.n] = [color] * self.n
+
+    def deinit(self):
         pass
 
-    def __setitem__(self, index, val):
-        self._leds[index] = val
+    def _set_pixel(self, index: int, value):
+        value = tuple(value) + (0,) * (4 - len(value))
+        offset = index * self.bpp
+        for byte, position in enumerate(self._positions):
+            self._post_brightness_buffer[offset + byte] = value[position]
 
-    def __getitem__(self, index):
-        return self._leds[index]
+    def _get_pixel(self, index: int) -> tuple:
+        offset = index * self.bpp
+        value = [0] * self.bpp
+        for byte, position in enumerate(self._positions):
+            value[position] = self._post_brightness_buffer[offset + byte]
+        return tuple(value)
 
+    def __setitem__(self, index, val):
+        if isinstance(index, slice):
+            for position, value in zip(range(*index.indices(self.n)), val):
+                self._set_pixel(position, value)
+        else:
+            self._set_pixel(range(self.n)[index], val)
 
-GRB: str = 'GRB'
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get_pixel(position) for position in range(*index.indices(self.n))]
+        return self._get_pixel(range(self.n)[index])
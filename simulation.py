@@ -0,0 +1,95 @@
+# Runs programs on a virtual clock as fast as the CPU allows and records the frames shown on the strips.
+#
+#   python -m simulation --block default --program fading --duration 3600
+import argparse
+import asyncio
+import time
+import typing
+
+import numpy
+
+import clock
+import strip
+
+
+class Frame(typing.NamedTuple):
+    time: float
+    strip: str
+    pixels: numpy.ndarray
+
+
+class Simulation:
+    def __init__(self, start: float = 0.0, record: bool = True):
+        self.clock = clock.VirtualClock(start)
+        self.record = record
+        self.frames: list[Frame] = []
+        self.frame_count = 0
+        self.wall_time = 0.0
+
+    def _on_frame(self, shown_strip: strip.Strip):
+        self.frame_count += 1
+        if self.record:
+            pixels = shown_strip.shown_pixels.copy()
+            self.frames.append(Frame(self.clock.now, shown_strip.identifier, pixels))
+
+    async def _run(self, start: typing.Callable[[], typing.Awaitable], duration: float):
+        await start()
+        await asyncio.sleep(duration)
+
+        # programs never end by themselves, everything still running is part of the simulated show only
+        running = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def run(self, start: typing.Callable[[], typing.Awaitable], duration: float = 0.0) -> list[Frame]:
+        # start() starts the programs, afterwards the virtual time advances by duration seconds
+        loop = self.clock.new_event_loop()
+        strip.frame_listeners.append(self._on_frame)
+        started = time.perf_counter()
+        try:
+            with clock.use(self.clock):
+                loop.run_until_complete(self._run(start, duration))
+        finally:
+            self.wall_time += time.perf_counter() - started
+            strip.frame_listeners.remove(self._on_frame)
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+        return self.frames
+
+
+def main():
+    # pylint: disable=import-outside-toplevel
+    import controller
+    import led_block
+
+    parser = argparse.ArgumentParser(description='Fast forward a program and measure the render throughput')
+    parser.add_argument('--config', default='default.config.json')
+    parser.add_argument('--block', default='default')
+    parser.add_argument('--program', default=led_block.BlockProgram.FADING.value,
+                        choices=[program.value for program in led_block.BlockProgram])
+    parser.add_argument('--color1', default=led_block.ColorName.BLACK.value)
+    parser.add_argument('--color2', default=led_block.ColorName.BLACK.value)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--duration', type=float, default=3600.0, help='simulated seconds')
+    arguments = parser.parse_args()
+
+    async def start():
+        controller.DataInitialize.config_file = arguments.config
+        await controller.DataInitialize.initialize()
+        colors = [led_block.ColorConverter.get_color(led_block.ColorName(arguments.color1)),
+                  led_block.ColorConverter.get_color(led_block.ColorName(arguments.color2))]
+        await led_block.known_blocks[arguments.block].run_program(
+            led_block.BlockProgram(arguments.program), colors=colors, seed=arguments.seed)
+
+    simulation = Simulation(record=False)
+    simulation.run(start, arguments.duration)
+    print(f'{arguments.duration:.0f} s of {arguments.program} on {arguments.block}: '
+          f'{simulation.frame_count} frames in {simulation.wall_time:.2f} s, '
+          f'{simulation.frame_count / max(simulation.wall_time, 1e-9):.0f} frames/s, '
+          f'{arguments.duration / max(simulation.wall_time, 1e-9):.0f}x real time')
+
+
+if __name__ == '__main__':
+    main()
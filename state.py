@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+import typing
+
+import clock
+
+
+def write_file(path: str, content: str):
+    # the file is replaced in one step, a power cut leaves either the old or the new content
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as data:
+        data.write(content)
+        data.flush()
+        os.fsync(data.fileno())
+    os.replace(temporary_path, path)
+
+
+class StateStore:
+    # the running programs are written to a local file after every change, so a restart resumes them,
+    # the file is replaced in one step and a power cut leaves either the old or the new state
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self.writes = 0
+        self._path: typing.Optional[str] = None
+        self._collect: typing.Callable[[], dict] = dict
+        self._task: asyncio.Task = None
+        self._changed = False
+
+    def open(self, path: str, collect: typing.Callable[[], dict]):
+        self._path, self._collect = path, collect
+
+    def load(self) -> dict[str, dict]:
+        if not self._path:
+            return {}
+
+        try:
+            with open(self._path, 'r', encoding='utf-8') as data:
+                states = json.load(data)
+        except (OSError, ValueError) as error:
+            if not isinstance(error, FileNotFoundError):
+                print(f'Could not load state {self._path}: {error}')
+            return {}
+
+        return states if isinstance(states, dict) else {}
+
+    def mark_changed(self):
+        # changes in quick succession, like a program started on every region, are written at once
+        if not self._path:
+            return
+
+        self._changed = True
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._write_later(), name='store state')
+
+    async def _write_later(self):
+        # a change while the file is written is collected by another write
+        while self._changed:
+            await clock.current.sleep(self.delay)
+            await self.flush()
+
+    async def flush(self):
+        if not self._path:
+            return
+
+        self._changed = False
+        content = json.dumps(self._collect())
+        try:
+            await asyncio.to_thread(self._write, self._path, content)
+            self.writes += 1
+        except OSError as error:
+            print(f'Could not store state {self._path}: {error}')
+
+    @staticmethod
+    def _write(path: str, content: str):
+        write_file(path, content)
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+        self._path, self._collect, self._task, self._changed = None, dict, None, False
+
+
+store = StateStore()
@@ -1,4 +1,9 @@
-import asyncio
+import functools
+import time
+import types
+import typing
+
+import numpy
 
 try:
     import neopixel
@@ -15,81 +20,411 @@ except ModuleNotFoundError:
 
 import pydantic
 
+import clock
+
+# names usable in the configuration, resolved once instead of evaluating the configured strings
+pins: dict[str, typing.Any] = {
+    f'board.{name}': value for name, value in vars(board).items()
+    if not name.startswith('_') and not callable(value) and not isinstance(value, (str, types.ModuleType))
+}
+pixel_orders: dict[str, typing.Any] = {
+    f'neopixel.{name}': getattr(neopixel, name) for name in ('RGB', 'GRB', 'RGBW', 'GRBW') if hasattr(neopixel, name)
+}
+
+# called with the strip after every shown frame, e.g. to record a simulation
+frame_listeners: list[typing.Callable[['Strip'], None]] = []
+
+# dims all strips on top of their own brightness
+global_brightness: float = 1.0  # pylint: disable=invalid-name
+
+
+def set_global_brightness(value: float):
+    global global_brightness  # pylint: disable=global-statement,invalid-name
+    global_brightness = max(0.0, min(value, 1.0))
+
+
+# WS281x LEDs are clocked at 800 kHz and latch after a reset pause
+WIRE_FREQUENCY = 800000
+RESET_TIME = 0.00008
+
+CALIBRATION_COLORS = ((255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255))
+
+
+def get_percentiles(times: list[float]) -> dict[str, float]:
+    milliseconds = numpy.array(times) * 1000
+    return {'median': float(numpy.median(milliseconds)), 'p95': float(numpy.percentile(milliseconds, 95)),
+            'max': float(milliseconds.max())}
+
+
+# resolution of the levels of float frames, in steps per 8 bit channel value
+LEVEL_STEPS = 16
+
+
+@functools.lru_cache(maxsize=32)
+def get_lookup_table(gamma: float, brightness: float) -> numpy.ndarray:
+    # gamma correction and brightness of every 8 bit channel value in one table
+    table = numpy.round(255 * brightness * (numpy.arange(256) / 255) ** gamma).astype(numpy.uint8)
+    table.flags.writeable = False
+    return table
+
+
+@functools.lru_cache(maxsize=32)
+def get_level_table(gamma: float, brightness: float) -> numpy.ndarray:
+    # like the lookup table, but for float frames and without rounding the output levels
+    table = (255 * brightness * (numpy.arange(255 * LEVEL_STEPS + 1) / (255 * LEVEL_STEPS)) ** gamma)
+    table = table.astype(numpy.float32)
+    table.flags.writeable = False
+    return table
+
+
+class PowerSupply(pydantic.BaseModel):  # pylint: disable=no-member
+    name: str
+    max_milliamps: float = pydantic.Field(gt=0, title='Current the supply delivers to all its strips together')
+
+    _draw: dict[str, float]
+    _requested: dict[str, float]
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._draw = {}
+        self._requested = {}
+
+    @property
+    def milliamps(self) -> float:
+        return sum(self._draw.values())
+
+    @property
+    def metrics(self) -> dict:
+        return {'milliamps': self.milliamps, 'requested_milliamps': sum(self._requested.values()),
+                'max_milliamps': self.max_milliamps, 'strips': dict(self._draw)}
+
+    def share(self, identifier: str, requested: float) -> float:
+        # every strip on the supply is dimmed by the same factor, from the current all of them request, so the split
+        # does not depend on the order the strips show their frames in
+        self._requested[identifier] = requested
+        total = sum(self._requested.values())
+        return requested * self.max_milliamps / total if total > self.max_milliamps else requested
+
+    def report(self, identifier: str, milliamps: float):
+        self._draw[identifier] = milliamps
+
+    class Config:
+        underscore_attrs_are_private = True
+
 
 class Strip(pydantic.BaseModel):  # pylint: disable=no-member
     identifier: str = 'default'
     count: int = 100
     gpio: str = "board.D13"
-    brightness: float = 1.0
+    brightness: float = pydantic.Field(default=1.0, ge=0, le=1)
+    gamma: float = pydantic.Field(default=1.0, gt=0,
+                                  title='Gamma of the levels, 1 shows them as they are, 2.2 in perceptually even steps')
     bytes_per_pixel: int = 3
     type: str = "neopixel.GRB"
     power_gpio: str = "board.D18"
+    power_settle: float = pydantic.Field(default=1.0, ge=0)
+    milliamps_per_channel: float = pydantic.Field(default=20.0, ge=0, title='Current of one channel at full level')
+    idle_milliamps: float = pydantic.Field(default=1.0, ge=0, title='Current of one dark LED')
+    max_milliamps: float = pydantic.Field(default=None, gt=0, title='Budget of the strip, no limit if not set')
+    power_supply: str = pydantic.Field(default=None, title='Name of the power supply the strip shares with others')
+    dithering: bool = pydantic.Field(default=False, title='Float frames are quantized with temporal dithering')
 
     _strip: neopixel.NeoPixel
     _gpio: digitalio.DigitalInOut
     _power_gpio: digitalio.DigitalInOut
+    _powered_at: float = None
+    _pixels: numpy.ndarray
+    _shown_pixels: numpy.ndarray
+    _channels: numpy.ndarray
+    _converted: numpy.ndarray
+    _levels: numpy.ndarray
+    _level_indices: numpy.ndarray
+    _level_errors: numpy.ndarray
+    _dither_error: numpy.ndarray
+    _error_rows: numpy.ndarray
+    _power_supply: PowerSupply = None
+    _requested_milliamps: float = 0.0
+    _milliamps: float = 0.0
+    _peak_milliamps: float = 0.0
+    _frames: int = 0
+    _limited_frames: int = 0
+    _calibration: dict = None
 
     def __init__(self, **data):
         super().__init__(**data)
 
-        self._gpio = eval(self.gpio)
+        self._gpio = pins[self.gpio]
 
-        power_pin = eval(self.power_gpio)
-        self._power_gpio = digitalio.DigitalInOut(power_pin)
+        self._power_gpio = digitalio.DigitalInOut(pins[self.power_gpio])
         self._power_gpio.switch_to_output()
 
         self._strip = neopixel.NeoPixel(
             pin=self._gpio,
             n=self.count,
             bpp=self.bytes_per_pixel,
-            brightness=self.brightness,
-            pixel_order=eval(self.type),
+            brightness=1.0,  # the brightness is part of the lookup table
+            pixel_order=pixel_orders[self.type],
             auto_write=False
         )
 
+        # frames are converted into a back buffer, several writers can fill it part by part, update_strip copies
+        # the complete frame into the byte buffer of the driver in one step, which is sent to the strip as it is
+        self._pixels = numpy.zeros((self.count, self.bytes_per_pixel), dtype=numpy.uint8)
+        self._shown_pixels = numpy.frombuffer(self._strip._post_brightness_buffer,  # pylint: disable=protected-access
+                                              dtype=numpy.uint8).reshape(self.count, self.bytes_per_pixel)
+        self._channels = numpy.array(['RGBW'.index(channel) for channel in pixel_orders[self.type]],
+                                     dtype=numpy.intp)
+        self._converted = numpy.zeros((self.count, 4), dtype=numpy.uint8)
+
+        # the quantization error of every channel is carried over to the next frame
+        self._levels = numpy.zeros((self.count, 3), dtype=numpy.float32)
+        self._level_indices = numpy.zeros((self.count, 3), dtype=numpy.intp)
+        self._level_errors = numpy.zeros((self.count, 3), dtype=numpy.float32)
+        self._dither_error = numpy.zeros((self.count, 3), dtype=numpy.float32)
+        # the errors of an LED as one element, scattering whole rows is several times faster
+        self._error_rows = self._dither_error.view(numpy.dtype((numpy.void, 12)))[:, 0]
+
+    @pydantic.validator('gpio', 'power_gpio')
+    def check_pin(cls, value: str) -> str:  # pylint: disable=no-self-argument
+        if value not in pins:
+            raise ValueError(f'Pin {value} is unknown. Valid pins are: {", ".join(pins)}')
+        return value
+
+    @pydantic.validator('type')
+    def check_pixel_order(cls, value: str, values: dict) -> str:  # pylint: disable=no-self-argument
+        if value not in pixel_orders:
+            raise ValueError(f'Type {value} is unknown. Valid types are: {", ".join(pixel_orders)}')
+        if 'bytes_per_pixel' in values and len(pixel_orders[value]) != values['bytes_per_pixel']:
+            raise ValueError(f'Type {value} needs {len(pixel_orders[value])} bytes per pixel, '
+                             f'not {values["bytes_per_pixel"]}')
+        return value
+
     @property
     def strip(self) -> neopixel.NeoPixel:
         return self._strip
 
+    @property
+    def pixels(self) -> numpy.ndarray:
+        # bytes of every LED of the next frame in the order they are sent to the strip
+        return self._pixels
+
+    @property
+    def shown_pixels(self) -> numpy.ndarray:
+        # bytes of the frame sent last, dimmed if it was over the current budget
+        return self._shown_pixels
+
+    @property
+    def rgb_pixels(self) -> numpy.ndarray:
+        # levels of every LED as shown by the strip, the white of RGBW strips is added to all colors
+        channels = numpy.zeros((self.count, 4), dtype=numpy.uint16)
+        channels[:, self._channels] = self._shown_pixels
+        return numpy.minimum(channels[:, :3] + channels[:, 3:], 255).astype(numpy.uint8)
+
+    @property
+    def lookup_table(self) -> numpy.ndarray:
+        return get_lookup_table(self.gamma, self.brightness * global_brightness)
+
+    @property
+    def level_table(self) -> numpy.ndarray:
+        return get_level_table(self.gamma, self.brightness * global_brightness)
+
+    @property
+    def is_on(self) -> bool:
+        return bool(self._power_gpio.value)
+
+    def has_settings(self, data: dict) -> bool:
+        values, _, error = pydantic.validate_model(Strip, data)
+        return not error and values == self.dict()
+
+    def set_power(self, value: bool):
+        self._power_gpio.value = value
+        self._powered_at = None
+
+    def power_on(self):
+        # only switches the power, ready() waits for the remaining settle time
+        if not self.is_on:
+            self._power_gpio.value = True
+            self._powered_at = clock.current.time()
+
+    async def ready(self):
+        if self._powered_at is not None:
+            remaining = self._powered_at + self.power_settle - clock.current.time()
+            if remaining > 0:
+                await clock.current.sleep(remaining)
+
+    def release(self):
+        # frees the pins, so a strip with the same pins can be created afterwards
+        self._strip.deinit()
+        self._power_gpio.deinit()
+
     async def run_tests(self):
         print(f'Starting tests for strip {self.identifier}.')
         await self.switch_on()
 
         print(f'Coloring reds for {self.identifier}.')
-        for index in range(self.count):
-            self._strip[index] = (255, 0, 0)
-            self._strip.show()
+        self.set_colors((255, 0, 0), 0, self.count)
+        self.update_strip()
 
-        await asyncio.sleep(1)
+        await clock.current.sleep(1)
 
         print(f'Coloring greens for {self.identifier}.')
-        for index in range(self.count):
-            self._strip[index] = (0, 255, 0)
-            self._strip.show()
+        self.set_colors((0, 255, 0), 0, self.count)
+        self.update_strip()
 
-        await asyncio.sleep(1)
+        await clock.current.sleep(1)
 
         await self.switch_off()
         print(f'Finished tests for strip {self.identifier}.')
 
+    @property
+    def calibration(self) -> typing.Optional[dict]:
+        return self._calibration
+
+    @property
+    def max_fps(self) -> typing.Optional[float]:
+        return self._calibration['max_fps'] if self._calibration else None
+
+    async def calibrate(self, samples: int = 20, hold: float = 0.5) -> dict:
+        # every test color is filled at once and shown for a moment, so the wiring can be checked by eye as well;
+        # the durations are hardware times, so they are measured on the real clock
+        print(f'Calibrating strip {self.identifier}.')
+        await self.switch_on()
+
+        indices = numpy.arange(self.count)
+        convert_times, show_times = [], []
+        for color in CALIBRATION_COLORS:
+            colors = numpy.broadcast_to(numpy.array(color, dtype=numpy.uint8), (self.count, 3))
+            for _ in range(samples):
+                started = time.perf_counter()
+                self.set_pixels(indices, colors)
+                converted = time.perf_counter()
+                self.update_strip()
+                convert_times.append(converted - started)
+                show_times.append(time.perf_counter() - converted)
+                await clock.current.sleep(0)
+
+            await clock.current.sleep(hold)
+
+        await self.switch_off()
+
+        # the strip cannot latch faster than the data is clocked out, even if show() returns earlier
+        wire_time = self.count * self.bytes_per_pixel * 8 / WIRE_FREQUENCY + RESET_TIME
+        frame_time = max(float(numpy.percentile(numpy.add(convert_times, show_times), 95)), wire_time)
+        self._calibration = {
+            'count': self.count,
+            'bytes_per_pixel': self.bytes_per_pixel,
+            'samples': len(show_times),
+            'wire_milliseconds': wire_time * 1000,
+            'convert_milliseconds': get_percentiles(convert_times),
+            'show_milliseconds': get_percentiles(show_times),
+            'max_fps': 1 / frame_time,
+        }
+        print(f'Calibrated strip {self.identifier}: {self._calibration["max_fps"]:.1f} fps.')
+        return self._calibration
+
     def set_colors(self, color: tuple[int, int, int], start_index: int, length: int = 1):
-        if self._strip:
-            self._strip[start_index: start_index + length] = [color] * length
+        colors = numpy.broadcast_to(numpy.array(color, dtype=numpy.uint8), (length, 3))
+        self.set_pixels(numpy.arange(start_index, start_index + length), colors)
+
+    def set_pixels(self, indices: numpy.ndarray, colors: numpy.ndarray):
+        # gamma and brightness, white extraction and channel order for all LEDs at once,
+        # float colors from 0 to 255 are quantized with temporal dithering if enabled
+        converted = self._converted[:len(indices)]
+        if colors.dtype == numpy.uint8:
+            numpy.take(self.lookup_table, colors, out=converted[:, :3])
+        elif self.dithering:
+            self._dither(indices, colors, converted[:, :3])
+        else:
+            numpy.take(self.lookup_table, numpy.clip(numpy.rint(colors), 0, 255).astype(numpy.uint8),
+                       out=converted[:, :3])
+
+        if self.bytes_per_pixel == 4:
+            white = converted[:, 3]
+            numpy.min(converted[:, :3], axis=1, out=white)
+            converted[:, :3] -= white[:, None]
+
+        self._pixels[indices] = converted[:, self._channels]
+
+    def _dither(self, indices: numpy.ndarray, colors: numpy.ndarray, out: numpy.ndarray):
+        # the output levels are rounded, the rounding error is added to the next frame of the LED,
+        # so over some frames the strip shows the level in between two 8 bit values on average
+        levels = self._levels[:len(indices)]
+        level_indices = self._level_indices[:len(indices)]
+        numpy.multiply(colors, LEVEL_STEPS, out=levels)
+        numpy.clip(levels, 0, 255 * LEVEL_STEPS, out=levels)
+        numpy.rint(levels, out=levels)
+        level_indices[:] = levels
+        numpy.take(self.level_table, level_indices, out=levels)
+
+        error = self._level_errors[:len(indices)]
+        levels += numpy.take(self._dither_error, indices, axis=0, out=error)
+        numpy.clip(levels, 0, 255, out=levels)
+        numpy.rint(levels, out=out, casting='unsafe')
+        numpy.subtract(levels, out, out=error)
+        self._error_rows[indices] = error.view(self._error_rows.dtype)[:, 0]
+
+    @property
+    def power_metrics(self) -> dict:
+        return {
+            'milliamps': self._milliamps,
+            'requested_milliamps': self._requested_milliamps,
+            'peak_milliamps': self._peak_milliamps,
+            'max_milliamps': self.max_milliamps,
+            'power_supply': self.power_supply,
+            'frames': self._frames,
+            'limited_frames': self._limited_frames,
+        }
+
+    def set_power_supply(self, power_supply: typing.Optional[PowerSupply]):
+        self._power_supply = power_supply
+
+    def _publish(self):
+        # the current follows from the bytes of the frame, a frame over budget is dimmed as a whole on the way
+        # to the driver, the back buffer keeps the levels for the writers of the next frame
+        idle = self.idle_milliamps * self.count
+        per_level = self.milliamps_per_channel / 255
+        requested = idle + per_level * int(self._pixels.sum())
+
+        budget = self.max_milliamps or numpy.inf
+        if self._power_supply is not None:
+            budget = min(budget, self._power_supply.share(self.identifier, requested))
+
+        drawn = requested
+        if requested > budget:
+            numpy.multiply(self._pixels, max(budget - idle, 0.0) / (requested - idle), out=self._shown_pixels,
+                           casting='unsafe')
+            drawn = idle + per_level * int(self._shown_pixels.sum())
+            self._limited_frames += 1
+        else:
+            numpy.copyto(self._shown_pixels, self._pixels)
+
+        self._frames += 1
+        self._requested_milliamps = requested
+        self._milliamps = drawn
+        self._peak_milliamps = max(self._peak_milliamps, requested)
+        if self._power_supply is not None:
+            self._power_supply.report(self.identifier, drawn)
 
     def update_strip(self):
+        self._publish()
         self._strip.show()
+        for listener in frame_listeners:
+            listener(self)
 
     async def switch_on(self):
-        self._power_gpio.value = True
-        await asyncio.sleep(1)
+        self.power_on()
+        await self.ready()
 
     async def switch_off(self):
-        for index in range(self.count):
-            self._strip[index] = tuple([0] * self.bytes_per_pixel)
-        self._strip.show()
+        self._pixels[:] = 0
+        self.update_strip()
 
-        await asyncio.sleep(1)
+        await clock.current.sleep(self.power_settle)
         self._power_gpio.value = False
+        self._powered_at = None
+        if self._power_supply is not None:
+            self._power_supply.share(self.identifier, 0.0)
+            self._power_supply.report(self.identifier, 0.0)
 
     class Config:
         underscore_attrs_are_private = True
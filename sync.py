@@ -0,0 +1,206 @@
+import asyncio
+import collections
+import enum
+import json
+import typing
+
+import pydantic
+
+import clock
+import effects
+
+PORT = 5810
+
+# clock samples kept by a follower, the one with the shortest round trip gives the offset
+SAMPLES = 8
+
+
+class SyncRole(enum.Enum):
+    LEADER = 'leader'
+    FOLLOWER = 'follower'
+
+
+class SyncSettings(pydantic.BaseModel):
+    role: SyncRole
+    leader: str = pydantic.Field(default='127.0.0.1', title='Address of the leader, the leader listens on it')
+    port: int = pydantic.Field(default=PORT, ge=0, lt=65536)
+    interval: float = pydantic.Field(default=1.0, gt=0, title='Seconds between clock samples and full states')
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, sync_node: 'SyncNode'):
+        self._node = sync_node
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return
+        if isinstance(message, dict):
+            self._node.receive(message, addr)
+
+    def error_received(self, exc: Exception):
+        print(f'Sync: {exc}')
+
+
+class SyncNode:
+    # several servers share one timeline, the wall time of the leader; followers measure their offset to it with
+    # UDP pings and run the programs of the leader with the same start times, so they show the same phase
+    def __init__(self, wall_time: typing.Callable[[], float] = None):
+        self.settings: typing.Optional[SyncSettings] = None
+        self.offset = 0.0
+        self.round_trip: typing.Optional[float] = None
+        self.states_received = 0
+        self._wall_time = wall_time
+        self._samples: collections.deque = collections.deque(maxlen=SAMPLES)
+        self._followers: dict[tuple, float] = {}
+        self._collect: typing.Callable[[], dict] = dict
+        self._apply: typing.Callable[[dict], typing.Awaitable] = None
+        self._transport: asyncio.DatagramTransport = None
+        self._task: asyncio.Task = None
+        self._sent_state: str = None
+        self._pending_state: dict = None
+        self._apply_task: asyncio.Task = None
+
+    @property
+    def role(self) -> typing.Optional[SyncRole]:
+        return self.settings.role if self.settings else None
+
+    @property
+    def is_synchronized(self) -> bool:
+        # a follower is on the shared timeline once it has measured its offset
+        return self.role == SyncRole.LEADER or (self.role == SyncRole.FOLLOWER and bool(self._samples))
+
+    @property
+    def port(self) -> typing.Optional[int]:
+        return self._transport.get_extra_info('sockname')[1] if self._transport else None
+
+    @property
+    def metrics(self) -> dict:
+        return {
+            'role': self.role.value if self.role else None,
+            'synchronized': self.is_synchronized,
+            'offset_milliseconds': self.offset * 1000,
+            'round_trip_milliseconds': self.round_trip * 1000 if self.round_trip is not None else None,
+            'followers': len(self._followers),
+            'states_received': self.states_received,
+        }
+
+    def time(self) -> float:
+        # time of the shared timeline, the wall time of a server running on its own
+        return self.wall_time() + self.offset
+
+    def wall_time(self) -> float:
+        return self._wall_time() if self._wall_time else clock.current.wall_time()
+
+    async def start(self, settings: SyncSettings, collect: typing.Callable[[], dict],
+                    apply: typing.Callable[[dict], typing.Awaitable]):
+        await self.stop()
+        self.settings, self._collect, self._apply = settings, collect, apply
+
+        loop = asyncio.get_running_loop()
+        if settings.role == SyncRole.LEADER:
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _Protocol(self), local_addr=(settings.leader, settings.port))
+            self._task = asyncio.create_task(self._lead(), name='sync leader')
+        else:
+            # a connected socket only receives the datagrams of the leader
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _Protocol(self), remote_addr=(settings.leader, settings.port))
+            self._task = asyncio.create_task(self._follow(), name='sync follower')
+
+    async def stop(self):
+        for task in (self._task, self._apply_task):
+            if task:
+                task.cancel()
+        if self._transport:
+            self._transport.close()
+
+        self.settings, self._transport, self._task, self._apply_task = None, None, None, None
+        self.offset, self.round_trip, self._sent_state, self._pending_state = 0.0, None, None, None
+        self._samples.clear()
+        self._followers.clear()
+
+    def _send(self, message: dict, address: tuple = None):
+        if self._transport:
+            self._transport.sendto(json.dumps(message).encode(), address)
+
+    async def _lead(self):
+        # changes are sent right away, the whole state once per interval for followers which missed a datagram
+        elapsed = 0.0
+        while True:
+            content = json.dumps(self._collect(), sort_keys=True)
+            if content != self._sent_state or elapsed >= self.settings.interval:
+                self._sent_state, elapsed = content, 0.0
+                self._broadcast(content)
+
+            await clock.current.sleep(self.settings.interval / 10)
+            elapsed += self.settings.interval / 10
+
+    def _broadcast(self, content: str):
+        now = clock.current.time()
+        for address, seen in list(self._followers.items()):
+            if now - seen > 5 * self.settings.interval:
+                del self._followers[address]
+            else:
+                self._transport.sendto(f'{{"type": "state", "blocks": {content}}}'.encode(), address)
+
+    async def _follow(self):
+        # a few quick samples first, so a follower is synchronized shortly after starting
+        for _ in range(3):
+            self._send({'type': 'ping', 'sent': self.wall_time()})
+            await clock.current.sleep(self.settings.interval / 10)
+
+        while True:
+            self._send({'type': 'ping', 'sent': self.wall_time()})
+            await clock.current.sleep(self.settings.interval)
+
+    def receive(self, message: dict, address: tuple):
+        match message.get('type'), self.role:
+            case 'ping', SyncRole.LEADER:
+                is_new = address not in self._followers
+                self._followers[address] = clock.current.time()
+                self._send({'type': 'pong', 'sent': message.get('sent'), 'time': self.time()}, address)
+                if is_new and self._sent_state is not None:
+                    self._transport.sendto(f'{{"type": "state", "blocks": {self._sent_state}}}'.encode(), address)
+            case 'pong', SyncRole.FOLLOWER:
+                self._add_sample(message)
+            case 'state', SyncRole.FOLLOWER if self.is_synchronized and isinstance(message.get('blocks'), dict):
+                self.states_received += 1
+                self._pending_state = message['blocks']
+                if not self._apply_task or self._apply_task.done():
+                    self._apply_task = asyncio.create_task(self._apply_states(), name='apply sync state')
+
+    def _add_sample(self, message: dict):
+        try:
+            sent, leader_time = float(message['sent']), float(message['time'])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        # the leader read its clock about half way through the round trip
+        received = self.wall_time()
+        round_trip = received - sent
+        if round_trip < 0:
+            return
+        self._samples.append((round_trip, leader_time + round_trip / 2 - received))
+        self.round_trip, self.offset = min(self._samples)
+
+    async def _apply_states(self):
+        # only the latest state is applied, states arriving meanwhile replace each other
+        while self._pending_state is not None:
+            states, self._pending_state = self._pending_state, None
+            try:
+                await self._apply(states)
+            except (KeyError, TypeError, ValueError) as error:
+                print(f'Sync: could not apply the state of the leader: {error}')
+
+
+def align(effect: effects.Effect, started: float, time: float, steps: int):
+    # an effect which fell behind the time of a frame skips ahead, like after rendering the frame with more steps;
+    # its start is rounded to a frame of the timeline
+    behind = round(time * effect.fps) - round(started * effect.fps) - (effect.frame_number + steps - 1)
+    if behind > 0:
+        effect.advance(behind)
+
+
+node = SyncNode()
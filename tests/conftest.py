@@ -1,8 +1,40 @@
+import asyncio
+
 import pytest
 import fastapi.testclient
 
+import clock
 import controller
 
+VIRTUAL_CLOCK = clock.VirtualClock()
+
+
+def pytest_configure():
+    # every event loop of the tests runs on virtual time, waiting for programs and strips costs no real time
+    asyncio.set_event_loop_policy(clock.VirtualEventLoopPolicy(VIRTUAL_CLOCK))
+    clock.current = VIRTUAL_CLOCK
+
+
+@pytest.fixture
+def virtual_clock() -> clock.VirtualClock:
+    return VIRTUAL_CLOCK
+
+
+@pytest.fixture(autouse=True)
+def state_file(tmp_path, monkeypatch) -> str:
+    # programs started by a test must not be resumed by the next one
+    path = str(tmp_path / 'state.json')
+    monkeypatch.setattr(controller.DataInitialize, 'state_file', path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def expressions_file(tmp_path, monkeypatch) -> str:
+    # expressions stored by a test must not show up in the next one
+    path = str(tmp_path / 'expressions.json')
+    monkeypatch.setattr(controller.DataInitialize, 'expressions_file', path)
+    return path
+
 
 @pytest.fixture
 def client():
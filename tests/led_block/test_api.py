@@ -1,3 +1,8 @@
+import audio
+import clock
+import pages
+
+
 class TestAPI:
 
     def test_show_blocks_returns_200(self, client):
@@ -8,6 +13,23 @@ class TestAPI:
         response = client.get('/block/default/')
         assert response.status_code == 200
 
+    def test_show_block_is_rendered_once(self, client):
+        client.get('/block/default/')
+        renders = pages.cache.renders
+
+        response = client.get('/block/default/')
+
+        assert response.status_code == 200
+        assert pages.cache.renders == renders
+
+    def test_show_block_returns_304_for_known_etag(self, client):
+        etag = client.get('/block/default/').headers['ETag']
+
+        response = client.get('/block/default/', headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+        assert not response.content
+
     def test_show_block_returns_404_for_unknown_block(self, client):
         response = client.get('/block/unknown/')
         assert response.status_code == 404
@@ -24,6 +46,88 @@ class TestAPI:
         response = client.get('/block/default/colors/')
         assert response.status_code == 200
 
+    def test_get_act_colors_returns_preview_interval(self, client):
+        response = client.get('/block/default/colors/')
+        assert response.headers['X-Preview-Interval'] == '200'
+
+    def test_get_act_colors_returns_seed_of_running_effect(self, client):
+        client.post('/block/default/?program=twinkle&seed=7')
+        client.portal.call(clock.current.sleep, 1.2)
+
+        response = client.get('/block/default/colors/')
+
+        assert response.headers['X-Effect-Seed'] == '7'
+
     def test_get_act_colors_return_404_for_unknown_block(self, client):
         response = client.get('/block/unknown/colors/')
         assert response.status_code == 404
+
+    def test_add_layer_returns_layers(self, client):
+        response = client.post('/block/default/layers/?program=sparkle&blend_mode=max&opacity=0.5&first_row=7')
+        assert response.status_code == 200
+        assert response.json()[-1]['blend_mode'] == 'max'
+
+        client.delete('/block/default/layers/')
+
+    def test_add_layer_returns_400_for_block_based_program(self, client):
+        response = client.post('/block/default/layers/?program=fading')
+        assert response.status_code == 400
+
+    def test_set_program_returns_400_for_missing_audio_source(self, client):
+        response = client.post('/block/default/?program=audio&source=missing.wav')
+        assert response.status_code == 400
+
+    def test_set_program_returns_400_for_audio_source_not_configured(self, client):
+        response = client.post('/block/default/', params={'program': 'audio', 'source': '/etc/passwd'})
+        assert response.status_code == 400
+        assert 'audio_sources' in response.json()['detail']
+
+    def test_set_program_returns_400_for_option_of_another_program(self, client):
+        response = client.post('/block/default/', params={'program': 'twinkle', 'source': 'foo.wav'})
+        assert response.status_code == 400
+
+    def test_add_layer_returns_400_for_option_of_another_program(self, client):
+        response = client.post('/block/default/layers/', params={'program': 'sparkle', 'expression': 'hue = x'})
+        assert response.status_code == 400
+
+    def test_set_program_runs_expression(self, client):
+        response = client.post('/block/default/', params={'program': 'expression', 'expression': 'hue = x / cols'})
+        assert response.status_code == 302
+
+    def test_set_program_returns_400_for_invalid_expression(self, client):
+        response = client.post('/block/default/', params={'program': 'expression', 'expression': 'hue = x.real'})
+        assert response.status_code == 400
+
+    def test_set_program_runs_color_run_with_easing(self, client):
+        response = client.post('/block/default/', params={'program': 'color_run', 'easing': 'ease_out'})
+        assert response.status_code == 302
+
+    def test_set_program_returns_422_for_unknown_easing(self, client):
+        response = client.post('/block/default/', params={'program': 'color_run', 'easing': 'bounce'})
+        assert response.status_code == 422
+
+    def test_show_block_offers_configured_expressions(self, client):
+        assert b'program=expression&expression=rainbow"' in client.get('/block/default/').content
+
+    def test_show_block_offers_stdin_audio_only_if_allowed(self, client, monkeypatch):
+        assert b'source=-' not in client.get('/block/default/').content
+
+        monkeypatch.setattr(audio, 'allowed_sources', ['-'])
+        pages.cache.clear()
+        assert b'source=-' in client.get('/block/default/').content
+
+    def test_get_layers_returns_200_for_known_block(self, client):
+        response = client.get('/block/default/layers/')
+        assert response.status_code == 200
+
+    def test_remove_layer_removes_layer(self, client):
+        client.post('/block/default/layers/?program=twinkle')
+
+        response = client.delete('/block/default/layers/0/')
+
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_remove_layer_returns_404_for_unknown_layer(self, client):
+        response = client.delete('/block/default/layers/3/')
+        assert response.status_code == 404
@@ -1,11 +1,17 @@
 import asyncio
 import typing
 
+import numpy
 import pydantic
 import pytest
 
+import clock
+import compositing
+import effects
+import keyframes
 import led_block
 import strip
+import workers
 
 
 class TestLedMatrix:
@@ -27,6 +33,19 @@ class TestLedMatrix:
 
     class TestProperties:
 
+        def test_frame_rate_is_fps_without_calibration(self):
+            matrix = led_block.LedMatrix(strip_obj=strip.Strip(), fps=40)
+            assert matrix.frame_rate == 40
+
+        def test_frame_rate_is_limited_by_calibrated_strip(self):
+            calibrated_strip = strip.Strip()
+            calibrated_strip._calibration = {'max_fps': 25.0}
+
+            matrix = led_block.LedMatrix(strip_obj=calibrated_strip, fps=40)
+
+            assert matrix.frame_rate == 25
+            assert matrix.create_effect(led_block.BlockProgram.TWINKLE).fps == 25
+
         def test_name(self):
             matrix = led_block.LedMatrix(name='name')
             assert matrix.name == 'name'
@@ -116,6 +135,40 @@ class TestLedMatrix:
 
             assert self._last_future.__name__ == '_run_fading'
 
+        async def test_color_run_keeps_its_easing(self, monkeypatch):
+            monkeypatch.setattr(led_block.LedMatrix, '_run_new_task', self.mock_run_new_task)
+
+            matrix = led_block.LedMatrix()
+            await matrix.run_program(led_block.BlockProgram.COLOR_RUN, easing=keyframes.Easing.STEP)
+            self._last_future.close()
+
+            assert matrix.state['program']['easing'] == 'step'
+            assert matrix._parse_settings(matrix.state['program'])['easing'] == keyframes.Easing.STEP
+
+        async def test_random_uses_its_default_easing(self, monkeypatch):
+            monkeypatch.setattr(led_block.LedMatrix, '_run_new_task', self.mock_run_new_task)
+
+            matrix = led_block.LedMatrix()
+            await matrix.run_program(led_block.BlockProgram.RANDOM)
+            self._last_future.close()
+
+            assert matrix.program_settings['easing'] == keyframes.Easing.LINEAR
+
+        @pytest.mark.parametrize("program", (
+                led_block.BlockProgram.TWINKLE,
+                led_block.BlockProgram.SPARKLE,
+                led_block.BlockProgram.RANDOM_DECAY,
+        ))
+        async def test_random_effects_call_run_effect(self, monkeypatch, program):
+            monkeypatch.setattr(led_block.LedMatrix, '_run_new_task', self.mock_run_new_task)
+
+            matrix = led_block.LedMatrix()
+            await matrix.run_program(program, seed=5)
+            await asyncio.sleep(0.1)
+
+            assert self._last_future.__name__ == '_run_effect'
+            assert self._last_future.cr_frame.f_locals['effect'].seed == 5
+
     @pytest.mark.asyncio
     class TestStopActTask:
 
@@ -205,6 +258,278 @@ class TestLedMatrix:
 
                 assert all(block.color in [red, blue] for block in matrix.all_blocks)
 
+            async def test_shows_the_first_frame_once_complete(self, monkeypatch):
+                matrix = TestLedMatrix.TestTasks.get_matrix_with_black_blocks()
+                shown = []
+
+                async def show_keyframe(shown_matrix: led_block.LedMatrix, *_):
+                    shown.append([block.color for block in shown_matrix.all_blocks])
+
+                monkeypatch.setattr(led_block.LedMatrix, '_show_keyframe', show_keyframe)
+
+                await matrix._run_random_with_color(led_block.Color(red=200), led_block.Color(blue=200))
+
+                assert len(shown) == 1
+                assert not any(color.is_black for color in shown[0])
+
+        class TestRunColorRun:
+
+            async def test_blends_from_one_step_to_the_next(self):
+                shown = []
+                matrix = led_block.LedMatrix(strip_obj=strip.Strip(count=10), fps=20, rows=1, cols=2,
+                                             blocks=[[led_block.LedBlock(start=0, end=5),
+                                                      led_block.LedBlock(start=5, end=10)]])
+
+                def on_frame(shown_strip: strip.Strip):
+                    shown.append((clock.current.time(), shown_strip.rgb_pixels[0, 0]))
+
+                strip.frame_listeners.append(on_frame)
+                started = clock.current.time()
+                try:
+                    matrix._is_running = True
+                    await asyncio.gather(matrix._run_color_run(led_block.Color(red=200), led_block.Color(blue=200),
+                                                               keyframes.Easing.LINEAR),
+                                         TestLedMatrix.TestTasks.call_stop(matrix, wait_time=0.9))
+                finally:
+                    strip.frame_listeners.remove(on_frame)
+
+                # the first block runs from red to blue within the half second after the first step
+                reds = [red for time, red in shown if time < started + 1.0]
+                assert len(reds) > 15
+                assert len(set(reds)) > 5
+                assert reds == sorted(reds, reverse=True)
+                assert not matrix._keyframes
+
+        class TestRunFading:
+
+            @staticmethod
+            async def count_frames(dithering: bool) -> tuple[led_block.LedMatrix, int]:
+                shown = []
+                matrix = led_block.LedMatrix(strip_obj=strip.Strip(count=10, dithering=dithering), fps=25, rows=2,
+                                             cols=1, blocks=[[led_block.LedBlock(start=0, end=5)],
+                                                             [led_block.LedBlock(start=5, end=10)]])
+
+                def on_frame(_):
+                    shown.append(clock.current.time())
+
+                strip.frame_listeners.append(on_frame)
+                started = clock.current.time()
+                try:
+                    matrix._is_running = True
+                    await asyncio.gather(matrix._run_fading(led_block.Color(red=10), led_block.Color(blue=10)),
+                                         TestLedMatrix.TestTasks.call_stop(matrix, wait_time=0.39))
+                finally:
+                    strip.frame_listeners.remove(on_frame)
+                return matrix, len([time for time in shown if time < started + 0.39])
+
+            async def test_shows_a_frame_per_step(self):
+                matrix, frames = await self.count_frames(dithering=False)
+
+                assert frames == 2
+                assert matrix._block_levels is None
+
+            async def test_dithered_strip_shows_fading_at_frame_rate_with_float_colors(self):
+                matrix, frames = await self.count_frames(dithering=True)
+
+                assert frames == 10
+                assert matrix._block_levels.dtype == numpy.float32
+                assert matrix._block_levels.shape == (2, 3)
+
+        class TestRunEffect:
+
+            async def test_sets_blocks_to_rendered_colors(self):
+                matrix = TestLedMatrix.TestTasks.get_matrix_with_black_blocks()
+                effect = effects.RandomDecay(matrix.geometry, led_block.ColorConverter.get_palette(), seed=1,
+                                             rate=1000)
+
+                matrix._is_running = True
+                await asyncio.gather(matrix._run_effect(effect), TestLedMatrix.TestTasks.call_stop(matrix))
+
+                assert any(not block.color.is_black for block in matrix.all_blocks)
+
+            async def test_frame_of_new_input_is_shown_right_away(self):
+                class InputEffect(effects.Twinkle):
+                    def listen(self, callback) -> bool:
+                        self.callback = callback  # pylint: disable=attribute-defined-outside-init
+                        return True
+
+                shown = []
+                matrix = led_block.LedMatrix(strip_obj=strip.Strip(count=10), fps=10, rows=1, cols=2,
+                                             blocks=[[led_block.LedBlock(start=0, end=5),
+                                                      led_block.LedBlock(start=5, end=10)]])
+                effect = InputEffect(matrix.geometry, led_block.ColorConverter.get_palette(), seed=1, fps=10)
+
+                def on_frame(_):
+                    shown.append(clock.current.time())
+
+                strip.frame_listeners.append(on_frame)
+                try:
+                    matrix._is_running = True
+                    task = asyncio.create_task(matrix._run_effect(effect))
+                    await asyncio.sleep(0.55)
+                    arrived = clock.current.time()
+                    effect.callback()
+                    await asyncio.sleep(0.01)
+
+                    matrix._is_running = False
+                    await task
+                finally:
+                    strip.frame_listeners.remove(on_frame)
+
+                # frames keep the frame rate without input
+                assert arrived in shown
+                assert numpy.allclose(numpy.diff([time for time in shown if time < arrived])[1:], 0.1)
+
+            async def test_expensive_effects_are_rendered_by_a_worker(self, monkeypatch):
+                pool = workers.RenderPool(processes=1)
+                monkeypatch.setattr(workers, 'pool', pool)
+                matrix = TestLedMatrix.TestTasks.get_matrix_with_black_blocks()
+
+                try:
+                    await pool.start()
+                    effect = matrix.create_effect(led_block.BlockProgram.EXPRESSION, expression='red = 1', seed=1)
+                    assert isinstance(effect, workers.WorkerEffect)
+                    assert not isinstance(matrix.create_effect(led_block.BlockProgram.TWINKLE), workers.WorkerEffect)
+                    assert effect.wait(5)  # the worker process starts first
+
+                    matrix._is_running = True
+                    await asyncio.gather(matrix._run_effect(effect), TestLedMatrix.TestTasks.call_stop(matrix))
+
+                    assert all(block.color == led_block.Color(red=255) for block in matrix.all_blocks)
+                finally:
+                    pool.close()
+
+    @pytest.mark.asyncio
+    class TestLayers:
+
+        @staticmethod
+        def get_matrix() -> led_block.LedMatrix:
+            return led_block.LedMatrix(strip_obj=strip.Strip(), blocks=[
+                [led_block.LedBlock(start=0, end=5), led_block.LedBlock(start=5, end=10)],
+                [led_block.LedBlock(start=10, end=15), led_block.LedBlock(start=15, end=20)],
+            ])
+
+        async def test_add_layer_starts_renderer(self):
+            matrix = self.get_matrix()
+
+            await matrix.add_layer(led_block.BlockProgram.TWINKLE, seed=1)
+
+            assert matrix.is_rendering
+            assert len(matrix.layers) == 1
+            matrix.clear_layers()
+
+        async def test_add_layer_rejects_block_based_program(self):
+            matrix = self.get_matrix()
+
+            with pytest.raises(ValueError):
+                await matrix.add_layer(led_block.BlockProgram.FADING)
+
+        async def test_layer_is_composited_over_block_colors(self):
+            matrix = self.get_matrix()
+            for block in matrix.all_blocks:
+                block.color = led_block.Color(blue=100)
+
+            await matrix.add_layer(led_block.BlockProgram.RANDOM_DECAY, colors=[led_block.Color(red=200)], seed=1,
+                                   blend_mode=compositing.BlendMode.MAX, rows=(0, 0))
+            matrix._layers.layers[0].effect._hits_per_frame = 100
+            await asyncio.sleep(0.1)
+
+            shown = matrix.shown_colors
+            assert any(color.red for color in shown[0])
+            assert all(color == led_block.Color(blue=100) for color in shown[1])
+            assert all(block.color == led_block.Color(blue=100) for block in matrix.all_blocks)
+            matrix.clear_layers()
+
+        async def test_renderer_stops_without_layers(self):
+            matrix = self.get_matrix()
+            await matrix.add_layer(led_block.BlockProgram.SPARKLE)
+
+            matrix.remove_layer(0)
+            await asyncio.sleep(0.1)
+
+            assert not matrix.is_rendering
+
+        async def test_stop_clears_layers(self):
+            matrix = self.get_matrix()
+            await matrix.add_layer(led_block.BlockProgram.SPARKLE)
+
+            await matrix._run_stop()
+
+            assert not matrix.layers
+
+    class TestRegions:
+
+        @staticmethod
+        def get_matrix(regions: list[dict]) -> led_block.LedMatrix:
+            return led_block.LedMatrix(name='regions', strip_obj=strip.Strip(), blocks=[
+                [[0, 5], [5, 10]],
+                [[10, 15], [15, 20]],
+                [[20, 25], [25, 30]],
+            ], regions=regions)
+
+        def test_region_is_known_block(self):
+            matrix = self.get_matrix([{'name': 'top', 'rows': [0, 0]}])
+
+            assert led_block.known_blocks['regions.top'] is matrix._regions['top']
+            assert matrix.region_names == ['regions.top']
+
+        def test_region_by_rows_and_cols(self):
+            self.get_matrix([{'name': 'corner', 'rows': [1, 2], 'cols': [1, 1]}])
+
+            region = led_block.known_blocks['regions.corner']
+
+            assert (region.rows, region.cols) == (2, 1)
+            assert [block.start for block in region.all_blocks] == [15, 25]
+
+        def test_region_by_blocks(self):
+            matrix = self.get_matrix([{'name': 'diagonal', 'blocks': [[0, 0], [2, 1]]}])
+
+            region = matrix._regions['diagonal']
+
+            assert [block.start for block in region.all_blocks] == [0, 25]
+            assert matrix.geometry.led_index[region._parent_leds].tolist() == region.geometry.led_index.tolist()
+
+        def test_empty_region_raises_error(self):
+            with pytest.raises(ValueError):
+                self.get_matrix([{'name': 'nothing', 'rows': [5, 6]}])
+
+        @pytest.mark.asyncio
+        async def test_regions_render_concurrently_in_one_frame(self, monkeypatch):
+            matrix = self.get_matrix([{'name': 'top', 'rows': [0, 0]}, {'name': 'bottom', 'rows': [1, 2]}])
+            shows = 0
+
+            def count_show(_):
+                nonlocal shows
+                shows += 1
+
+            monkeypatch.setattr(strip.Strip, 'update_strip', count_show)
+
+            await matrix._regions['top'].run_program(led_block.BlockProgram.FIXED, colors=[led_block.Color(red=100)])
+            await matrix._regions['bottom'].run_program(led_block.BlockProgram.RANDOM_DECAY, seed=1)
+            await asyncio.sleep(1.2)  # switching on the strip
+            shows = 0
+            await asyncio.sleep(0.5)
+
+            assert matrix.is_rendering
+            assert all(color == led_block.Color(red=100) for color in matrix.shown_colors[0])
+            assert not any(block.color.red for block in matrix.all_blocks)
+            assert 0 < shows <= 0.5 * matrix.fps + 1
+
+            matrix._regions['bottom']._deactivate()
+            matrix._regions['top']._deactivate()
+
+        @pytest.mark.asyncio
+        async def test_stop_of_matrix_stops_regions(self):
+            matrix = self.get_matrix([{'name': 'top', 'rows': [0, 0]}])
+            await matrix._regions['top'].run_program(led_block.BlockProgram.SPARKLE)
+            await asyncio.sleep(0.1)
+
+            await matrix._run_stop()
+            await asyncio.sleep(0.1)
+
+            assert not matrix._active_regions
+            assert not matrix.is_rendering
+
     class TestGetDistance:
 
         @pytest.mark.parametrize("start, end, result", [
@@ -220,5 +545,3 @@ class TestLedMatrix:
         ])
         def test_with_size_10(self, start, end, result):
             assert led_block.LedMatrix.get_distance(start, end, 10) == result
-
-
@@ -0,0 +1,212 @@
+import os
+import time
+import wave
+
+import numpy
+import pytest
+
+import audio
+import effects
+
+SAMPLE_RATE = 16000
+
+
+def get_tone(frequency: float, seconds: float = 1.0) -> numpy.ndarray:
+    times = numpy.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (numpy.sin(2 * numpy.pi * frequency * times) * 16000).astype('<i2')
+
+
+def write_wave(path, samples: numpy.ndarray, channels: int = 1) -> str:
+    with wave.open(str(path), 'wb') as file:
+        file.setnchannels(channels)
+        file.setsampwidth(2)
+        file.setframerate(SAMPLE_RATE)
+        file.writeframes(samples.tobytes())
+    return str(path)
+
+
+def get_geometry(rows: int = 4, cols: int = 8) -> effects.Geometry:
+    return effects.Geometry([[(2 * (row * cols + col), 2 * (row * cols + col) + 2) for col in range(cols)]
+                             for row in range(rows)])
+
+
+PALETTE = numpy.array([[0, 255, 0], [255, 0, 0]], dtype=numpy.float32)
+
+
+@pytest.fixture(autouse=True)
+def allowed_sources(tmp_path, monkeypatch) -> list[str]:
+    sources = [str(tmp_path)]
+    monkeypatch.setattr(audio, 'allowed_sources', sources)
+    return sources
+
+
+class TestWaveSource:
+
+    def test_reads_requested_samples_and_loops(self, tmp_path):
+        source = audio.WaveSource(write_wave(tmp_path / 'tone.wav', get_tone(440, 0.01)))
+
+        assert len(source.read(100)) == 100
+        assert len(source.read(100)) == 100  # 160 samples in the file, the second read wraps around
+        source.close()
+
+    def test_stereo_is_mixed_to_mono(self, tmp_path):
+        samples = numpy.stack([numpy.full(10, 16384), numpy.zeros(10)], axis=1).astype('<i2')
+        source = audio.WaveSource(write_wave(tmp_path / 'stereo.wav', samples.ravel(), channels=2))
+
+        assert numpy.allclose(source.read(10), 0.25)
+        source.close()
+
+    def test_only_16_bit_is_supported(self, tmp_path):
+        path = str(tmp_path / 'eight.wav')
+        with wave.open(path, 'wb') as file:
+            file.setnchannels(1)
+            file.setsampwidth(1)
+            file.setframerate(SAMPLE_RATE)
+            file.writeframes(bytes(10))
+
+        with pytest.raises(ValueError):
+            audio.WaveSource(path)
+
+
+class TestStreamSource:
+
+    def test_returns_samples_received_since_last_read(self):
+        read_end, write_end = os.pipe()
+        source = audio.StreamSource(os.fdopen(read_end, 'rb'), sample_rate=SAMPLE_RATE, chunk_size=64)
+
+        os.write(write_end, numpy.full(64, 16384, dtype='<i2').tobytes())
+        for _ in range(100):
+            if source._written >= 64:  # pylint: disable=protected-access
+                break
+            time.sleep(0.01)
+
+        samples = source.read(1024)
+        assert len(samples) == 64
+        assert numpy.allclose(samples, 0.5)
+        assert len(source.read(1024)) == 0
+
+        os.close(write_end)
+        source.close()
+
+    def test_close_does_not_wait_for_a_silent_writer(self):
+        read_end, write_end = os.pipe()
+        stream = os.fdopen(read_end, 'rb')
+        source = audio.StreamSource(stream, sample_rate=SAMPLE_RATE, chunk_size=64)
+        os.write(write_end, numpy.zeros(10, dtype='<i2').tobytes())
+
+        started = time.monotonic()
+        source.close()
+        assert time.monotonic() - started < 0.1
+
+        source._thread.join(1)  # pylint: disable=protected-access
+        assert stream.closed
+        os.close(write_end)
+
+    def test_samples_of_several_channels_are_mixed(self):
+        read_end, write_end = os.pipe()
+        source = audio.StreamSource(os.fdopen(read_end, 'rb'), sample_rate=SAMPLE_RATE, channels=2, chunk_size=64)
+
+        os.write(write_end, numpy.tile(numpy.array([16384, 0], dtype='<i2'), 64).tobytes())
+        for _ in range(100):
+            if source._written >= 64:  # pylint: disable=protected-access
+                break
+            time.sleep(0.01)
+
+        assert numpy.allclose(source.read(1024), 0.25)
+        os.close(write_end)
+        source.close()
+
+
+class TestOpenSource:
+
+    def test_pipe_is_opened_without_waiting_for_its_writer(self, tmp_path):
+        path = str(tmp_path / 'input')
+        os.mkfifo(path)
+
+        started = time.monotonic()
+        source = audio.open_source(path)
+        assert time.monotonic() - started < 0.5
+
+        with open(path, 'wb') as writer:
+            writer.write(numpy.full(512, 16384, dtype='<i2').tobytes())
+        for _ in range(100):
+            if source._written >= 512:  # pylint: disable=protected-access
+                break
+            time.sleep(0.01)
+
+        assert numpy.allclose(source.read(1024), 0.5)
+        source.close()
+
+    @pytest.mark.parametrize('source', ['/etc/passwd', '-', '../outside.wav'])
+    def test_only_configured_sources_are_opened(self, source):
+        with pytest.raises(ValueError, match='audio_sources'):
+            audio.open_source(source)
+
+    def test_stdin_can_be_allowed(self, allowed_sources):
+        allowed_sources.append('-')
+
+        audio.check_source('-')
+
+    def test_wav_source_has_to_be_a_file(self, tmp_path):
+        path = str(tmp_path / 'input.wav')
+        os.mkfifo(path)
+
+        with pytest.raises(ValueError, match='wav file'):
+            audio.open_source(path)
+
+
+class TestSpectrumAnalyzer:
+
+    @pytest.mark.parametrize('frequency', [200, 1000, 5000])
+    def test_tone_has_the_highest_level_in_its_band(self, frequency):
+        analyzer = audio.SpectrumAnalyzer(SAMPLE_RATE, bands=8)
+        analyzer.push(get_tone(frequency, 0.1)[-1024:] / 32768)
+
+        levels = analyzer.analyze()
+
+        edges = numpy.geomspace(40, SAMPLE_RATE / 2, 9)
+        assert numpy.argmax(levels) == numpy.searchsorted(edges, frequency) - 1
+        assert levels.max() == 1
+
+    def test_silence_has_no_levels(self):
+        analyzer = audio.SpectrumAnalyzer(SAMPLE_RATE, bands=8)
+        analyzer.push(get_tone(1000, 0.1)[-1024:] / 32768)
+        analyzer.analyze()
+
+        analyzer.push(numpy.zeros(1024, dtype=numpy.float32))
+        assert analyzer.analyze().max() == 0
+
+
+class TestAudioSpectrum:
+
+    def test_bars_grow_from_the_last_row(self, tmp_path):
+        geometry = get_geometry()
+        effect = audio.AudioSpectrum(geometry, PALETTE, fps=20,
+                                     source=write_wave(tmp_path / 'tone.wav', get_tone(1000)))
+
+        for _ in range(10):
+            frame = effect.next_frame()
+        blocks = geometry.block_means(frame).sum(axis=1)
+
+        column = numpy.argmax(blocks[geometry.block_rows == 3])
+        assert blocks[geometry.block_id(3, int(column))] > 0
+        assert blocks[geometry.block_id(0, int(column))] <= blocks[geometry.block_id(3, int(column))]
+        effect.close()
+
+    def test_bar_colors_follow_the_palette(self, tmp_path):
+        geometry = get_geometry()
+        effect = audio.AudioSpectrum(geometry, PALETTE, fps=20,
+                                     source=write_wave(tmp_path / 'tone.wav', get_tone(1000)))
+
+        for _ in range(10):
+            frame = effect.next_frame()
+        lit = geometry.block_means(frame)[geometry.block_rows == 3]
+
+        assert lit[:, 0].max() == 0  # the bottom row has the first palette color
+        effect.close()
+
+    def test_reads_one_frame_of_samples(self, tmp_path):
+        effect = audio.AudioSpectrum(get_geometry(), PALETTE, fps=20,
+                                     source=write_wave(tmp_path / 'tone.wav', get_tone(1000)))
+        assert effect.samples_per_frame == SAMPLE_RATE // 20
+        effect.close()
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import clock
+
+
+def run(coroutine):
+    loop = clock.VirtualClock().new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestVirtualClock:
+
+    def test_sleep_advances_virtual_time_only(self):
+        async def sleep_an_hour():
+            started = asyncio.get_running_loop().time()
+            await asyncio.sleep(3600)
+            return asyncio.get_running_loop().time() - started
+
+        started = time.perf_counter()
+        assert run(sleep_an_hour()) == 3600
+        assert time.perf_counter() - started < 1
+
+    def test_sleeping_tasks_wake_up_in_order(self):
+        woken = []
+
+        async def sleeper(name: str, delay: float, count: int):
+            for _ in range(count):
+                await asyncio.sleep(delay)
+                woken.append((asyncio.get_running_loop().time(), name))
+
+        async def main():
+            await asyncio.gather(sleeper('slow', 1.0, 2), sleeper('fast', 0.3, 4))
+
+        run(main())
+
+        assert [name for _, name in woken] == ['fast', 'fast', 'fast', 'slow', 'fast', 'slow']
+        assert woken == sorted(woken)
+
+    def test_threads_are_awaited_in_real_time(self):
+        async def main():
+            return await asyncio.to_thread(lambda: time.sleep(0.05) or 'done')
+
+        assert run(main()) == 'done'
+
+    def test_use_replaces_current_clock_temporarily(self):
+        previous = clock.current
+        virtual = clock.VirtualClock(start=10)
+
+        with clock.use(virtual):
+            assert clock.current.time() == 10
+
+        assert clock.current is previous
@@ -0,0 +1,81 @@
+import numpy
+import pytest
+
+import compositing
+import effects
+
+
+class FixedEffect(effects.Effect):
+
+    def __init__(self, geometry: effects.Geometry, color: tuple[int, int, int]):
+        super().__init__(geometry, numpy.array([color]), seed=0)
+
+    def render(self, time: float) -> numpy.ndarray:
+        return self.geometry.expand(numpy.tile(self.palette, (self.geometry.block_count, 1)))
+
+
+def get_geometry() -> effects.Geometry:
+    return effects.Geometry([[(0, 2), (2, 4)], [(4, 6), (6, 8)]])
+
+
+def get_base(color: tuple[int, int, int]) -> numpy.ndarray:
+    return numpy.tile(numpy.array(color, dtype=numpy.float32), (8, 1))
+
+
+class TestLayerStack:
+
+    def test_without_layers_returns_base(self):
+        stack = compositing.LayerStack()
+        base = get_base((10, 20, 30))
+
+        assert numpy.array_equal(stack.composite(base), base)
+
+    @pytest.mark.parametrize("blend_mode, base, layer, result", [
+        (compositing.BlendMode.ADD, (100, 200, 0), (100, 100, 50), (200, 255, 50)),
+        (compositing.BlendMode.MULTIPLY, (100, 200, 0), (255, 0, 255), (100, 0, 0)),
+        (compositing.BlendMode.MAX, (100, 200, 0), (150, 100, 50), (150, 200, 50)),
+        (compositing.BlendMode.ALPHA, (100, 200, 0), (150, 100, 50), (150, 100, 50)),
+    ])
+    def test_blend_modes_with_full_opacity(self, blend_mode, base, layer, result):
+        stack = compositing.LayerStack()
+        stack.add(compositing.Layer(FixedEffect(get_geometry(), layer), blend_mode=blend_mode))
+
+        frame = stack.composite(get_base(base))
+
+        assert numpy.allclose(frame, get_base(result))
+
+    def test_opacity_weights_layer(self):
+        stack = compositing.LayerStack()
+        stack.add(compositing.Layer(FixedEffect(get_geometry(), (200, 0, 0)), opacity=0.25))
+
+        frame = stack.composite(get_base((0, 0, 100)))
+
+        assert numpy.allclose(frame, get_base((50, 0, 75)))
+
+    def test_mask_limits_layer_to_region(self):
+        geometry = get_geometry()
+        stack = compositing.LayerStack()
+        stack.add(compositing.Layer(FixedEffect(geometry, (255, 0, 0)), mask=geometry.mask(rows=(0, 0))))
+
+        frame = stack.composite(get_base((0, 0, 0)))
+
+        assert (frame[:4, 0] == 255).all()
+        assert (frame[4:] == 0).all()
+
+    def test_layers_are_applied_in_order(self):
+        stack = compositing.LayerStack()
+        stack.add(compositing.Layer(FixedEffect(get_geometry(), (255, 0, 0))))
+        stack.add(compositing.Layer(FixedEffect(get_geometry(), (0, 255, 0))))
+
+        frame = stack.composite(get_base((0, 0, 0)))
+
+        assert numpy.allclose(frame, get_base((0, 255, 0)))
+
+    def test_does_not_modify_base(self):
+        stack = compositing.LayerStack()
+        stack.add(compositing.Layer(FixedEffect(get_geometry(), (255, 0, 0)), blend_mode=compositing.BlendMode.ADD))
+        base = get_base((10, 10, 10))
+
+        stack.composite(base)
+
+        assert numpy.array_equal(base, get_base((10, 10, 10)))
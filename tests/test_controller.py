@@ -1,3 +1,25 @@
+import asyncio
+import json
+import marshal
+import os
+
+import fastapi.testclient
+import pytest
+
+import clock
+import controller
+import expressions
+import led_block
+import profiler
+import strip
+import sync
+
+
+def test_get_layout_aliases_returns_aliased_blocks(client):
+    aliases = client.get('/layout/aliases/').json()['default']
+    assert ['default[0][0] (228, 220)', *(f'default[{row}][0] (228, 220)' for row in range(1, 7))] in aliases
+
+
 def test_show_main_page_returns_200(client):
     response = client.get('/')
     assert response.status_code == 200
@@ -11,3 +33,400 @@ def test_show_status_page_returns_200( client):
 def test_test_returns_200(client):
     response = client.get('/test/')
     assert response.status_code == 200
+
+
+def test_calibrate_returns_calibration_report(client):
+    response = client.get('/calibrate/?samples=2&hold=0')
+
+    assert response.status_code == 200
+    assert response.json()['default']['count'] == 571
+    assert response.json()['default']['max_fps'] > 0
+
+
+def test_set_brightness_dims_all_strips(client, monkeypatch):
+    monkeypatch.setattr(strip, 'global_brightness', 1.0)
+
+    response = client.post('/brightness/?value=0.25')
+
+    assert response.json() == {'brightness': 0.25}
+    assert strip.global_brightness == 0.25
+
+
+def test_set_brightness_rejects_values_above_1(client):
+    response = client.post('/brightness/?value=2')
+    assert response.status_code == 422
+
+
+def test_get_power_metrics_returns_strips_and_power_supplies(config_file, client):
+    config, write_config = config_file
+    config['power_supplies'] = [{'name': 'main', 'max_milliamps': 10000}]
+    config['strips'][0]['power_supply'] = 'main'
+    write_config(config)
+    client.post('/config/reload/')
+
+    response = client.get('/metrics/power/')
+
+    assert response.status_code == 200
+    assert response.json()['strips']['default']['power_supply'] == 'main'
+    assert response.json()['power_supplies']['main']['max_milliamps'] == 10000
+
+
+@pytest.fixture
+def endless_profiling(monkeypatch):
+    # idle virtual time passes instantly, the sessions of these tests have to be stopped explicitly
+    async def wait_forever(_):
+        await asyncio.Future()
+
+    monkeypatch.setattr(profiler.Session, '_stop_after_duration', wait_forever)
+
+
+@pytest.fixture
+def profiling(config_file, client):
+    config, write_config = config_file
+    config['profiling'] = True
+    write_config(config)
+    client.post('/config/reload/')
+    yield config, write_config
+
+
+class TestProfiling:
+
+    def test_profiling_is_disabled_by_default(self, client):
+        assert client.post('/profiling/?target=output').status_code == 403
+        assert client.get('/profiling/').status_code == 403
+        assert client.get('/profiling/result/').status_code == 403
+
+    def test_disabling_profiling_stops_the_session(self, client, profiling, endless_profiling):
+        config, write_config = profiling
+        client.post('/profiling/?target=output&duration=60')
+
+        config['profiling'] = False
+        write_config(config)
+        client.post('/config/reload/')
+
+        assert not profiler.session.is_running
+        assert client.delete('/profiling/').status_code == 403
+
+    def test_cprofile_of_matrix_profiles_rendered_frames(self, client, profiling):
+        client.post('/block/default/?program=twinkle&seed=1')
+        client.portal.call(clock.current.sleep, 1.2)  # switching on the strip
+
+        response = client.post('/profiling/?target=matrix&block_id=default&mode=cprofile&duration=1')
+        assert response.json()['running']
+        client.portal.call(clock.current.sleep, 1.2)
+
+        status = client.get('/profiling/').json()
+        assert not status['running']
+        assert status['calls'] > 0
+        assert led_block.LedMatrix._render_frame.__name__ == '_render_frame'
+
+        response = client.get('/profiling/result/')
+        assert response.headers['Content-Disposition'] == 'attachment; filename="profile-matrix-default.pstats"'
+        assert any(function == 'render' for _, _, function in marshal.loads(response.content))
+
+    def test_profiling_http_handlers_can_be_stopped_early(self, client, profiling, endless_profiling):
+        client.post('/profiling/?target=http&mode=cprofile&duration=60')
+        client.get('/block/default/colors/')
+
+        assert client.get('/profiling/result/').status_code == 409
+        response = client.delete('/profiling/')
+
+        assert not response.json()['running']
+        assert response.json()['calls'] == 1
+        assert any(function == 'get_act_colors' for _, _, function in
+                   marshal.loads(client.get('/profiling/result/').content))
+
+    def test_second_session_returns_409(self, client, profiling, endless_profiling):
+        client.post('/profiling/?target=output&duration=60')
+
+        assert client.post('/profiling/?target=output').status_code == 409
+        client.delete('/profiling/')
+
+    def test_unknown_matrix_returns_404(self, client, profiling):
+        response = client.post('/profiling/?target=matrix&block_id=unknown')
+        assert response.status_code == 404
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    with open(os.path.join('config', 'default.config.json'), 'r', encoding='utf-8') as data:
+        config = json.load(data)
+
+    path = tmp_path / 'test.config.json'
+
+    def write_config(new_config: dict):
+        path.write_text(json.dumps(new_config), encoding='utf-8')
+
+    write_config(config)
+    monkeypatch.setattr(controller.DataInitialize, 'config_file', str(path))
+    yield config, write_config
+
+
+class TestReloadConfig:
+
+    def test_unchanged_config_keeps_matrices(self, config_file, client):
+        matrix = led_block.known_blocks['default']
+
+        response = client.post('/config/reload/')
+
+        assert response.status_code == 200
+        assert response.json()['blocks']['updated'] == ['default']
+        assert led_block.known_blocks['default'] is matrix
+
+    def test_changed_settings_keep_running_program(self, config_file, client):
+        config, write_config = config_file
+        client.post('/block/default/?program=twinkle&seed=3')
+        client.portal.call(clock.current.sleep, 1.2)  # switching on the strip
+        matrix = led_block.known_blocks['default']
+        running_task = matrix._act_task
+
+        config['blocks'][0]['fps'] = 10
+        write_config(config)
+        client.post('/config/reload/')
+
+        assert led_block.known_blocks['default'] is matrix
+        assert matrix.fps == 10
+        assert matrix._act_task is running_task
+
+    def test_changed_geometry_rebuilds_matrix_and_restarts_program(self, config_file, client):
+        config, write_config = config_file
+        client.post('/block/default/?program=twinkle&seed=3')
+        client.portal.call(clock.current.sleep, 1.2)  # switching on the strip
+        matrix = led_block.known_blocks['default']
+
+        config['blocks'][0]['blocks'][9][0] = [0, 10]
+        write_config(config)
+        response = client.post('/config/reload/')
+        client.portal.call(clock.current.sleep, 0.2)
+
+        assert response.json()['blocks']['rebuilt'] == ['default']
+        new_matrix = led_block.known_blocks['default']
+        assert new_matrix is not matrix
+        assert new_matrix.blocks[9][0].start == 0
+        assert new_matrix.effect_seed == 3
+        assert not matrix.is_rendering
+
+    def test_changed_regions_are_rebuilt(self, config_file, client):
+        config, write_config = config_file
+        config['blocks'][0]['regions'] = [{'name': 'top', 'rows': [0, 6]}, {'name': 'left', 'cols': [0, 1]}]
+        write_config(config)
+
+        response = client.post('/config/reload/')
+
+        assert response.status_code == 200
+        assert 'default.left' in led_block.known_blocks
+        assert 'default.bottom' not in led_block.known_blocks
+
+    def test_reload_renders_pages_again(self, config_file, client):
+        config, write_config = config_file
+        assert b'href="/block/default.middle/"' not in client.get('/block/default/').content
+
+        config['blocks'][0]['regions'].append({'name': 'middle', 'rows': [7, 7]})
+        write_config(config)
+        client.post('/config/reload/')
+
+        assert b'href="/block/default.middle/"' in client.get('/block/default/').content
+
+    def test_removed_matrix_is_unknown(self, config_file, client):
+        config, write_config = config_file
+        config['blocks'].append({**config['blocks'][0], 'name': 'second', 'regions': []})
+        write_config(config)
+        client.post('/config/reload/')
+        assert 'second' in led_block.known_blocks
+
+        config['blocks'].pop()
+        write_config(config)
+        response = client.post('/config/reload/')
+
+        assert response.json()['blocks']['removed'] == ['second']
+        assert 'second' not in led_block.known_blocks
+
+    def test_overlapping_blocks_return_400(self, config_file, client):
+        config, write_config = config_file
+        config['blocks'][0]['blocks'][0][0] = [229, 220]
+        write_config(config)
+
+        response = client.post('/config/reload/')
+
+        assert response.status_code == 400
+        assert 'default[0][0] (229, 220)' in response.json()['detail']
+
+    def test_invalid_config_returns_400_and_keeps_layout(self, config_file, client):
+        config, write_config = config_file
+        matrix = led_block.known_blocks['default']
+        config['blocks'][0]['regions'] = [{'name': 'nothing', 'rows': [20, 30]}]
+        write_config(config)
+
+        response = client.post('/config/reload/')
+
+        assert response.status_code == 400
+        assert led_block.known_blocks['default'] is matrix
+
+
+class TestExpressions:
+
+    def test_get_expressions_returns_configured_expressions(self, config_file, client):
+        response = client.get('/expressions/')
+        assert response.json()['rainbow'] == 'hue = (x + y) / 10 + t * 0.2'
+
+    def test_store_expression_writes_expressions_file(self, config_file, expressions_file, client):
+        with open(controller.DataInitialize.config_file, 'rb') as data:
+            config_content = data.read()
+
+        response = client.put('/expressions/stripes/', params={'expression': 'hue = fract(y / 2)'})
+
+        assert response.status_code == 200
+        assert expressions.library['stripes'] == 'hue = fract(y / 2)'
+        with open(expressions_file, 'r', encoding='utf-8') as data:
+            assert json.load(data) == {'stripes': 'hue = fract(y / 2)'}
+        with open(controller.DataInitialize.config_file, 'rb') as data:
+            assert data.read() == config_content
+
+        response = client.post('/block/default/?program=expression&expression=stripes')
+        assert response.status_code == 302
+
+    def test_stored_expressions_are_kept_after_restart_and_reload(self, config_file, client):
+        client.put('/expressions/stripes/', params={'expression': 'hue = fract(y / 2)'})
+
+        with fastapi.testclient.TestClient(controller.app) as restarted:
+            assert restarted.get('/expressions/').json()['stripes'] == 'hue = fract(y / 2)'
+            restarted.post('/config/reload/')
+            assert restarted.get('/expressions/').json()['stripes'] == 'hue = fract(y / 2)'
+            assert restarted.get('/expressions/').json()['rainbow'] == 'hue = (x + y) / 10 + t * 0.2'
+
+    @pytest.mark.parametrize("expression", (
+        'hue = x.real', 'hue = sin()', 'hue = where(x)', 'hue = ' + '-' * 1500 + 'x',
+    ))
+    def test_store_invalid_expression_returns_400(self, config_file, client, expression):
+        response = client.put('/expressions/broken/', params={'expression': expression})
+
+        assert response.status_code == 400
+        assert 'broken' not in expressions.library
+
+    def test_remove_expression_writes_expressions_file(self, config_file, expressions_file, client):
+        client.put('/expressions/stripes/', params={'expression': 'hue = fract(y / 2)'})
+
+        response = client.delete('/expressions/stripes/')
+
+        assert response.status_code == 200
+        assert 'stripes' not in response.json()
+        with open(expressions_file, 'r', encoding='utf-8') as data:
+            assert json.load(data) == {}
+
+    def test_remove_expression_of_config_returns_400(self, config_file, client):
+        response = client.delete('/expressions/rainbow/')
+
+        assert response.status_code == 400
+        assert 'rainbow' in expressions.library
+
+    def test_remove_unknown_expression_returns_404(self, config_file, client):
+        response = client.delete('/expressions/unknown/')
+        assert response.status_code == 404
+
+
+class TestSync:
+
+    def test_leader_config_starts_sync(self, config_file):
+        config, write_config = config_file
+        write_config({**config, 'sync': {'role': 'leader', 'port': 0}})
+
+        with fastapi.testclient.TestClient(controller.app) as client:
+            assert client.get('/metrics/sync/').json()['role'] == 'leader'
+
+        assert sync.node.role is None
+
+    def test_follower_shows_programs_of_leader(self, config_file, client):
+        config, write_config = config_file
+        started = client.portal.call(clock.current.wall_time) - 2
+        states = {'default': {'program': {'program': 'twinkle', 'colors': [], 'seed': 3, 'source': None,
+                                          'expression': None, 'started': started}, 'layers': []}}
+        leader = sync.SyncNode()
+        client.portal.call(leader.start, sync.SyncSettings(role='leader', port=0), lambda: states, None)
+        try:
+            write_config({**config, 'sync': {'role': 'follower', 'port': leader.port}})
+            client.post('/config/reload/')
+            client.portal.call(clock.current.sleep, 1.5)  # switching on the strip
+
+            matrix = led_block.known_blocks['default']
+            effect = matrix._effect
+            assert matrix.state == states['default']
+            assert client.get('/metrics/sync/').json()['synchronized']
+
+            # unchanged programs keep running
+            client.portal.call(clock.current.sleep, 1.5)
+            assert matrix._effect is effect
+
+            states['default'] = {'program': None, 'layers': [
+                {'program': 'sparkle', 'colors': [], 'seed': 5, 'blend_mode': 'max', 'opacity': 1.0, 'rows': None,
+                 'cols': None, 'source': None, 'expression': None, 'started': started}]}
+            client.portal.call(clock.current.sleep, 2.5)  # stopped first, the layers follow with the next state
+            assert matrix.state == states['default']
+
+            # a block with neither program nor layers on the leader is not in its state
+            del states['default']
+            client.portal.call(clock.current.sleep, 1.5)
+            assert matrix.layers == []
+        finally:
+            client.portal.call(leader.stop)
+
+
+class TestResumeState:
+
+    def test_restart_resumes_program_at_its_phase(self):
+        with fastapi.testclient.TestClient(controller.app) as client:
+            client.post('/block/default/?program=twinkle&seed=3')
+            client.portal.call(clock.current.sleep, 2)
+            started = clock.current.wall_time() - led_block.known_blocks['default']._effect.time
+
+        with fastapi.testclient.TestClient(controller.app) as client:
+            client.portal.call(clock.current.sleep, 1.2)  # switching on the strip
+
+            matrix = led_block.known_blocks['default']
+            assert matrix.effect_seed == 3
+            assert clock.current.wall_time() - matrix._effect.time == pytest.approx(started, abs=0.1)
+
+    def test_restart_resumes_chosen_colors_and_layers(self):
+        with fastapi.testclient.TestClient(controller.app) as client:
+            client.post('/block/default/?program=fixed')
+            client.post('/block/default/layers/?program=sparkle&seed=5&blend_mode=max&first_row=7')
+            client.portal.call(clock.current.sleep, 1.2)
+            color = led_block.known_blocks['default'].program_settings['colors'][0]
+
+        with fastapi.testclient.TestClient(controller.app) as client:
+            client.portal.call(clock.current.sleep, 1.2)
+
+            matrix = led_block.known_blocks['default']
+            assert matrix.program_settings['colors'] == [color]
+            assert matrix.layers == [{'effect': 'Sparkle', 'blend_mode': 'max', 'opacity': 1.0, 'masked': True,
+                                      'seed': 5}]
+
+    @pytest.mark.parametrize("path", ('/block/default/layers/', '/block/default/layers/0/'))
+    def test_removed_layers_stay_removed_after_restart(self, state_file, path):
+        with fastapi.testclient.TestClient(controller.app) as client:
+            client.post('/block/default/?program=fixed')
+            client.post('/block/default/layers/?program=sparkle')
+            client.portal.call(clock.current.sleep, 1.2)  # no write is pending when the layers are removed
+
+            response = client.delete(path)
+            assert response.status_code == 200
+            assert response.json() == []
+            client.portal.call(clock.current.sleep, 1.2)
+
+        with open(state_file, 'r', encoding='utf-8') as data:
+            assert json.load(data)['default']['layers'] == []
+
+        with fastapi.testclient.TestClient(controller.app):
+            assert led_block.known_blocks['default'].layers == []
+
+    def test_stopped_matrix_stays_dark_after_restart(self, state_file):
+        with fastapi.testclient.TestClient(controller.app) as client:
+            client.post('/block/default/?program=twinkle')
+            client.portal.call(clock.current.sleep, 1.2)
+            client.post('/block/default/?program=stop')
+            client.portal.call(clock.current.sleep, 1.2)
+
+        with open(state_file, 'r', encoding='utf-8') as data:
+            assert 'default' not in json.load(data)
+
+        with fastapi.testclient.TestClient(controller.app):
+            assert led_block.known_blocks['default'].program_settings is None
@@ -0,0 +1,84 @@
+import numpy
+import pytest
+
+import effects
+
+
+def get_geometry() -> effects.Geometry:
+    return effects.Geometry([
+        [(0, 4), (8, 4), (8, 12)],
+        [(12, 16), (20, 16), (20, 24)],
+    ])
+
+
+PALETTE = numpy.array([[255, 0, 0], [0, 0, 255]], dtype=numpy.float32)
+
+
+class TestGeometry:
+
+    def test_counts_blocks_and_leds(self):
+        geometry = get_geometry()
+        assert geometry.block_count == 6
+        assert geometry.led_count == 24
+
+    def test_inverted_block_is_indexed_from_start_to_end(self):
+        geometry = get_geometry()
+        assert geometry.led_index[4:8].tolist() == [7, 6, 5, 4]
+
+    def test_expand_repeats_block_colors_for_leds(self):
+        geometry = get_geometry()
+        block_colors = numpy.arange(18, dtype=numpy.float32).reshape(6, 3)
+
+        frame = geometry.expand(block_colors)
+
+        assert frame.shape == (24, 3)
+        assert (frame[4:8] == block_colors[1]).all()
+
+    def test_block_means_is_inverse_of_expand(self):
+        geometry = get_geometry()
+        block_colors = numpy.arange(18, dtype=numpy.float32).reshape(6, 3)
+
+        assert numpy.allclose(geometry.block_means(geometry.expand(block_colors)), block_colors)
+
+
+class TestEffect:
+
+    def test_effect_without_render_cannot_be_created(self):
+        class Incomplete(effects.Effect):  # pylint: disable=abstract-method
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete(get_geometry(), PALETTE, seed=1)
+
+
+@pytest.mark.parametrize("effect_class", (effects.Twinkle, effects.Sparkle, effects.RandomDecay))
+class TestRandomEffects:
+
+    def test_frame_has_color_for_every_led(self, effect_class):
+        effect = effect_class(get_geometry(), PALETTE, seed=1)
+        assert effect.next_frame().shape == (24, 3)
+
+    def test_is_reproducible_by_seed(self, effect_class):
+        first = effect_class(get_geometry(), PALETTE, seed=42)
+        second = effect_class(get_geometry(), PALETTE, seed=42)
+
+        for _ in range(50):
+            assert numpy.array_equal(first.next_frame(), second.next_frame())
+
+    def test_generates_seed_if_not_provided(self, effect_class):
+        effect = effect_class(get_geometry(), PALETTE)
+        assert isinstance(effect.seed, int)
+
+    def test_lights_up_leds_within_palette_range(self, effect_class):
+        effect = effect_class(get_geometry(), PALETTE, seed=3)
+        frames = numpy.stack([effect.next_frame() for _ in range(100)])
+
+        assert frames.max() > 0
+        assert frames.min() >= 0
+        assert frames.max() <= 255
+
+    def test_next_frame_with_steps_skips_frames(self, effect_class):
+        stepped = effect_class(get_geometry(), PALETTE, seed=5)
+        stepped.next_frame(3)
+
+        assert stepped.frame_number == 3
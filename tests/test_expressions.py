@@ -0,0 +1,124 @@
+import json
+
+import numpy
+import pytest
+
+import effects
+import expressions
+
+
+def get_geometry() -> effects.Geometry:
+    return effects.Geometry([
+        [(0, 4), (8, 4), (8, 12)],
+        [(12, 16), (20, 16), (20, 24)],
+    ])
+
+
+PALETTE = numpy.array([[255, 0, 0], [0, 0, 255]], dtype=numpy.float32)
+
+
+def create_effect(expression: str) -> expressions.ExpressionEffect:
+    return expressions.ExpressionEffect(get_geometry(), PALETTE, seed=1, expression=expression)
+
+
+class TestExpression:
+
+    def test_collects_outputs_and_used_names(self):
+        expression = expressions.Expression('a = x * 2; hue = a + t\nvalue = u')
+
+        assert expression.outputs == ['a', 'hue', 'value']
+        assert expression.uses_leds
+
+    def test_evaluates_whole_arrays(self):
+        expression = expressions.Expression('hue = (x + y) / 10 + t * 0.2')
+
+        outputs = expression.evaluate({'x': numpy.arange(3.0), 'y': numpy.ones(3), 't': 5.0})
+
+        assert numpy.allclose(outputs['hue'], [1.1, 1.2, 1.3])
+
+    @pytest.mark.parametrize("source", (
+        'hue = __import__("os")', 'hue = x.real', 'hue = [x]', 'hue = unknown', 'hue = 1 < x < 2',
+        'hue = sin(x=1)', 'import os', 'x = 1', 'sin = 1', '_a = 1; hue = _a', 'value = 1', 'hue = (',
+        'hue = sin()', 'hue = sin(x, x)', 'hue = where(x)', 'hue = clamp(x, 0, 1, 2)', 'hue = dist(1)',
+    ))
+    def test_invalid_expression_raises_error(self, source):
+        with pytest.raises(ValueError):
+            expressions.Expression(source)
+
+    def test_too_long_expression_raises_error(self):
+        with pytest.raises(ValueError):
+            expressions.Expression('hue = ' + '+'.join(['x'] * expressions.MAX_LENGTH))
+
+    def test_deeply_nested_expression_raises_error(self):
+        with pytest.raises(ValueError):
+            expressions.Expression('hue = ' + '-' * 1500 + 'x')
+
+    def test_overflow_gives_no_error(self):
+        outputs = expressions.Expression('hue = 9 ** 9 ** 9 + 1 / 0').evaluate({})
+        assert numpy.isinf(outputs['hue'])
+
+    def test_compiled_expressions_are_cached(self):
+        assert expressions.compile_expression('hue = x') is expressions.compile_expression('hue = x')
+
+
+class TestLoadLibrary:
+
+    def test_loads_valid_expressions(self, tmp_path):
+        path = tmp_path / 'expressions.json'
+        path.write_text(json.dumps({'stripes': 'hue = fract(y / 2)', 'broken': 'hue = x.real'}), encoding='utf-8')
+
+        assert expressions.load_library(str(path)) == {'stripes': 'hue = fract(y / 2)'}
+
+    def test_missing_file_gives_empty_library(self, tmp_path):
+        assert expressions.load_library(str(tmp_path / 'expressions.json')) == {}
+
+
+class TestExpressionEffect:
+
+    def test_hue_frame_has_color_for_every_led(self):
+        frame = create_effect('hue = 0').next_frame()
+
+        assert frame.shape == (24, 3)
+        assert numpy.allclose(frame, [255, 0, 0])
+
+    def test_rgb_channels_are_clipped(self):
+        frame = create_effect('red = 2; blue = -1').next_frame()
+        assert numpy.allclose(frame, [255, 0, 0])
+
+    def test_palette_position_interpolates_colors(self):
+        frame = create_effect('palette = 0.25').next_frame()
+        assert numpy.allclose(frame, [127.5, 0, 127.5])
+
+    def test_value_scales_colors(self):
+        frame = create_effect('hue = 0; value = x / 2').next_frame()
+        assert frame[[0, 4, 8], 0].tolist() == [0, 127.5, 255]
+
+    def test_dist_is_distance_of_blocks(self):
+        frame = create_effect('red = dist(0, 0) / 4').next_frame()
+        assert frame[[0, 12, 20], 0].tolist() == [0, 63.75, pytest.approx(255 * 5 ** 0.5 / 4)]
+
+    def test_block_expression_gives_one_color_per_block(self):
+        effect = create_effect('hue = x / cols + t')
+        frame = effect.next_frame()
+
+        assert not effect.expression.uses_leds
+        assert (frame[4:8] == frame[4]).all()
+
+    def test_led_expression_gives_color_per_led(self):
+        effect = create_effect('red = u')
+        frame = effect.next_frame()
+
+        assert effect.expression.uses_leds
+        assert frame[0:4, 0].tolist() == [0, 85, 170, 255]
+
+    def test_invalid_values_are_black(self):
+        frame = create_effect('red = sqrt(-1) + log(0) * 0').next_frame()
+        assert numpy.isfinite(frame).all()
+
+    def test_uses_expression_of_library(self, monkeypatch):
+        monkeypatch.setattr(expressions, 'library', {'red': 'red = 1'})
+        assert numpy.allclose(create_effect('red').next_frame(), [255, 0, 0])
+
+    def test_missing_expression_raises_error(self):
+        with pytest.raises(ValueError):
+            expressions.ExpressionEffect(get_geometry(), PALETTE)
@@ -0,0 +1,85 @@
+import numpy
+import pytest
+
+import keyframes
+
+RED = numpy.array([[200, 0, 0], [0, 0, 0]], dtype=numpy.float32)
+BLUE = numpy.array([[0, 0, 200], [0, 0, 0]], dtype=numpy.float32)
+
+
+class TestEasing:
+
+    @pytest.mark.parametrize("easing", list(keyframes.Easing))
+    def test_ends_at_the_next_keyframe(self, easing):
+        assert easing.apply(0.0) == 0.0
+        assert easing.apply(1.0) == 1.0
+
+    @pytest.mark.parametrize("easing, share", [
+        (keyframes.Easing.STEP, 0.0),
+        (keyframes.Easing.LINEAR, 0.25),
+        (keyframes.Easing.EASE_IN, 0.0625),
+        (keyframes.Easing.EASE_OUT, 0.4375),
+        (keyframes.Easing.EASE_IN_OUT, 0.15625),
+    ])
+    def test_share_of_the_next_keyframe(self, easing, share):
+        assert easing.apply(0.25) == pytest.approx(share)
+
+
+class TestKeyframeTrack:
+
+    @staticmethod
+    def get_track(easing: keyframes.Easing = keyframes.Easing.LINEAR) -> keyframes.KeyframeTrack:
+        track = keyframes.KeyframeTrack()
+        track.add(RED, 1.0)
+        track.add(BLUE, 1.5, easing)
+        return track
+
+    def test_blends_between_keyframes(self):
+        frame = self.get_track().sample(1.25)
+
+        assert numpy.allclose(frame, [[100, 0, 100], [0, 0, 0]])
+
+    def test_uses_the_easing_of_the_next_keyframe(self):
+        frame = self.get_track(keyframes.Easing.EASE_IN).sample(1.25)
+
+        assert numpy.allclose(frame, [[150, 0, 50], [0, 0, 0]])
+
+    def test_holds_first_and_last_keyframe(self):
+        track = self.get_track()
+
+        assert numpy.array_equal(track.sample(0.5), RED)
+        assert numpy.array_equal(track.sample(2.0), BLUE)
+
+    def test_forgets_keyframes_once_passed(self):
+        track = self.get_track()
+        track.add(RED, 2.0)
+
+        track.sample(1.75)
+
+        assert len(track) == 2
+        assert numpy.allclose(track.sample(1.0), BLUE)
+
+    def test_keyframe_replaces_later_ones(self):
+        track = self.get_track()
+
+        track.add(RED, 1.5)
+        track.add(RED, 1.2)
+
+        assert len(track) == 2
+        assert numpy.array_equal(track.sample(1.3), RED)
+
+    def test_keeps_a_copy_of_the_colors(self):
+        track = keyframes.KeyframeTrack()
+        colors = RED.copy()
+
+        track.add(colors, 1.0)
+        colors[:] = 0
+
+        assert numpy.array_equal(track.sample(1.0), RED)
+
+    def test_is_empty_after_clear(self):
+        track = self.get_track()
+
+        track.clear()
+
+        assert not track
@@ -0,0 +1,214 @@
+import json
+import os
+
+import pydantic
+import pytest
+
+import layout
+
+
+def get_config() -> dict:
+    return {
+        'strips': [{'identifier': 'default', 'count': 20}],
+        'blocks': [{'name': 'layout', 'blocks': [[[0, 5], [10, 5]], [[10, 15], [15, 20]]],
+                    'regions': [{'name': 'top', 'rows': [0, 0]}]}],
+    }
+
+
+@pytest.fixture
+def config_path(tmp_path) -> str:
+    path = tmp_path / 'test.config.json'
+    path.write_text(json.dumps(get_config()), encoding='utf-8')
+    return str(path)
+
+
+class TestCompileLayout:
+
+    def test_fills_defaults(self):
+        compiled = layout.compile_layout(get_config())
+
+        assert compiled.strips[0]['gpio'] == 'board.D13'
+        assert compiled.blocks[0]['strip_name'] == 'default'
+
+    def test_precomputes_geometries(self):
+        compiled = layout.compile_layout(get_config())
+        assert compiled.geometries['layout'].led_count == 20
+
+    def test_invalid_strip_raises_error(self):
+        config = get_config()
+        config['strips'][0]['gpio'] = 'board.D99'
+
+        with pytest.raises(pydantic.ValidationError):
+            layout.compile_layout(config)
+
+    def test_empty_region_raises_error(self):
+        config = get_config()
+        config['blocks'][0]['regions'][0]['rows'] = [4, 5]
+
+        with pytest.raises(ValueError):
+            layout.compile_layout(config)
+
+    def test_unknown_power_supply_raises_error(self):
+        config = get_config()
+        config['strips'][0]['power_supply'] = 'missing'
+
+        with pytest.raises(ValueError):
+            layout.compile_layout(config)
+
+    def test_invalid_expression_raises_error(self):
+        config = get_config()
+        config['expressions'] = {'broken': 'hue = open(x)'}
+
+        with pytest.raises(ValueError, match='broken'):
+            layout.compile_layout(config)
+
+    def test_keeps_render_workers(self):
+        config = get_config()
+        config['render_workers'] = 0
+
+        assert layout.compile_layout(config).render_workers == 0
+        assert layout.compile_layout(get_config()).render_workers is None
+
+    def test_invalid_render_workers_raises_error(self):
+        config = get_config()
+        config['render_workers'] = -1
+
+        with pytest.raises(ValueError, match='render_workers'):
+            layout.compile_layout(config)
+
+    def test_keeps_audio_sources(self):
+        config = get_config()
+        config['audio_sources'] = ['-', 'audio']
+
+        assert layout.compile_layout(config).audio_sources == ['-', 'audio']
+        assert layout.compile_layout(get_config()).audio_sources == []
+
+    def test_invalid_audio_sources_raises_error(self):
+        config = get_config()
+        config['audio_sources'] = 'audio'
+
+        with pytest.raises(ValueError, match='audio_sources'):
+            layout.compile_layout(config)
+
+    def test_profiling_is_off_unless_enabled(self):
+        config = get_config()
+        config['profiling'] = True
+
+        assert layout.compile_layout(config).profiling
+        assert not layout.compile_layout(get_config()).profiling
+
+    def test_invalid_profiling_raises_error(self):
+        config = get_config()
+        config['profiling'] = 'yes'
+
+        with pytest.raises(ValueError, match='profiling'):
+            layout.compile_layout(config)
+
+    def test_keeps_sync_settings(self):
+        config = get_config()
+        config['sync'] = {'role': 'follower', 'leader': '10.0.0.2'}
+
+        settings = layout.compile_layout(config).sync
+        assert (settings.role.value, settings.leader, settings.port) == ('follower', '10.0.0.2', 5810)
+        assert layout.compile_layout(get_config()).sync is None
+
+    def test_unknown_sync_role_raises_error(self):
+        config = get_config()
+        config['sync'] = {'role': 'boss'}
+
+        with pytest.raises(ValueError):
+            layout.compile_layout(config)
+
+    def test_block_beyond_strip_raises_error(self):
+        config = get_config()
+        config['blocks'][0]['blocks'][1][1] = [15, 21]
+
+        with pytest.raises(ValueError, match=r'layout\[1\]\[1\] \(15, 21\)'):
+            layout.compile_layout(config)
+
+    def test_partially_overlapping_blocks_raise_error(self):
+        config = get_config()
+        config['blocks'].append({'name': 'second', 'blocks': [[[3, 8]]]})
+
+        with pytest.raises(ValueError, match=r'layout\[0\]\[0\] \(0, 5\) and second\[0\]\[0\] \(3, 8\)'):
+            layout.compile_layout(config)
+
+    def test_keeps_aliases_of_blocks(self):
+        config = get_config()
+        config['blocks'].append({'name': 'second', 'blocks': [[[5, 10]]]})
+
+        compiled = layout.compile_layout(config)
+
+        assert compiled.aliases == {'default': [['layout[0][1] (10, 5)', 'second[0][0] (5, 10)']]}
+        assert compiled.geometries['second'].write_positions is None
+
+    def test_aliases_of_one_matrix_write_last_block(self):
+        config = get_config()
+        config['blocks'][0]['blocks'][1][0] = [0, 5]
+
+        geometry = layout.compile_layout(config).geometries['layout']
+
+        assert geometry.write_positions.tolist() == list(range(5, 20))
+        assert geometry.write_index[:5].tolist() == [9, 8, 7, 6, 5]
+
+    def test_blocks_of_other_strips_do_not_collide(self):
+        config = get_config()
+        config['strips'].append({'identifier': 'second', 'count': 10, 'gpio': 'board.D12'})
+        config['blocks'].append({'name': 'second', 'strip_name': 'second', 'blocks': [[[3, 8]]]})
+
+        assert layout.compile_layout(config).aliases == {}
+
+    def test_keeps_power_supplies(self):
+        config = get_config()
+        config['power_supplies'] = [{'name': 'main', 'max_milliamps': 5000}]
+        config['strips'][0]['power_supply'] = 'main'
+
+        assert layout.compile_layout(config).power_supplies == [{'name': 'main', 'max_milliamps': 5000}]
+
+    def test_missing_strips_raises_error(self):
+        with pytest.raises(ValueError):
+            layout.compile_layout({'blocks': []})
+
+
+class TestIntervalIndex:
+
+    def test_contained_block_overlaps(self):
+        index = layout.IntervalIndex(100, {'outer': [[[0, 50]]], 'inner': [[[10, 20]]]})
+        assert index.overlaps == [('outer[0][0] (0, 50)', 'inner[0][0] (10, 20)')]
+
+    def test_inverted_block_is_alias(self):
+        index = layout.IntervalIndex(100, {'matrix': [[[0, 10], [10, 0]]]})
+
+        assert index.aliases == [['matrix[0][0] (0, 10)', 'matrix[0][1] (10, 0)']]
+        assert index.shadowed == {'matrix': [0]}
+
+    def test_adjacent_and_empty_blocks_do_not_collide(self):
+        index = layout.IntervalIndex(100, {'matrix': [[[0, 10], [10, 20], [5, 5]]]})
+        assert not index.overlaps and not index.aliases and not index.out_of_range
+
+
+class TestLoad:
+
+    def test_stores_snapshot(self, config_path):
+        layout.load(config_path)
+
+        with open(config_path, 'rb') as data:
+            assert os.path.exists(layout.get_snapshot_path(config_path, data.read()))
+
+    def test_uses_snapshot_if_config_is_unchanged(self, config_path, monkeypatch):
+        layout.load(config_path)
+        monkeypatch.setattr(layout, 'compile_layout', lambda *_: pytest.fail('layout compiled again'))
+
+        assert layout.load(config_path).geometries['layout'].block_count == 4
+
+    def test_compiles_changed_config_and_removes_old_snapshot(self, config_path):
+        layout.load(config_path)
+        config = get_config()
+        config['blocks'][0]['name'] = 'changed'
+        with open(config_path, 'w', encoding='utf-8') as data:
+            json.dump(config, data)
+
+        compiled = layout.load(config_path)
+
+        assert 'changed' in compiled.geometries
+        assert len(os.listdir(os.path.join(os.path.dirname(config_path), '.cache'))) == 1
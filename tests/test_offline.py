@@ -0,0 +1,117 @@
+import os
+import struct
+import zlib
+
+import numpy
+import pytest
+
+import effects
+import layout
+import led_block
+import offline
+
+CONFIG_PATH = os.path.join('config', 'default.config.json')
+
+
+@pytest.fixture(scope='module')
+def recording() -> offline.Recording:
+    return offline.render(CONFIG_PATH, 'default', led_block.BlockProgram.TWINKLE, duration=2, fps=20, seed=3)
+
+
+def decode_lzw(data: bytes, code_size: int) -> list[int]:
+    # a plain GIF decoder: the code width grows as soon as the table is full for the current width
+    clear_code, end_code = 1 << code_size, (1 << code_size) + 1
+    value = int.from_bytes(data, 'little')
+    position, bits = 0, code_size + 1
+    table, previous, indices = {}, None, []
+    while True:
+        code = (value >> position) & ((1 << bits) - 1)
+        position += bits
+        if code == clear_code:
+            table = {index: [index] for index in range(clear_code)}
+            bits, previous = code_size + 1, None
+            continue
+        if code == end_code:
+            return indices
+
+        entry = table[code] if code in table else table[previous] + table[previous][:1]
+        if previous is not None:
+            table[len(table) + 2] = table[previous] + entry[:1]
+            if len(table) + 2 == 1 << bits and bits < 12:
+                bits += 1
+        indices.extend(entry)
+        previous = code
+
+
+class TestRender:
+
+    def test_records_frames_of_blocks_and_strip(self, recording):
+        assert recording.blocks.shape == (40, 10, 5, 3)
+        assert recording.strip.shape == (40, 571, 3)
+        assert numpy.allclose(recording.times, (numpy.arange(40) + 0.5) / 20)
+
+    def test_blocks_are_frames_of_the_effect(self, recording):
+        compiled = layout.load(CONFIG_PATH)
+        geometry = compiled.geometries['default']
+        effect = effects.Twinkle(geometry, led_block.ColorConverter.get_palette(), seed=3, fps=20)
+
+        for blocks in recording.blocks:
+            expected = geometry.block_means(effect.next_frame()).astype(numpy.uint8)
+            assert numpy.array_equal(blocks.reshape(-1, 3), expected)
+
+    def test_seeded_render_is_reproducible(self, recording):
+        second = offline.render(CONFIG_PATH, 'default', led_block.BlockProgram.TWINKLE, duration=2, fps=20, seed=3)
+        assert numpy.array_equal(recording.strip, second.strip)
+
+    def test_renders_faster_than_real_time(self):
+        rendered = offline.render(CONFIG_PATH, 'default', led_block.BlockProgram.SPARKLE, duration=60, seed=1)
+
+        assert len(rendered.times) == 1800
+        assert rendered.wall_time < 6
+
+    def test_renders_region(self):
+        rendered = offline.render(CONFIG_PATH, 'default.bottom', led_block.BlockProgram.FIXED, duration=1,
+                                  colors=[led_block.ColorConverter.get_color(led_block.ColorName.RED)])
+
+        assert rendered.blocks.shape[1:] == (3, 5, 3)
+        assert (rendered.blocks[-1] == [160, 0, 0]).all()
+        assert 'default.bottom' not in led_block.known_blocks
+
+    def test_unknown_block_raises_error(self):
+        with pytest.raises(ValueError):
+            offline.render(CONFIG_PATH, 'unknown', led_block.BlockProgram.FIXED, duration=1)
+
+
+class TestSave:
+
+    def test_npz_contains_all_arrays(self, recording, tmp_path):
+        offline.save(recording, str(tmp_path / 'show.npz'))
+
+        with numpy.load(tmp_path / 'show.npz') as saved:
+            assert numpy.array_equal(saved['blocks'], recording.blocks)
+            assert numpy.array_equal(saved['strip'], recording.strip)
+
+    def test_png_sequence_has_file_per_frame(self, recording, tmp_path):
+        paths = offline.save(recording, str(tmp_path / 'frame.png'), view='strip', scale=2)
+
+        assert len(paths) == 40 and paths[0].endswith('frame-00000.png')
+        with open(paths[7], 'rb') as image:
+            content = image.read()
+        assert struct.unpack('>II', content[16:24]) == (571, 2)
+        rows = numpy.frombuffer(zlib.decompress(content[41:-16]), dtype=numpy.uint8).reshape(2, -1)
+        assert numpy.array_equal(rows[0, 1:].reshape(-1, 3), recording.strip[7])
+
+    def test_gif_frames_decode_to_images(self):
+        images = numpy.random.default_rng(1).integers(0, 5, (2, 60, 90, 1), dtype=numpy.uint8).repeat(3, axis=3) * 50
+
+        content = offline.encode_gif(images, fps=30)
+
+        assert content.startswith(b'GIF89a') and content.endswith(b';')
+        palette, indices = numpy.unique(images[0].reshape(-1, 3), axis=0, return_inverse=True)
+        assert decode_lzw(offline._lzw_compress(indices.astype(numpy.uint8).tobytes(), 3), 3) == \
+            indices.ravel().tolist()
+        assert len(palette) == 5
+
+    def test_unknown_format_raises_error(self, recording, tmp_path):
+        with pytest.raises(ValueError):
+            offline.save(recording, str(tmp_path / 'show.mp4'))
@@ -0,0 +1,98 @@
+import asyncio
+import marshal
+import sys
+
+import pytest
+
+import profiler
+
+
+def busy(count: int) -> int:
+    return sum(range(count))
+
+
+async def busy_steps(count: int) -> int:
+    total = 0
+    for _ in range(count):
+        total += busy(100)
+        await asyncio.sleep(0)
+    return total
+
+
+class Owner:
+    busy = staticmethod(busy)
+
+
+def profiled_functions(result: bytes) -> set[str]:
+    return {function for _, _, function in marshal.loads(result)}
+
+
+class TestCallProfiler:
+
+    def test_profiles_wrapped_function(self):
+        call_profiler = profiler.CallProfiler()
+
+        assert call_profiler.wrap(busy)(10) == 45
+        assert call_profiler.calls == 1
+        assert 'busy' in profiled_functions(call_profiler.result)
+
+    def test_skips_calls_rejected_by_condition(self):
+        call_profiler = profiler.CallProfiler()
+
+        call_profiler.wrap(busy, condition=lambda count: count > 10)(10)
+
+        assert call_profiler.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_profiles_every_step_of_coroutine(self):
+        call_profiler = profiler.CallProfiler()
+
+        assert await call_profiler.wrap(busy_steps)(3) == 3 * busy(100)
+        assert call_profiler.calls == 4
+        assert 'busy' in profiled_functions(call_profiler.result)
+
+
+class TestSampler:
+
+    def test_counts_stacks_containing_target_code(self):
+        target = profiler.Target('test', codes=[sys._getframe().f_code])
+        sampler = profiler.Sampler(target, 0.01, None)
+
+        sampler.sample(0, sys._getframe(), set())
+        sampler.sample(0, sys._getframe().f_back, set())
+
+        assert sampler.samples == 1
+        stack, count = sampler.result.decode().rsplit(' ', 1)
+        assert stack.split(';')[-1].startswith('test_counts_stacks_containing_target_code (test_profiler.py:')
+        assert count == '1\n'
+
+
+@pytest.mark.asyncio
+class TestSession:
+
+    async def test_restores_patched_functions_after_stop(self):
+        session = profiler.Session(profiler.Target('test', patches=[(Owner, 'busy')]),
+                                   profiler.ProfilerMode.CPROFILE, 10)
+
+        session.start()
+        Owner.busy(10)
+        session.stop()
+
+        assert Owner.busy is busy
+        assert session.status['calls'] == 1
+        assert 'busy' in profiled_functions(session.result)
+
+    async def test_stops_after_duration(self):
+        session = profiler.start(profiler.Target('test'), profiler.ProfilerMode.SAMPLING, 1)
+
+        await asyncio.sleep(1.1)
+
+        assert not session.is_running
+        assert session.status['elapsed'] == pytest.approx(1)
+
+    async def test_only_one_session_runs(self):
+        session = profiler.start(profiler.Target('test'), profiler.ProfilerMode.SAMPLING, 1)
+
+        with pytest.raises(RuntimeError):
+            profiler.start(profiler.Target('test'), profiler.ProfilerMode.SAMPLING, 1)
+        session.stop()
@@ -0,0 +1,62 @@
+import pytest
+
+import quality
+
+
+def report_frames(monitor: quality.QualityMonitor, frames: int, misses: int):
+    for index in range(frames):
+        monitor.report_frame('default', 0.1 if index < misses else 0.0, 1 / 30)
+
+
+class TestQualityMonitor:
+
+    def test_counts_frames_later_than_half_an_interval_as_missed(self):
+        monitor = quality.QualityMonitor()
+
+        monitor.report_frame('default', 0.01, 1 / 30)
+        monitor.report_frame('default', 0.02, 1 / 30)
+
+        assert monitor.metrics['matrices']['default'] == {'frames': 2, 'missed_frames': 1, 'rate': 30}
+
+    def test_degrades_one_level_per_window(self):
+        monitor = quality.QualityMonitor()
+
+        for level in (quality.QualityLevel.BACKGROUND_FPS, quality.QualityLevel.INTERPOLATION,
+                      quality.QualityLevel.PREVIEW, quality.QualityLevel.PREVIEW):
+            report_frames(monitor, 30, 10)
+            assert monitor.evaluate() == level
+
+    @pytest.mark.parametrize("cpu, lag", ((0.95, 0.0), (0.1, 0.2)))
+    def test_degrades_on_cpu_load_or_event_loop_lag(self, cpu, lag):
+        monitor = quality.QualityMonitor()
+        assert monitor.evaluate(cpu, lag) == quality.QualityLevel.BACKGROUND_FPS
+
+    def test_restores_only_after_calm_windows(self):
+        monitor = quality.QualityMonitor(restore_windows=3)
+        monitor.evaluate(cpu=1.0)
+        monitor.evaluate(cpu=1.0)
+
+        assert monitor.evaluate(cpu=0.1) == quality.QualityLevel.INTERPOLATION
+        assert monitor.evaluate(cpu=0.1) == quality.QualityLevel.INTERPOLATION
+        assert monitor.evaluate(cpu=0.1) == quality.QualityLevel.BACKGROUND_FPS
+
+    def test_load_between_thresholds_keeps_level(self):
+        monitor = quality.QualityMonitor(restore_windows=1)
+        monitor.evaluate(cpu=1.0)
+
+        assert monitor.evaluate(cpu=0.8) == quality.QualityLevel.BACKGROUND_FPS
+
+    def test_throttles_lower_priorities_first(self):
+        monitor = quality.QualityMonitor()
+        monitor.level = quality.QualityLevel.BACKGROUND_FPS
+
+        assert monitor.frame_divider(0, 1) == 2
+        assert monitor.frame_divider(1, 1) == 1
+        assert monitor.interpolation_steps(10) == 10
+
+    def test_reduces_interpolation_and_preview_rate_on_higher_levels(self):
+        monitor = quality.QualityMonitor()
+        monitor.level = quality.QualityLevel.PREVIEW
+
+        assert monitor.interpolation_steps(10) == 2
+        assert monitor.preview_interval == 1.0
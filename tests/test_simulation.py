@@ -0,0 +1,60 @@
+import numpy
+
+import led_block
+import simulation
+import strip
+
+
+def get_matrix() -> led_block.LedMatrix:
+    return led_block.LedMatrix(strip_obj=strip.Strip(count=24, power_settle=0.5), rows=2, cols=3, blocks=[[
+        led_block.LedBlock(start=0, end=4),
+        led_block.LedBlock(start=4, end=8),
+        led_block.LedBlock(start=8, end=12),
+    ], [
+        led_block.LedBlock(start=12, end=16),
+        led_block.LedBlock(start=16, end=20),
+        led_block.LedBlock(start=20, end=24),
+    ]])
+
+
+class TestSimulation:
+
+    def test_hour_long_show_is_fast_forwarded(self):
+        matrix = get_matrix()
+
+        async def start():
+            await matrix.run_program(led_block.BlockProgram.FADING)
+
+        run = simulation.Simulation(record=False)
+        run.run(start, duration=3600)
+
+        # the strip is switched on within the first second, afterwards fading shows a frame every 0.2 seconds
+        assert 17990 <= run.frame_count <= 18000
+        assert run.wall_time < 60
+
+    def test_frames_are_recorded_with_virtual_time(self):
+        matrix = get_matrix()
+        matrix.fps = 10
+
+        async def start():
+            await matrix.run_program(led_block.BlockProgram.TWINKLE, seed=3)
+
+        frames = simulation.Simulation().run(start, duration=2)
+
+        assert frames[0].time >= 0.5  # power settle time of the strip
+        assert numpy.allclose(numpy.diff([frame.time for frame in frames[:10]]), 0.1)
+        assert all(frame.strip == 'default' and frame.pixels.shape == (24, 3) for frame in frames)
+
+    def test_seeded_show_is_reproducible(self):
+        def record():
+            matrix = get_matrix()
+
+            async def start():
+                await matrix.run_program(led_block.BlockProgram.SPARKLE, seed=7)
+
+            return simulation.Simulation().run(start, duration=3)
+
+        first, second = record(), record()
+
+        assert len(first) == len(second)
+        assert all((one.pixels == other.pixels).all() for one, other in zip(first, second))
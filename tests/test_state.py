@@ -0,0 +1,79 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+import clock
+import state
+
+
+@pytest.fixture
+def store(tmp_path) -> state.StateStore:
+    states = {'default': {'program': {'program': 'twinkle', 'seed': 3}, 'layers': []}}
+    store = state.StateStore(delay=0.5)
+    store.open(str(tmp_path / 'state.json'), lambda: states)
+    yield store
+    store.close()
+
+
+@pytest.mark.asyncio
+class TestStateStore:
+
+    async def test_flush_writes_collected_state(self, store):
+        await store.flush()
+        assert store.load() == {'default': {'program': {'program': 'twinkle', 'seed': 3}, 'layers': []}}
+
+    async def test_flush_leaves_no_temporary_file(self, store, tmp_path):
+        await store.flush()
+        assert os.listdir(tmp_path) == ['state.json']
+
+    async def test_changes_are_written_once_after_delay(self, store):
+        for _ in range(5):
+            store.mark_changed()
+
+        await clock.current.sleep(0.4)
+        assert store.writes == 0
+
+        await clock.current.sleep(0.2)
+        await store._task  # the file is written in a thread
+        assert store.writes == 1
+
+    async def test_change_during_write_is_written_afterwards(self, store, monkeypatch):
+        states, writing, finish = {'v': 1}, threading.Event(), threading.Event()
+        store.open(store._path, lambda: dict(states))
+        write = store._write
+
+        def slow_write(path: str, content: str):
+            writing.set()
+            finish.wait(5)
+            write(path, content)
+
+        monkeypatch.setattr(store, '_write', slow_write)
+        store.mark_changed()
+        await clock.current.sleep(0.6)
+        await asyncio.to_thread(writing.wait, 5)
+
+        states['v'] = 2
+        store.mark_changed()
+        finish.set()
+        await store._task
+
+        assert store.writes == 2
+        assert store.load() == {'v': 2}
+
+    async def test_missing_file_is_empty_state(self, tmp_path):
+        store = state.StateStore()
+        store.open(str(tmp_path / 'missing.json'), dict)
+        assert store.load() == {}
+
+    async def test_broken_file_is_empty_state(self, store, tmp_path):
+        (tmp_path / 'state.json').write_text('{"default": ', encoding='utf-8')
+        assert store.load() == {}
+
+    async def test_closed_store_writes_nothing(self, store, tmp_path):
+        store.close()
+        store.mark_changed()
+        await store.flush()
+
+        assert not (tmp_path / 'state.json').exists()
@@ -1,8 +1,10 @@
 import asyncio
 
+import numpy
 import pydantic
 import pytest
 
+import clock
 import strip
 
 
@@ -27,4 +29,204 @@ class TestStrip:
 
         await asyncio.gather(test_strip.run_tests(), _check_colored_after_1_second(test_strip))
 
-        assert is_called
\ No newline at end of file
+        assert is_called
+
+    @pytest.mark.asyncio
+    async def test_calibrate_shows_test_colors(self):
+        shown = []
+        test_strip = strip.Strip(count=10)
+        strip.frame_listeners.append(lambda shown_strip: shown.append(shown_strip.pixels[0].tolist()))
+        try:
+            await test_strip.calibrate(samples=2, hold=0)
+        finally:
+            strip.frame_listeners.pop()
+
+        assert shown == [[0, 255, 0]] * 2 + [[255, 0, 0]] * 2 + [[0, 0, 255]] * 2 + [[255, 255, 255]] * 2 + [[0, 0, 0]]
+        assert not test_strip.is_on
+
+    @pytest.mark.asyncio
+    async def test_calibrate_reports_max_fps(self):
+        test_strip = strip.Strip(count=600, power_settle=0)
+
+        report = await test_strip.calibrate(samples=3, hold=0)
+
+        assert report['samples'] == 12
+        assert report['wire_milliseconds'] == pytest.approx(18.08)
+        assert 0 < report['max_fps'] <= 1000 / 18.08
+        assert test_strip.max_fps == report['max_fps']
+
+    def test_set_pixels_colors_given_leds(self):
+        test_strip = strip.Strip()
+
+        test_strip.set_pixels(numpy.array([3, 1]), numpy.array([[10, 20, 30], [40, 50, 60]], dtype=numpy.uint8))
+        test_strip.update_strip()
+
+        assert test_strip._strip[1] == (40, 50, 60)
+        assert test_strip._strip[3] == (10, 20, 30)
+
+    def test_set_pixels_writes_driver_buffer_in_pixel_order(self):
+        test_strip = strip.Strip(count=2, type='neopixel.GRB')
+
+        test_strip.set_pixels(numpy.array([1]), numpy.array([[10, 20, 30]], dtype=numpy.uint8))
+        test_strip.update_strip()
+
+        assert test_strip.pixels[1].tolist() == [20, 10, 30]
+        assert bytes(test_strip.strip._post_brightness_buffer) == bytes([0, 0, 0, 20, 10, 30])
+
+    def test_set_pixels_applies_gamma_and_brightness(self):
+        test_strip = strip.Strip(count=1, type='neopixel.RGB', gamma=2.0, brightness=0.5)
+
+        test_strip.set_pixels(numpy.array([0]), numpy.array([[255, 128, 0]], dtype=numpy.uint8))
+
+        assert test_strip.pixels[0].tolist() == [128, 32, 0]
+
+    def test_global_brightness_dims_all_strips(self, monkeypatch):
+        monkeypatch.setattr(strip, 'global_brightness', 1.0)
+        test_strip = strip.Strip(count=1, type='neopixel.RGB', brightness=0.5)
+
+        strip.set_global_brightness(0.5)
+        test_strip.set_pixels(numpy.array([0]), numpy.array([[200, 100, 0]], dtype=numpy.uint8))
+
+        assert test_strip.pixels[0].tolist() == [50, 25, 0]
+
+    def test_rgbw_strip_extracts_white(self):
+        test_strip = strip.Strip(count=1, type='neopixel.GRBW', bytes_per_pixel=4)
+
+        test_strip.set_pixels(numpy.array([0]), numpy.array([[200, 150, 100]], dtype=numpy.uint8))
+
+        assert test_strip.pixels[0].tolist() == [50, 100, 0, 100]
+
+    def test_float_colors_are_rounded_without_dithering(self):
+        test_strip = strip.Strip(count=1, type='neopixel.RGB')
+
+        test_strip.set_pixels(numpy.array([0]), numpy.array([[10.4, 10.6, 300.0]], dtype=numpy.float32))
+
+        assert test_strip.pixels[0].tolist() == [10, 11, 255]
+
+    def test_frame_is_shown_complete_with_update_strip(self):
+        test_strip = strip.Strip(count=4, type='neopixel.RGB')
+        pixels, shown_pixels = test_strip.pixels, test_strip.shown_pixels
+
+        test_strip.set_colors((10, 20, 30), start_index=0, length=2)
+        assert not test_strip.shown_pixels.any()
+
+        test_strip.set_colors((40, 50, 60), start_index=2, length=2)
+        test_strip.update_strip()
+
+        assert test_strip.shown_pixels.tolist() == [[10, 20, 30]] * 2 + [[40, 50, 60]] * 2
+        assert bytes(test_strip.strip._post_brightness_buffer) == test_strip.shown_pixels.tobytes()
+        assert test_strip.pixels is pixels and test_strip.shown_pixels is shown_pixels
+
+    def test_dithering_shows_levels_between_8_bit_values_on_average(self):
+        test_strip = strip.Strip(count=2, type='neopixel.RGB', dithering=True)
+        colors = numpy.array([[0.25, 10.5, 255.0], [3.0, 0.0, 0.0]], dtype=numpy.float32)
+
+        shown = numpy.zeros((2, 3))
+        for _ in range(4):
+            test_strip.set_pixels(numpy.array([1, 0]), colors)
+            shown += test_strip.pixels
+
+        assert (shown / 4).tolist() == [[3.0, 0.0, 0.0], [0.25, 10.5, 255.0]]
+
+    def test_type_has_to_match_bytes_per_pixel(self):
+        with pytest.raises(pydantic.ValidationError):
+            strip.Strip(type='neopixel.GRBW', bytes_per_pixel=3)
+
+    @pytest.mark.asyncio
+    async def test_switch_off_clears_all_pixels(self):
+        test_strip = strip.Strip(count=3, power_settle=0)
+        test_strip.set_colors((10, 20, 30), start_index=0, length=3)
+
+        await test_strip.switch_off()
+
+        assert not test_strip.pixels.any()
+
+    def test_unknown_pin_is_rejected(self):
+        with pytest.raises(pydantic.ValidationError):
+            strip.Strip(gpio='board.D99')
+
+    def test_unknown_type_is_rejected(self):
+        with pytest.raises(pydantic.ValidationError):
+            strip.Strip(type='neopixel.XYZ')
+
+    @pytest.mark.asyncio
+    async def test_switch_on_only_waits_remaining_settle_time(self):
+        test_strip = strip.Strip(power_settle=0.3)
+        test_strip.power_on()
+        await asyncio.sleep(0.2)
+
+        started = clock.current.time()
+        await test_strip.switch_on()
+
+        assert test_strip.is_on
+        assert clock.current.time() - started == pytest.approx(0.1)
+
+
+class TestPowerLimit:
+
+    @staticmethod
+    def show_white(test_strip: strip.Strip):
+        test_strip.set_colors((255, 255, 255), start_index=0, length=test_strip.count)
+        test_strip.update_strip()
+
+    def test_current_is_estimated_from_the_frame(self):
+        test_strip = strip.Strip(count=10, milliamps_per_channel=20, idle_milliamps=1)
+
+        self.show_white(test_strip)
+
+        assert test_strip.power_metrics['milliamps'] == pytest.approx(610)
+        assert test_strip.power_metrics['limited_frames'] == 0
+
+    def test_frame_over_strip_budget_is_dimmed(self):
+        test_strip = strip.Strip(count=10, milliamps_per_channel=20, idle_milliamps=1, max_milliamps=310)
+
+        self.show_white(test_strip)
+
+        metrics = test_strip.power_metrics
+        assert metrics['requested_milliamps'] == pytest.approx(610)
+        assert metrics['milliamps'] <= 310
+        assert metrics['limited_frames'] == 1
+        assert test_strip.shown_pixels.max() == 127
+
+    def test_dimming_does_not_compound_over_repeated_frames(self):
+        test_strip = strip.Strip(count=10, milliamps_per_channel=20, idle_milliamps=1, max_milliamps=310)
+        self.show_white(test_strip)
+
+        # every frame is over the budget, only the first LED is written again
+        shown = []
+        for _ in range(5):
+            test_strip.set_colors((255, 255, 255), start_index=0, length=1)
+            test_strip.update_strip()
+            shown.append(test_strip.shown_pixels.copy())
+
+        assert all(numpy.array_equal(frame, shown[0]) for frame in shown)
+        assert shown[0].min() == 127
+        assert test_strip.pixels.min() == 255
+
+    def test_strips_share_budget_of_power_supply(self):
+        supply = strip.PowerSupply(name='main', max_milliamps=700)
+        first = strip.Strip(identifier='first', count=10, gpio='board.D13', power_gpio='board.D18',
+                            power_supply='main')
+        second = strip.Strip(identifier='second', count=10, gpio='board.D12', power_gpio='board.D17',
+                             power_supply='main')
+        first.set_power_supply(supply)
+        second.set_power_supply(supply)
+
+        for _ in range(2):
+            self.show_white(first)
+            self.show_white(second)
+
+        # both request the same current, so both get the same share whichever shows its frame first
+        assert first.power_metrics['milliamps'] == second.power_metrics['milliamps']
+        assert numpy.array_equal(first.shown_pixels, second.shown_pixels)
+        assert supply.milliamps <= 700
+        assert supply.metrics['requested_milliamps'] == pytest.approx(1220)
+
+    def test_power_supply_dims_every_strip_by_the_same_factor(self):
+        supply = strip.PowerSupply(name='main', max_milliamps=500)
+
+        assert supply.share('first', 400) == pytest.approx(400)
+        assert supply.share('second', 400) == pytest.approx(250)
+        assert supply.share('first', 600) == pytest.approx(300)
+        assert supply.share('second', 0) == 0
+        assert supply.share('first', 600) == pytest.approx(500)
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+import clock
+import effects
+import led_block
+import strip
+import sync
+
+
+async def start_pair(leader_states: dict, applied: list, skew: float = 5.0) -> tuple[sync.SyncNode, sync.SyncNode]:
+    leader = sync.SyncNode()
+    await leader.start(sync.SyncSettings(role='leader', port=0, interval=1.0), lambda: leader_states, None)
+
+    async def apply(states: dict):
+        applied.append(states)
+
+    # the clock of the follower is some seconds ahead
+    follower = sync.SyncNode(wall_time=lambda: clock.current.wall_time() + skew)
+    await follower.start(sync.SyncSettings(role='follower', port=leader.port, interval=1.0), dict, apply)
+    return leader, follower
+
+
+@pytest.mark.asyncio
+class TestSyncNode:
+
+    async def test_follower_measures_offset_to_leader(self):
+        leader, follower = await start_pair({}, [])
+        try:
+            await asyncio.sleep(0.5)
+
+            assert follower.is_synchronized
+            assert follower.offset == pytest.approx(-5.0)
+            assert follower.time() == pytest.approx(leader.time())
+            assert leader.metrics['followers'] == 1
+        finally:
+            await follower.stop()
+            await leader.stop()
+
+    async def test_follower_is_not_synchronized_before_first_sample(self):
+        follower = sync.SyncNode()
+
+        await follower.start(sync.SyncSettings(role='follower', port=9, interval=1.0), dict, None)
+        try:
+            assert follower.role == sync.SyncRole.FOLLOWER
+            assert not follower.is_synchronized
+        finally:
+            await follower.stop()
+
+    async def test_leader_sends_state_and_changes(self):
+        states, applied = {'default': {'program': {'program': 'twinkle', 'seed': 3, 'started': 12.5}}}, []
+        leader, follower = await start_pair(states, applied)
+        try:
+            await asyncio.sleep(0.5)
+            assert applied[-1] == states
+
+            states['default'] = {'program': {'program': 'sparkle', 'seed': 1, 'started': 13.0}}
+            await asyncio.sleep(0.15)
+            assert applied[-1] == states
+        finally:
+            await follower.stop()
+            await leader.stop()
+
+    async def test_whole_state_is_sent_again_after_interval(self):
+        applied = []
+        leader, follower = await start_pair({'default': {}}, applied)
+        try:
+            await asyncio.sleep(0.5)
+            received = follower.states_received
+
+            await asyncio.sleep(1.05)
+
+            assert follower.states_received == received + 1
+        finally:
+            await follower.stop()
+            await leader.stop()
+
+    async def test_broken_datagrams_are_ignored(self):
+        leader, follower = await start_pair({}, [])
+        try:
+            leader.receive({'type': 'pong', 'sent': 'x'}, ('127.0.0.1', 1))
+            follower.receive({'type': 'pong', 'time': 1.0}, ('127.0.0.1', 1))
+            follower.receive({'type': 'state', 'blocks': []}, ('127.0.0.1', 1))
+
+            assert not follower.is_synchronized
+            assert follower.states_received == 0
+        finally:
+            await follower.stop()
+            await leader.stop()
+
+
+@pytest.mark.asyncio
+class TestSynchronizedRendering:
+
+    @staticmethod
+    def get_matrix() -> led_block.LedMatrix:
+        return led_block.LedMatrix(strip_obj=strip.Strip(power_settle=0), name='synchronized', fps=20, blocks=[
+            [led_block.LedBlock(start=0, end=5), led_block.LedBlock(start=5, end=10)],
+        ])
+
+    @pytest.fixture
+    def leader(self, monkeypatch) -> sync.SyncNode:
+        # rendering only depends on the timeline of the node
+        node = sync.SyncNode()
+        node.settings = sync.SyncSettings(role='leader')
+        monkeypatch.setattr(sync, 'node', node)
+        return node
+
+    async def test_effect_shows_the_frame_of_the_shared_timeline(self, leader):
+        matrix = self.get_matrix()
+        started = leader.time() - 10.0
+
+        await matrix.run_program(led_block.BlockProgram.TWINKLE, seed=1, started=started)
+        await asyncio.sleep(1.01)
+
+        # frames are shown at the frame times of the timeline, the start is rounded to one of them
+        assert matrix._effect.frame_number - 1 == int(leader.time() * 20) - round(started * 20)
+        assert matrix.state['program']['started'] == started
+        matrix._deactivate()
+
+    async def test_late_frames_are_skipped(self, leader, monkeypatch):
+        matrix = self.get_matrix()
+        rendered = []
+        render_frame = led_block.LedMatrix._render_frame
+
+        def slow_render_frame(self, steps: int = 1):
+            rendered.append(steps)
+            render_frame(self, steps)
+            clock.current.now += 0.12  # the frame takes more than two frame intervals
+
+        monkeypatch.setattr(led_block.LedMatrix, '_render_frame', slow_render_frame)
+        await matrix.run_program(led_block.BlockProgram.TWINKLE, seed=1, started=leader.time())
+        await asyncio.sleep(1.0)
+
+        assert max(rendered) > 1
+        assert abs(matrix._effect.time - (leader.time() - matrix._started)) <= 0.15
+        matrix._deactivate()
+
+    async def test_layers_are_aligned_to_their_start(self, leader):
+        matrix = self.get_matrix()
+        started = leader.time() - 3.0
+
+        await matrix.add_layer(led_block.BlockProgram.SPARKLE, seed=2, started=started)
+        await asyncio.sleep(0.51)
+
+        layer = matrix._layers.layers[0]
+        assert layer.started == started
+        assert layer.effect.frame_number - 1 == int(leader.time() * 20) - round(started * 20)
+        matrix.clear_layers()
+
+    async def test_effect_started_later_is_not_moved_back(self, leader):
+        effect = effects.Twinkle(self.get_matrix().geometry, led_block.ColorConverter.get_palette(), seed=1)
+        effect.advance(50)
+
+        sync.align(effect, leader.time(), leader.time(), 1)
+
+        assert effect.frame_number == 50
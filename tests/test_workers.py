@@ -0,0 +1,224 @@
+import multiprocessing.shared_memory
+import os
+import signal
+import time
+
+import numpy
+import pytest
+
+import effects
+import expressions
+import workers
+
+
+def get_geometry() -> effects.Geometry:
+    return effects.Geometry([
+        [(0, 4), (8, 4), (8, 12)],
+        [(12, 16), (20, 16), (20, 24)],
+    ])
+
+
+PALETTE = numpy.array([[255, 0, 0], [0, 0, 255]], dtype=numpy.float32)
+
+SOURCE = 'hue = u / 4 + x / 3 + t; value = r'
+
+
+def create_effect(seed: int = 1) -> expressions.ExpressionEffect:
+    return expressions.ExpressionEffect(get_geometry(), PALETTE, seed=seed, expression=SOURCE)
+
+
+@pytest.fixture(scope='module')
+def pool() -> workers.RenderPool:
+    pool = workers.RenderPool(processes=2)
+    yield pool
+    pool.close()
+
+
+class TestWorkerEffect:
+
+    def test_renders_the_same_frames_as_in_process(self, pool):
+        effect, reference = pool.wrap(create_effect()), create_effect()
+
+        try:
+            assert isinstance(effect, workers.WorkerEffect)
+            for _ in range(10):
+                assert effect.wait(5)
+                assert numpy.array_equal(effect.next_frame(), reference.next_frame())
+            assert effect.is_remote
+            assert effect.time == reference.time
+        finally:
+            effect.close()
+
+    def test_skipped_frames_are_passed_on(self, pool):
+        effect, reference = pool.wrap(create_effect()), create_effect()
+        effect.advance(7)
+        reference.advance(7)
+
+        try:
+            for _ in range(6):
+                assert effect.wait(5, steps=3)
+                assert numpy.array_equal(effect.next_frame(3), reference.next_frame(3))
+            assert effect.frame_number == reference.frame_number == 25
+        finally:
+            effect.close()
+
+    def test_frames_are_read_from_shared_memory(self, pool):
+        effect = pool.wrap(create_effect())
+
+        try:
+            frames = [effect.next_frame() for _ in range(effect.depth) if effect.wait(5)]
+            assert all(not frame.flags.owndata for frame in frames)
+            assert len({frame.__array_interface__['data'][0] for frame in frames}) == effect.depth
+        finally:
+            effect.close()
+
+    def test_first_frames_are_black_until_the_worker_rendered_them(self, pool):
+        effect = pool.wrap(create_effect())
+
+        try:
+            assert not effect.next_frame().any()
+            assert effect.frame_number == 1
+        finally:
+            effect.close()
+
+    def test_slow_worker_shows_the_last_frame_again(self, pool, monkeypatch):
+        effect, reference = pool.wrap(create_effect()), create_effect()
+
+        try:
+            effect.wait(5)
+            frame = effect.next_frame().copy()
+            reference.next_frame()
+
+            monkeypatch.setattr(effect._worker, 'ready', lambda effect_id, timeout=0.0: False)
+            for _ in range(3):
+                assert numpy.array_equal(effect.next_frame(), frame)
+                reference.next_frame()
+            assert effect.is_remote
+
+            # the frames asked for before are late, the next ones are in time again
+            monkeypatch.undo()
+            assert effect.wait(5)
+            effect.next_frame()
+            reference.next_frame()
+            for _ in range(3):
+                assert effect.wait(5)
+                assert numpy.array_equal(effect.next_frame(), reference.next_frame())
+        finally:
+            effect.close()
+
+    def test_lost_worker_is_replaced_by_the_local_effect(self):
+        pool = workers.RenderPool(processes=1)
+        effect, reference = pool.wrap(create_effect()), create_effect()
+
+        try:
+            for _ in range(3):
+                effect.next_frame()
+                reference.next_frame()
+
+            pool._workers[0].process.kill()
+            pool._workers[0].process.join()
+
+            for _ in range(3):
+                assert numpy.array_equal(effect.next_frame(), reference.next_frame())
+            assert not effect.is_remote
+        finally:
+            effect.close()
+            pool.close()
+
+    def test_close_releases_the_shared_memory(self, pool):
+        effect = pool.wrap(create_effect())
+        effect.next_frame()
+        name = effect._memory.name
+
+        effect.close()
+
+        with pytest.raises(FileNotFoundError):
+            multiprocessing.shared_memory.SharedMemory(name=name)
+
+
+class TestWorker:
+
+    def test_effect_released_before_it_was_attached_is_rendered_locally(self):
+        pool = workers.RenderPool(processes=1)
+        effect = pool.wrap(create_effect())
+
+        try:
+            worker = pool._workers[0]
+            worker.add(-1, create_effect(), 'released', effect.depth)
+            worker.request(-1, 0, 1)
+            assert worker.ready(-1, 5)
+            assert worker.receive(-1) is None
+            worker.remove(-1)
+
+            assert effect.wait(5)
+            effect.next_frame()
+            assert effect.is_remote
+            assert worker.is_alive
+        finally:
+            effect.close()
+            pool.close()
+
+    def test_effect_bigger_than_the_pipe_buffer_is_added_without_waiting_for_the_worker(self):
+        pool = workers.RenderPool(processes=1)
+        effect = pool.wrap(create_effect())
+        worker = pool._workers[0]
+        big_effect = create_effect()
+        big_effect.padding = numpy.zeros(1000000, dtype=numpy.float32)
+
+        os.kill(worker.process.pid, signal.SIGSTOP)
+        try:
+            started = time.perf_counter()
+            worker.add(-1, big_effect, effect._memory.name, effect.depth + 1)
+            worker.request(-1, 0, 1)
+            assert time.perf_counter() - started < 0.5
+        finally:
+            os.kill(worker.process.pid, signal.SIGCONT)
+
+        try:
+            assert worker.ready(-1, 5)
+            assert worker.receive(-1) == 0
+        finally:
+            worker.remove(-1)
+            effect.close()
+            pool.close()
+
+
+class TestRenderPool:
+
+    def test_effects_are_spread_over_the_workers(self, pool):
+        created = [pool.wrap(create_effect(seed)) for seed in range(3)]
+
+        try:
+            assert pool.workers == 2
+            assert sorted(worker.load for worker in pool._workers) == [1, 2]
+        finally:
+            for effect in created:
+                effect.close()
+
+    @pytest.mark.asyncio
+    async def test_workers_are_started_in_a_thread(self):
+        pool = workers.RenderPool(processes=1)
+        effect = create_effect()
+
+        try:
+            # no process is spawned on the event loop, the first effect is rendered in the main process meanwhile
+            assert pool.wrap(effect) is effect
+            await pool._start_task
+            assert pool.workers == 1
+
+            wrapped = pool.wrap(create_effect())
+            assert isinstance(wrapped, workers.WorkerEffect)
+            wrapped.close()
+        finally:
+            pool.close()
+
+    def test_without_processes_effects_stay_in_process(self):
+        effect = create_effect()
+
+        assert workers.RenderPool(processes=0).wrap(effect) is effect
+
+    def test_effects_which_cannot_be_sent_stay_in_process(self, pool):
+        effect = effects.Twinkle(get_geometry(), PALETTE, seed=1)
+        effect.render = lambda time: numpy.zeros((effect.geometry.led_count, 3), dtype=numpy.float32)
+
+        assert pool.wrap(effect) is effect
@@ -0,0 +1,315 @@
+import asyncio
+import collections
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.reduction
+import multiprocessing.shared_memory
+import os
+import pickle
+import queue
+import threading
+import typing
+
+import numpy
+
+import effects
+
+# frames rendered ahead of the shown one, a worker has this many frame intervals to render a frame in time
+PIPELINE_DEPTH = 3
+
+# a worker not stopping within this time is terminated
+TIMEOUT = 1.0
+
+
+def _attach(name: str, depth: int, led_count: int) -> tuple[multiprocessing.shared_memory.SharedMemory, numpy.ndarray]:
+    memory = multiprocessing.shared_memory.SharedMemory(name=name, create=False)
+    return memory, numpy.ndarray((depth, led_count, 3), dtype=numpy.float32, buffer=memory.buf)
+
+
+def _serve(connection: multiprocessing.connection.Connection):
+    # runs in the worker process: renders the frames asked for into the slots of the shared buffers
+    rendering: dict[int, tuple[effects.Effect, multiprocessing.shared_memory.SharedMemory, numpy.ndarray]] = {}
+    while (message := connection.recv()) is not None:
+        match message:
+            case ('add', effect_id, effect, name, depth):
+                # the effect may have been closed and its memory released before the worker got to it
+                try:
+                    rendering[effect_id] = (effect, *_attach(name, depth, effect.geometry.led_count))
+                except OSError as error:
+                    print(f'Attaching {type(effect).__name__} failed in worker {os.getpid()}: {error!r}')
+                    effect.close()
+                    connection.send((effect_id, None))
+            case ('render', effect_id, _, _) if effect_id not in rendering:
+                connection.send((effect_id, None))
+            case ('render', effect_id, slot, steps):
+                effect, _, frames = rendering[effect_id]
+                try:
+                    frames[slot] = effect.next_frame(steps)
+                except Exception as error:  # pylint: disable=broad-except
+                    print(f'Rendering {type(effect).__name__} failed in worker {os.getpid()}: {error!r}')
+                    slot = None
+                connection.send((effect_id, slot))
+            case ('remove', effect_id) if effect_id in rendering:
+                effect, memory, frames = rendering.pop(effect_id)
+                del frames
+                memory.close()
+                effect.close()
+
+    for effect, memory, frames in rendering.values():
+        del frames
+        memory.close()
+        effect.close()
+
+
+class Worker:
+    # a process rendering the effects assigned to it, replies of all its effects come back over one pipe;
+    # the messages are pickled right away but written by a thread of their own, a pickled effect is bigger
+    # than the pipe buffer and writing it waits until the worker has imported everything and reads
+    def __init__(self, context: multiprocessing.context.BaseContext):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), name='render worker', daemon=True)
+        self.process.start()
+        child.close()
+        self._replies: dict[int, collections.deque] = {}
+        self._outbox: queue.SimpleQueue = queue.SimpleQueue()
+        self._sender = threading.Thread(target=self._send_all, name='render worker sender', daemon=True)
+        self._sender.start()
+
+    def _send(self, message: typing.Optional[tuple]):
+        self._outbox.put(multiprocessing.reduction.ForkingPickler.dumps(message))
+
+    def _send_all(self):
+        # a lost worker is noticed by the render loop, the remaining messages are dropped
+        while (data := self._outbox.get()) is not None:
+            try:
+                self.connection.send_bytes(data)
+            except OSError:
+                return
+
+    @property
+    def load(self) -> int:
+        return len(self._replies)
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def add(self, effect_id: int, effect: effects.Effect, name: str, depth: int):
+        self._send(('add', effect_id, effect, name, depth))
+        self._replies[effect_id] = collections.deque()
+
+    def request(self, effect_id: int, slot: int, steps: int):
+        self._send(('render', effect_id, slot, steps))
+
+    def ready(self, effect_id: int, timeout: float = 0.0) -> bool:
+        # collects the replies which arrived, the render loop does not wait for a slow worker, only a worker which
+        # exited is lost
+        replies = self._replies[effect_id]
+        while self.connection.poll(0.0 if replies else timeout):
+            other_id, slot = self.connection.recv()
+            if other_id in self._replies:
+                self._replies[other_id].append(slot)
+
+        if not replies and not self.is_alive:
+            raise EOFError(f'Render worker {self.process.pid} exited')
+        return bool(replies)
+
+    def receive(self, effect_id: int) -> typing.Optional[int]:
+        # the slot of the oldest frame asked for, None if the worker could not render it
+        return self._replies[effect_id].popleft()
+
+    def remove(self, effect_id: int):
+        if self._replies.pop(effect_id, None) is not None and self.is_alive:
+            self._send(('remove', effect_id))
+
+    def stop(self):
+        self._send(None)
+        self._outbox.put(None)
+        self.process.join(TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self._sender.join()
+        self.connection.close()
+
+
+class WorkerEffect(effects.Effect):
+    # renders an effect in a worker process a few frames ahead, the frames are read from shared memory in place,
+    # so the main loop only composites and shows them, a frame not rendered in time shows the one before again
+    def __init__(self, effect: effects.Effect, worker: Worker, effect_id: int, depth: int = PIPELINE_DEPTH):
+        super().__init__(effect.geometry, effect.palette, effect.seed, effect.fps)
+        self.effect = effect  # takes over if the worker gets lost
+        self.depth = depth
+        self._worker, self._effect_id = worker, effect_id
+        # a slot more than frames in flight, the shown frame is not overwritten by the next ones
+        self._memory = multiprocessing.shared_memory.SharedMemory(
+            create=True, size=max((depth + 1) * effect.geometry.led_count * 3 * 4, 1))
+        self._frames = numpy.ndarray((depth + 1, effect.geometry.led_count, 3), dtype=numpy.float32,
+                                     buffer=self._memory.buf)
+        self._black = numpy.zeros((effect.geometry.led_count, 3), dtype=numpy.float32)
+        self._shown: typing.Optional[int] = None
+        self._requested = 0
+        self._last_requested = effect.frame_number - 1
+        self._in_flight: collections.deque = collections.deque()
+        try:
+            worker.add(effect_id, effect, self._memory.name, depth + 1)
+        except Exception:
+            self._release()
+            raise
+
+    @property
+    def is_remote(self) -> bool:
+        return self._worker is not None
+
+    def render(self, time: float) -> numpy.ndarray:
+        return self.effect.render(time)
+
+    def next_frame(self, steps: int = 1) -> numpy.ndarray:
+        if self._worker is None:
+            return self._render_locally(steps)
+
+        try:
+            # the newest frame arrived which is not ahead of this one, the frames are asked for at the frame numbers
+            # they are expected to be shown at, so a constant rate renders the same frames as without a worker
+            rendered = self._receive(self.frame_number + steps - 1)
+            if rendered:
+                self._request(self.frame_number + 2 * steps - 1, steps)
+        except (OSError, EOFError) as error:
+            print(f'Render worker lost, rendering {type(self.effect).__name__} in the main process: {error}')
+            rendered = False
+
+        if not rendered:
+            self._detach()
+            return self._render_locally(steps)
+
+        self.frame_number += steps
+        return self._black if self._shown is None else self._frames[self._shown]
+
+    def wait(self, timeout: float, steps: int = 1) -> bool:
+        # waits until the next frame arrived, for a start outside of the render loop, which shows black until then
+        if self._worker is None:
+            return True
+        self._request(self.frame_number + steps - 1, steps)
+        return self._worker.ready(self._effect_id, timeout)
+
+    def _receive(self, frame_number: int) -> bool:
+        # False if the worker could not render a frame
+        while self._in_flight and self._in_flight[0] <= frame_number and self._worker.ready(self._effect_id):
+            self._in_flight.popleft()
+            if (slot := self._worker.receive(self._effect_id)) is None:
+                return False
+            self._shown = slot
+        return True
+
+    def _request(self, frame_number: int, steps: int):
+        # keeps the pipeline filled from the given frame on, a frame skipped in between is passed on with the steps
+        while len(self._in_flight) < self.depth:
+            requested = max(self._last_requested + steps, frame_number)
+            self._worker.request(self._effect_id, self._requested % (self.depth + 1),
+                                 requested - self._last_requested)
+            self._in_flight.append(requested)
+            self._requested += 1
+            self._last_requested = requested
+
+    def _render_locally(self, steps: int) -> numpy.ndarray:
+        # continues at the current time, an effect keeping state like particles starts over from its seed
+        self.effect.advance(self.frame_number + steps - 1 - self.effect.frame_number)
+        self.frame_number += steps
+        return self.effect.next_frame()
+
+    def _detach(self):
+        if self._worker is not None:
+            self._worker.remove(self._effect_id)
+            self._worker = None
+        self._release()
+
+    def _release(self):
+        if self._memory is None:
+            return
+        self._frames, self._shown = None, None
+        try:
+            self._memory.close()
+        except BufferError:
+            pass  # a frame still in use keeps the mapping until it is gone
+        self._memory.unlink()
+        self._memory = None
+
+    def close(self):
+        self._detach()
+        self.effect.close()
+
+
+class RenderPool:
+    # worker processes for effects opting in with in_worker, by default one per core besides the one running
+    # the server; spawning a process blocks, so the event loop starts them in a thread before they are used
+    def __init__(self, processes: int = None, depth: int = PIPELINE_DEPTH):
+        self.processes = 0
+        self.depth = depth
+        self.configure(processes)
+        self._context = multiprocessing.get_context('spawn')
+        self._workers: list[Worker] = []
+        self._effect_ids = itertools.count()
+        self._is_starting = False
+        self._start_task: asyncio.Task = None
+
+    def configure(self, processes: int = None):
+        # effects already running keep their workers, further ones are assigned to the remaining ones
+        self.processes = max((os.cpu_count() or 1) - 1, 1) if processes is None else processes
+
+    @property
+    def workers(self) -> int:
+        return len(self._workers)
+
+    def wrap(self, effect: effects.Effect) -> effects.Effect:
+        if self.processes <= 0:
+            return effect
+
+        try:
+            return WorkerEffect(effect, self._get_worker(), next(self._effect_ids), self.depth)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as error:
+            print(f'Rendering {type(effect).__name__} in the main process: {error}')
+            return effect
+
+    async def start(self):
+        # effects created meanwhile are rendered in the main process
+        self._remove_lost()
+        if self._is_starting or len(self._workers) >= self.processes:
+            return
+
+        self._is_starting = True
+        try:
+            self._workers.extend(await asyncio.to_thread(self._spawn, self.processes - len(self._workers)))
+        finally:
+            self._is_starting = False
+
+    def _spawn(self, count: int) -> list[Worker]:
+        return [Worker(self._context) for _ in range(count)]
+
+    def _remove_lost(self):
+        for worker in [worker for worker in self._workers if not worker.is_alive]:
+            worker.stop()
+            self._workers.remove(worker)
+
+    def _get_worker(self) -> Worker:
+        self._remove_lost()
+        if len(self._workers) < self.processes and not self._is_starting:
+            try:
+                self._start_task = asyncio.get_running_loop().create_task(self.start(), name='start render workers')
+            except RuntimeError:
+                # without an event loop nothing else waits for the spawned processes
+                self._workers.extend(self._spawn(self.processes - len(self._workers)))
+
+        if not self._workers:
+            raise OSError('The render workers are not started yet')
+        return min(self._workers[:self.processes], key=lambda worker: worker.load)
+
+    def close(self):
+        if self._start_task:
+            self._start_task.cancel()
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+
+pool = RenderPool()